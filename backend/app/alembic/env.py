@@ -5,7 +5,15 @@ from alembic import context
 from sqlalchemy import engine_from_config, pool
 
 from alembic_utils.replaceable_entity import register_entities
-from app.sql_functions import avg_last_24
+from app.sql_functions import (
+    avg_last_24,
+    sensor_data_bump_watermark,
+    sensor_data_watermark_insert,
+    sensor_data_watermark_update,
+    sensor_data_watermark_delete,
+    user_cache_invalidate,
+    user_cache_invalidate_trigger,
+)
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -81,7 +89,15 @@ def run_migrations_online():
             context.run_migrations()
 
 
-register_entities([avg_last_24])
+register_entities([
+    avg_last_24,
+    sensor_data_bump_watermark,
+    sensor_data_watermark_insert,
+    sensor_data_watermark_update,
+    sensor_data_watermark_delete,
+    user_cache_invalidate,
+    user_cache_invalidate_trigger,
+])
 
 if context.is_offline_mode():
     run_migrations_offline()
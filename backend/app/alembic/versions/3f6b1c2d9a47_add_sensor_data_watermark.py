@@ -0,0 +1,80 @@
+"""Add sensor_data_watermark table and triggers
+
+Revision ID: 3f6b1c2d9a47
+Revises: 5c950b20564c
+Create Date: 2024-09-20 14:12:08.411932
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+from alembic_utils.pg_function import PGFunction
+
+from app.sql_functions import (
+    sensor_data_watermark_insert,
+    sensor_data_watermark_update,
+    sensor_data_watermark_delete,
+)
+
+# revision identifiers, used by Alembic.
+revision = '3f6b1c2d9a47'
+down_revision = '5c950b20564c'
+branch_labels = None
+depends_on = None
+
+# Definition at this revision, the one in app.sql_functions has changed since
+sensor_data_bump_watermark = PGFunction(
+    schema="public",
+    signature="sensor_data_bump_watermark()",
+    definition="""
+		RETURNS trigger
+		LANGUAGE plpgsql AS
+		$func$
+		BEGIN
+			IF TG_OP IN ('INSERT', 'UPDATE') THEN
+				INSERT INTO sensor_data_watermark (equipment_id, seq)
+				SELECT changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (SELECT DISTINCT equipment_id FROM new_rows) changed
+				ON CONFLICT (equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+			END IF;
+			IF TG_OP IN ('UPDATE', 'DELETE') THEN
+				INSERT INTO sensor_data_watermark (equipment_id, seq)
+				SELECT changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (SELECT DISTINCT equipment_id FROM old_rows) changed
+				ON CONFLICT (equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+			END IF;
+			RETURN NULL;
+		END
+		$func$;
+	""")
+
+
+def upgrade():
+    op.execute('CREATE SEQUENCE sensor_data_ingest_seq')
+    op.create_table('sensor_data_watermark',
+    sa.Column('equipment_id', sqlmodel.sql.sqltypes.AutoString(length=255), nullable=False),
+    sa.Column('seq', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('equipment_id')
+    )
+
+    # Every equipment already registered starts with its own watermark
+    op.execute("""
+        INSERT INTO sensor_data_watermark (equipment_id, seq)
+        SELECT equipment_id, nextval('sensor_data_ingest_seq')
+        FROM (SELECT DISTINCT equipment_id FROM sensor_data) existing
+    """)
+
+    op.create_entity(sensor_data_bump_watermark)
+    op.create_entity(sensor_data_watermark_insert)
+    op.create_entity(sensor_data_watermark_update)
+    op.create_entity(sensor_data_watermark_delete)
+
+
+def downgrade():
+    op.drop_entity(sensor_data_watermark_delete)
+    op.drop_entity(sensor_data_watermark_update)
+    op.drop_entity(sensor_data_watermark_insert)
+    op.drop_entity(sensor_data_bump_watermark)
+
+    op.drop_table('sensor_data_watermark')
+    op.execute('DROP SEQUENCE sensor_data_ingest_seq')
@@ -0,0 +1,115 @@
+"""Add sensor_data_hour_watermark table
+
+Revision ID: 4e8a2b7c9d16
+Revises: 707dd7779844
+Create Date: 2024-10-21 10:37:52.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+from alembic_utils.pg_function import PGFunction
+
+# revision identifiers, used by Alembic.
+revision = '4e8a2b7c9d16'
+down_revision = '707dd7779844'
+branch_labels = None
+depends_on = None
+
+# Definition at this revision, the one in app.sql_functions has changed since
+sensor_data_bump_watermark = PGFunction(
+    schema="public",
+    signature="sensor_data_bump_watermark()",
+    definition="""
+		RETURNS trigger
+		LANGUAGE plpgsql AS
+		$func$
+		BEGIN
+			IF TG_OP IN ('INSERT', 'UPDATE') THEN
+				INSERT INTO sensor_data_watermark (equipment_id, seq)
+				SELECT changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (SELECT DISTINCT equipment_id FROM new_rows) changed
+				ON CONFLICT (equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+				INSERT INTO sensor_data_hour_watermark (hour, equipment_id, seq)
+				SELECT changed.hour, changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (
+					SELECT DISTINCT date_trunc('hour', "timestamp") AS hour, equipment_id
+					FROM new_rows
+				) changed
+				ORDER BY changed.hour, changed.equipment_id
+				ON CONFLICT (hour, equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+			END IF;
+			IF TG_OP IN ('UPDATE', 'DELETE') THEN
+				INSERT INTO sensor_data_watermark (equipment_id, seq)
+				SELECT changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (SELECT DISTINCT equipment_id FROM old_rows) changed
+				ON CONFLICT (equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+				INSERT INTO sensor_data_hour_watermark (hour, equipment_id, seq)
+				SELECT changed.hour, changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (
+					SELECT DISTINCT date_trunc('hour', "timestamp") AS hour, equipment_id
+					FROM old_rows
+				) changed
+				ORDER BY changed.hour, changed.equipment_id
+				ON CONFLICT (hour, equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+			END IF;
+			DELETE FROM sensor_data_hour_watermark
+			WHERE hour < localtimestamp - '7 days'::INTERVAL;
+			RETURN NULL;
+		END
+		$func$;
+	""")
+
+# Previous definition, only stamping the equipment ids
+sensor_data_bump_watermark_equipment_only = PGFunction(
+    schema="public",
+    signature="sensor_data_bump_watermark()",
+    definition="""
+		RETURNS trigger
+		LANGUAGE plpgsql AS
+		$func$
+		BEGIN
+			IF TG_OP IN ('INSERT', 'UPDATE') THEN
+				INSERT INTO sensor_data_watermark (equipment_id, seq)
+				SELECT changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (SELECT DISTINCT equipment_id FROM new_rows) changed
+				ON CONFLICT (equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+			END IF;
+			IF TG_OP IN ('UPDATE', 'DELETE') THEN
+				INSERT INTO sensor_data_watermark (equipment_id, seq)
+				SELECT changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (SELECT DISTINCT equipment_id FROM old_rows) changed
+				ON CONFLICT (equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+			END IF;
+			RETURN NULL;
+		END
+		$func$;
+	""")
+
+
+def upgrade():
+    op.create_table('sensor_data_hour_watermark',
+    sa.Column('hour', sa.DateTime(), nullable=False),
+    sa.Column('equipment_id', sqlmodel.sql.sqltypes.AutoString(length=255), nullable=False),
+    sa.Column('seq', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('hour', 'equipment_id')
+    )
+
+    # The hours of the last week already registered start with their own watermark
+    op.execute("""
+        INSERT INTO sensor_data_hour_watermark (hour, equipment_id, seq)
+        SELECT hour, equipment_id, nextval('sensor_data_ingest_seq')
+        FROM (
+            SELECT DISTINCT date_trunc('hour', "timestamp") AS hour, equipment_id
+            FROM sensor_data
+            WHERE "timestamp" >= localtimestamp - '7 days'::INTERVAL
+        ) existing
+    """)
+
+    op.replace_entity(sensor_data_bump_watermark)
+
+
+def downgrade():
+    op.replace_entity(sensor_data_bump_watermark_equipment_only)
+
+    op.drop_table('sensor_data_hour_watermark')
@@ -0,0 +1,29 @@
+"""Add BRIN index on sensor_data.timestamp
+
+Revision ID: 7d2e4a8c1b90
+Revises: 3f6b1c2d9a47
+Create Date: 2024-09-27 10:41:52.108273
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2e4a8c1b90'
+down_revision = '3f6b1c2d9a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_sensor_data_timestamp_brin',
+        'sensor_data',
+        ['timestamp'],
+        unique=False,
+        postgresql_using='brin'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_sensor_data_timestamp_brin', table_name='sensor_data')
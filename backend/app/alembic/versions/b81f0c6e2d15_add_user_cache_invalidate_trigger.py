@@ -0,0 +1,26 @@
+"""Add user_cache_invalidate trigger
+
+Revision ID: b81f0c6e2d15
+Revises: 7d2e4a8c1b90
+Create Date: 2024-10-02 16:08:33.572914
+
+"""
+from alembic import op
+
+from app.sql_functions import user_cache_invalidate, user_cache_invalidate_trigger
+
+# revision identifiers, used by Alembic.
+revision = 'b81f0c6e2d15'
+down_revision = '7d2e4a8c1b90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_entity(user_cache_invalidate)
+    op.create_entity(user_cache_invalidate_trigger)
+
+
+def downgrade():
+    op.drop_entity(user_cache_invalidate_trigger)
+    op.drop_entity(user_cache_invalidate)
@@ -0,0 +1,114 @@
+"""Stop pruning the hour watermarks in the sensor_data triggers
+
+Revision ID: c2f7d19b8e54
+Revises: a6c3f0d84e21
+Create Date: 2024-10-25 16:02:11.804392
+
+"""
+from alembic import op
+from alembic_utils.pg_function import PGFunction
+
+# revision identifiers, used by Alembic.
+revision = 'c2f7d19b8e54'
+down_revision = 'a6c3f0d84e21'
+branch_labels = None
+depends_on = None
+
+# The old hours are deleted by the workers (app.core.cache.prune_hour_watermarks)
+# rather than by every statement writing to sensor_data
+sensor_data_bump_watermark = PGFunction(
+    schema="public",
+    signature="sensor_data_bump_watermark()",
+    definition="""
+		RETURNS trigger
+		LANGUAGE plpgsql AS
+		$func$
+		BEGIN
+			IF TG_OP IN ('INSERT', 'UPDATE') THEN
+				INSERT INTO sensor_data_watermark (equipment_id, seq)
+				SELECT changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (SELECT DISTINCT equipment_id FROM new_rows) changed
+				ORDER BY changed.equipment_id
+				ON CONFLICT (equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+				INSERT INTO sensor_data_hour_watermark (hour, equipment_id, seq)
+				SELECT changed.hour, changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (
+					SELECT DISTINCT date_trunc('hour', "timestamp") AS hour, equipment_id
+					FROM new_rows
+				) changed
+				ORDER BY changed.hour, changed.equipment_id
+				ON CONFLICT (hour, equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+			END IF;
+			IF TG_OP IN ('UPDATE', 'DELETE') THEN
+				INSERT INTO sensor_data_watermark (equipment_id, seq)
+				SELECT changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (SELECT DISTINCT equipment_id FROM old_rows) changed
+				ORDER BY changed.equipment_id
+				ON CONFLICT (equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+				INSERT INTO sensor_data_hour_watermark (hour, equipment_id, seq)
+				SELECT changed.hour, changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (
+					SELECT DISTINCT date_trunc('hour', "timestamp") AS hour, equipment_id
+					FROM old_rows
+				) changed
+				ORDER BY changed.hour, changed.equipment_id
+				ON CONFLICT (hour, equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+			END IF;
+			RETURN NULL;
+		END
+		$func$;
+	""")
+
+# Previous definition
+sensor_data_bump_watermark_pruning = PGFunction(
+    schema="public",
+    signature="sensor_data_bump_watermark()",
+    definition="""
+		RETURNS trigger
+		LANGUAGE plpgsql AS
+		$func$
+		BEGIN
+			IF TG_OP IN ('INSERT', 'UPDATE') THEN
+				INSERT INTO sensor_data_watermark (equipment_id, seq)
+				SELECT changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (SELECT DISTINCT equipment_id FROM new_rows) changed
+				ORDER BY changed.equipment_id
+				ON CONFLICT (equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+				INSERT INTO sensor_data_hour_watermark (hour, equipment_id, seq)
+				SELECT changed.hour, changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (
+					SELECT DISTINCT date_trunc('hour', "timestamp") AS hour, equipment_id
+					FROM new_rows
+				) changed
+				ORDER BY changed.hour, changed.equipment_id
+				ON CONFLICT (hour, equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+			END IF;
+			IF TG_OP IN ('UPDATE', 'DELETE') THEN
+				INSERT INTO sensor_data_watermark (equipment_id, seq)
+				SELECT changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (SELECT DISTINCT equipment_id FROM old_rows) changed
+				ORDER BY changed.equipment_id
+				ON CONFLICT (equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+				INSERT INTO sensor_data_hour_watermark (hour, equipment_id, seq)
+				SELECT changed.hour, changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (
+					SELECT DISTINCT date_trunc('hour', "timestamp") AS hour, equipment_id
+					FROM old_rows
+				) changed
+				ORDER BY changed.hour, changed.equipment_id
+				ON CONFLICT (hour, equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+			END IF;
+			DELETE FROM sensor_data_hour_watermark
+			WHERE hour < localtimestamp - '7 days'::INTERVAL;
+			RETURN NULL;
+		END
+		$func$;
+	""")
+
+
+def upgrade():
+    op.replace_entity(sensor_data_bump_watermark)
+
+
+def downgrade():
+    op.replace_entity(sensor_data_bump_watermark_pruning)
@@ -1,48 +1,114 @@
 import jwt
+import math
+import time
 
-from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import Depends, HTTPException, Request, Response, status
+from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
 from pydantic import ValidationError
 from sqlmodel import Session
-from collections.abc import Generator
+from sqlmodel.ext.asyncio.session import AsyncSession
+from collections.abc import AsyncGenerator, Generator
 from typing import Annotated
 
+from app import async_crud, crud
 from app.core import security
+from app.core.api_keys import ApiKeyEntry, api_key_table
 from app.core.config import settings
-from app.core.db import engine
-from app.models import TokenPayload, User
+from app.core.db import async_engine, engine, read_router
+from app.core.timeouts import set_statement_timeout, statement_timeout_for
+from app.core.user_cache import token_cache
+from app.models import ApiKeyScope, TokenPayload, User
 
 # This file sets up all dependencies for the backend.
 
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/login/access-token"
 )
+# The ingest endpoints also accept an API key instead of the token
+optional_oauth2 = OAuth2PasswordBearer(
+    tokenUrl=f"{settings.API_V1_STR}/login/access-token", auto_error=False
+)
+api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 
-def get_db() -> Generator[Session, None, None]:
+def get_db(request: Request) -> Generator[Session, None, None]:
     with Session(engine) as session:
+        set_statement_timeout(session, statement_timeout_for(request))
+        yield session
+
+
+async def get_async_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    # Objects are still used to build the response after the commit
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        set_statement_timeout(session, statement_timeout_for(request))
+        yield session
+
+
+# After a write, the client reads from the primary until the replicas caught up
+READ_PRIMARY_COOKIE = "read_primary_until"
+
+
+def stick_to_primary(response: Response) -> None:
+    if not read_router.replicas:
+        return
+    response.set_cookie(
+        READ_PRIMARY_COOKIE,
+        str(time.time() + settings.POSTGRES_REPLICA_MAX_LAG_SECONDS),
+        max_age=math.ceil(settings.POSTGRES_REPLICA_MAX_LAG_SECONDS),
+        httponly=True,
+    )
+
+
+def reads_from_primary(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(READ_PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+async def get_async_read_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    # Read-only routes may be served by a replica, see ReadReplicaRouter
+    engine = read_router.choose(prefer_primary=reads_from_primary(request))
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        set_statement_timeout(session, statement_timeout_for(request))
         yield session
 
 
 SessionDependency = Annotated[Session, Depends(get_db)]
+AsyncSessionDependency = Annotated[AsyncSession, Depends(get_async_db)]
+AsyncReadSessionDependency = Annotated[AsyncSession, Depends(get_async_read_db)]
 TokenDependency = Annotated[str, Depends(reusable_oauth2)]
 
 
-def get_current_user(session: SessionDependency, token: TokenDependency) -> User:
+def decode_token(token: str) -> str:
+    """
+    The id of the user the token was issued to.
+    """
+    user_id: str | None = token_cache.get(token)
+    if user_id is not None:
+        return user_id
     try:
-        token_payload = TokenPayload(**jwt.decode(
+        payload = jwt.decode(
             token, 
             settings.SECRET_KEY, 
             algorithms=[security.ALGORITHM]
-        ))
+        )
+        user_id = TokenPayload(**payload).sub
     except (InvalidTokenError, ValidationError):
+        user_id = None
+    if user_id is None:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="User could not be authenticaded",
         )
+    # The signature was checked, only the expiration can change the outcome
+    if "exp" in payload:
+        token_cache.set(token, user_id, ttl=payload["exp"] - time.time())
+    return user_id
 
-    user = session.get(User, token_payload.sub)
+
+def check_user(user: User | None) -> User:
     if not user:
         raise HTTPException(
             status_code=404, 
@@ -56,7 +122,47 @@ def get_current_user(session: SessionDependency, token: TokenDependency) -> User
     return user
 
 
+def get_current_user(session: SessionDependency, token: TokenDependency) -> User:
+    user_id = decode_token(token)
+    return check_user(crud.get_user_by_id(session=session, id=user_id))
+
+
+async def get_current_user_async(session: AsyncSessionDependency, token: TokenDependency) -> User:
+    user_id = decode_token(token)
+    user = await async_crud.get_user_by_id(session=session, id=user_id)
+    # Gives the connection back to the pool (nothing to do on a user cache hit),
+    # the route may use another session, or wait for a query of another request
+    await session.commit()
+    return check_user(user)
+
+
 CurrentUserDependency = Annotated[User, Depends(get_current_user)]
+# For async routes, loads the user without taking a threadpool thread
+AsyncCurrentUserDependency = Annotated[User, Depends(get_current_user_async)]
+
+
+async def get_ingest_client(
+    session: AsyncSessionDependency,
+    api_key: Annotated[str | None, Depends(api_key_header)],
+    token: Annotated[str | None, Depends(optional_oauth2)],
+) -> User | ApiKeyEntry:
+    """
+    The user, or the API key of a machine client (e.g. a sensor gateway) acting
+    for its owner. API keys are checked in memory, without decoding a token nor
+    loading the user.
+    """
+    if api_key:
+        return api_key_table.verify(api_key, ApiKeyScope.SENSOR_DATA_WRITE.value)
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return await get_current_user_async(session, token)
+
+
+AsyncIngestClientDependency = Annotated[User | ApiKeyEntry, Depends(get_ingest_client)]
 
 
 def get_current_active_superuser(user: CurrentUserDependency) -> User:
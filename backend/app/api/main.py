@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from app.api.routes import sensor_data, auth, users, utils
+from app.api.routes import api_keys, sensor_data, auth, users, utils
 
 # Sets up all routers, one for each endpoint prefix for our application
 # DO NOT write the routes manually in this file
@@ -9,3 +9,4 @@ api_router.include_router(auth.router, tags=["login"])
 api_router.include_router(users.router, prefix="/users", tags=["users"])
 api_router.include_router(utils.router, prefix="/utils", tags=["utils"])
 api_router.include_router(sensor_data.router, prefix="/sensor-data", tags=["sensor-data"])
+api_router.include_router(api_keys.router, prefix="/api-keys", tags=["api-keys"])
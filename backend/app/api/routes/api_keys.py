@@ -0,0 +1,82 @@
+import uuid
+from typing import Any
+
+from fastapi import APIRouter, HTTPException
+from sqlmodel import col, func, select
+
+from app import crud
+from app.api.deps import CurrentUserDependency, SessionDependency
+from app.core.api_keys import api_key_table
+from app.models import ApiKey, ApiKeyCreate, ApiKeyCreated, ApiKeyPublic, ApiKeysPublic
+
+router = APIRouter()
+
+
+def reload_api_keys(session: SessionDependency) -> None:
+    # This worker sees the change right away, the others on their next refresh
+    api_key_table.load(crud.get_active_api_key_entries(session=session))
+
+
+@router.get("/", response_model=ApiKeysPublic)
+def read_api_keys(
+    session: SessionDependency,
+    current_user: CurrentUserDependency,
+    skip: int = 0,
+    limit: int = 100,
+) -> Any:
+    """
+    Retrieve the API keys of the current user, revoked ones included.
+    """
+    count_statement = (
+        select(func.count())
+        .select_from(ApiKey)
+        .where(ApiKey.owner_id == current_user.id)
+    )
+    count = session.exec(count_statement).one()
+
+    statement = (
+        select(ApiKey)
+        .where(ApiKey.owner_id == current_user.id)
+        .order_by(col(ApiKey.created_at).desc())
+        .offset(skip)
+        .limit(limit)
+    )
+    api_keys = session.exec(statement).all()
+
+    return ApiKeysPublic(data=api_keys, count=count)
+
+
+@router.post("/", response_model=ApiKeyCreated)
+def create_api_key(
+    *,
+    session: SessionDependency,
+    current_user: CurrentUserDependency,
+    api_key_in: ApiKeyCreate,
+) -> Any:
+    """
+    Create an API key acting for the current user. The key is only returned in
+    this response.
+    """
+    (api_key, key) = crud.create_api_key(
+        session=session, owner=current_user, api_key_in=api_key_in
+    )
+    reload_api_keys(session)
+    return ApiKeyCreated.model_validate(api_key, update={"key": key})
+
+
+@router.delete("/{id}", response_model=ApiKeyPublic)
+def revoke_api_key(
+    session: SessionDependency, current_user: CurrentUserDependency, id: uuid.UUID
+) -> Any:
+    """
+    Revoke an API key.
+    """
+    api_key = session.get(ApiKey, id)
+    if not api_key:
+        raise HTTPException(status_code=404, detail="API key not found")
+    if not current_user.is_superuser and (api_key.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    if api_key.revoked_at is None:
+        api_key = crud.revoke_api_key(session=session, api_key=api_key)
+        reload_api_keys(session)
+    return api_key
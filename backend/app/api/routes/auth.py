@@ -1,7 +1,8 @@
+import time
 from datetime import timedelta
 from typing import Annotated, Any
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import HTMLResponse
 from fastapi.security import OAuth2PasswordRequestForm
 
@@ -9,12 +10,12 @@ from app import crud
 from app.api.deps import CurrentUserDependency, SessionDependency, get_current_active_superuser
 from app.core import security
 from app.core.config import settings
+from app.core.rate_limit import client_address, login_limiter
 from app.core.security import get_password_hash
 from app.models import Message, NewPassword, Token, UserPublic
 from app.utils import (
     generate_password_reset_token,
     generate_reset_password_email,
-    send_email,
     verify_password_reset_token,
 )
 
@@ -24,18 +25,26 @@ router = APIRouter()
 
 @router.post("/login/access-token")
 def login_access_token(
-    session: SessionDependency, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
+    request: Request,
+    session: SessionDependency,
+    form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
 ) -> Token:
     """
     Logs an user by email and password. The return is a OAuth2 token.
 
     The returned token can be used by further requests, store it safely.
+    Too many attempts from the same address or for the same account are
+    answered with a 429.
     """
+    login_limiter.check(client_address(request), form_data.username)
+
+    start = time.perf_counter()
     user = crud.authenticate(
         session=session, 
         email=form_data.username, 
         password=form_data.password
     )
+    login_limiter.observe_check(time.perf_counter() - start)
 
     # Purposely not explaining if the credentials are incorrect or if the user does not exist.
     if (not user) or (not user.is_active):
@@ -78,7 +87,8 @@ def recover_password(email: str, session: SessionDependency) -> Message:
     email_content = generate_reset_password_email(
         email_to=user.email, email=email, token=token
     )
-    send_email(
+    crud.enqueue_email(
+        session=session,
         email_to=user.email,
         subject=email_content.subject,
         html_content=email_content.html_content,
@@ -0,0 +1,40 @@
+import hmac
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.api.deps import (
+    SessionDependency,
+    get_current_active_superuser,
+    get_current_user,
+)
+from app.core import metrics
+from app.core.config import settings
+
+# Mounted at the root, not under API_V1_STR, where Prometheus expects it
+router = APIRouter()
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics", include_in_schema=False)
+def read_prometheus_metrics(
+    session: SessionDependency, authorization: str | None = Header(None)
+) -> PlainTextResponse:
+    """
+    Metrics of all the workers of the host, in the Prometheus text format.
+    Scraped with the METRICS_TOKEN, or by a superuser.
+    """
+    if not (
+        settings.METRICS_TOKEN
+        and hmac.compare_digest(authorization or "", f"Bearer {settings.METRICS_TOKEN}")
+    ):
+        (scheme, _, token) = (authorization or "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        get_current_active_superuser(get_current_user(session, token))
+
+    return PlainTextResponse(
+        metrics.generate_latest(metrics.collect_all(settings.METRICS_MULTIPROC_DIR)),
+        media_type=CONTENT_TYPE_LATEST,
+    )
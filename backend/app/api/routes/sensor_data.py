@@ -1,112 +1,162 @@
-from datetime import date, datetime
+import time
+from datetime import date, datetime, timedelta
 import uuid
-from typing import Any, List
+from typing import Any
 
-from app import crud
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from app import async_crud
+from fastapi import APIRouter, HTTPException, Request, Response, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from sqlmodel import select
-from sqlalchemy import func, sql, and_
-
-from app.api.deps import SessionDependency, CurrentUserDependency
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.api.deps import (
+    AsyncCurrentUserDependency,
+    AsyncIngestClientDependency,
+    AsyncReadSessionDependency,
+    AsyncSessionDependency,
+    stick_to_primary,
+)
+from app.core import metrics
+from app.core.cache import line_chart_cache, truncate_to_hour
+from app.core.config import settings
+from app.core.cost_guard import check_bar_chart_cost, estimate_bar_chart_cost
+from app.core.encoded import (
+    EncodedBody,
+    encode_and_cache,
+    encoded_response,
+    encoded_response_cache,
+)
+from app.core.etag import is_not_modified, make_etag, not_modified, set_etag
+from app.core.single_flight import dashboard_single_flight
+from app.core.timeouts import cancel_on_disconnect
 from app.models import (
     OptionList,
-    Option,
     SensorData, 
     SensorDataCreate,
     SensorDataPublic, 
     SensorDataListPublic, 
     SensorDataUpdate, 
     SensorDataCsvImportStatus,
+    SensorDataAccuracy,
     SensorDataLineChartDashboard,
-    SensorDataLineChartDashboardItem,
-    SensorDataBarChartDashboardItem,
     SensorDataDashboardFetch,
     SensorDataDashboardList,
     Message
 )
-from app.utils import read_csv_sensor_data_file, get_data_interval
+from app.utils import parse_csv_sensor_data_file, get_data_interval
 
 router = APIRouter()
 
 
 @router.get("/", response_model=SensorDataListPublic)
-def read_sensors_data(
-    session: SessionDependency, skip: int = 0, limit: int = 100
+async def read_sensors_data(
+    session: AsyncReadSessionDependency, 
+    request: Request, 
+    skip: int = 0, 
+    limit: int = 100
 ) -> Any:
     """
     Retrieve all sensors data.
     """
 
-    count_query = select(func.count()).select_from(SensorData)
-    count = session.exec(count_query).one()
+    etag = make_etag("list", await async_crud.get_data_watermark(session=session), skip, limit)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    async def fetch_page() -> ORJSONResponse:
+        count = await async_crud.count_sensor_data(session=session)
+
+        # Plain rows serialized straight to JSON, skipping the ORM and the
+        # SensorDataPublic validation (response_model is kept for the docs)
+        sensors = await async_crud.get_sensor_data_rows(session=session, skip=skip, limit=limit)
 
-    query = select(
-        SensorData
-    ).order_by(
-        SensorData.timestamp.desc()
-    ).order_by(
-        SensorData.equipment_id
-    ).offset(skip).limit(limit)
-    sensors = session.exec(query).all()
+        response = ORJSONResponse({"data": sensors, "count": count})
+        set_etag(response, etag)
+        return response
 
-    return SensorDataListPublic(data=sensors, count=count)
+    return await cancel_on_disconnect(request, fetch_page())
 
 
 @router.get("/options/equipment", response_model=OptionList)
-def read_equipment_options(
-    session: SessionDependency,
+async def read_equipment_options(
+    session: AsyncReadSessionDependency,
+    request: Request,
 ) -> Any:
     """
     Retrieve unique options for all equipment ids present in the database.
     """
 
-    query = select(
-        SensorData.equipment_id
-    ).select_from(
-        SensorData
-    ).distinct()
-    
-    result = session.exec(query).all()
+    etag = make_etag("options", await async_crud.get_data_watermark(session=session))
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    # Served already encoded while the data doesn't change
+    body = encoded_response_cache.get(etag)
+    if body is None:
+        query = select(
+            SensorData.equipment_id
+        ).select_from(
+            SensorData
+        ).distinct()
+        
+        result = (await session.exec(query)).all()
 
-    options: List[Option] = [
-        Option(row)
-        for row in result
-    ]
+        # Plain dicts, same as OptionList(data=[Option(row) ...])
+        options = [{"value": row, "label": row} for row in result]
+        body = await encode_and_cache(etag, {"data": options})
 
-    return OptionList(data=options)
+    return encoded_response(request, body, etag)
 
 
 @router.get("/{id}", response_model=SensorDataPublic)
-def read_sensor_data(session: SessionDependency, id: uuid.UUID) -> Any:
+async def read_sensor_data(session: AsyncSessionDependency, id: uuid.UUID) -> Any:
     """
     Get sensor data by ID.
 
     Not to be mistaken for the getByEquipmentId function.
     """
-    sensorData = session.get(SensorData, id)
+    sensorData = await async_crud.get_sensor_data_by_id(session=session, id=id)
     if not sensorData:
         raise HTTPException(status_code=404, detail="Sensor data not found")
     return sensorData
 
 
 @router.get("/equipment/{equipment_id}", response_model=SensorDataListPublic)
-def read_sensor_data_by_equipment(session: SessionDependency, equipment_id: str) -> Any:
+async def read_sensor_data_by_equipment(
+    session: AsyncSessionDependency, 
+    request: Request, 
+    equipment_id: str
+) -> Any:
     """
     Get all sensor data emmited by a a specific equipment.
     """
 
-    sensors = crud.get_sensor_data_by_equipment_id(session=session, equipment_id=equipment_id)
-    return SensorDataListPublic(data=sensors, count=len(sensors))
+    watermark = await async_crud.get_data_watermark(session=session, equipment_ids=[equipment_id])
+    etag = make_etag("equipment", equipment_id, watermark)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    sensors = await async_crud.get_sensor_data_rows_by_equipment_id(
+        session=session, equipment_id=equipment_id
+    )
+
+    response = ORJSONResponse({"data": sensors, "count": len(sensors)})
+    set_etag(response, etag)
+    return response
 
 
 @router.post("/dashboard/line-chart", response_model=SensorDataLineChartDashboard)
-def read_sensor_data_for_line_chart(
-    session: SessionDependency,
-    current_user: CurrentUserDependency) -> Any:
+async def read_sensor_data_for_line_chart(
+    session: AsyncReadSessionDependency,
+    request: Request,
+    current_user: AsyncCurrentUserDependency) -> Any:
     """
     Get values from hour to hour from the last day. 
     
     Not required, but can be used to create line graphs to show the average values over time for an equipment.
+
+    Answers 304 to a matching If-None-Match, even though the route is a POST.
     """
     if(not current_user):
         raise HTTPException(
@@ -114,28 +164,64 @@ def read_sensor_data_for_line_chart(
             detail="Not authenticated",
         )
 
-    result = session.execute(
-        sql.text('SELECT * FROM avg_last_24(:current_date, :equipments);'), 
-        {"current_date": datetime.today(), "equipments": []}
+    # The window only moves when a new hour opens
+    now = datetime.today()
+    etag = make_etag(
+        "line-chart", truncate_to_hour(now), await async_crud.get_data_watermark(session=session)
+    )
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    # The shared query takes a connection of its own: with as many requests
+    # waiting for it as connections in the pool, it would never get one
+    await session.commit()
+
+    body = encoded_response_cache.get(etag)
+    if body is not None:
+        return encoded_response(request, body, etag)
+
+    # Same buckets as the avg_last_24 database function, but only the open hour
+    # and the hours that received late data or deletes are recomputed on each
+    # call. The concurrent requests share the encoding too.
+    async def fetch_line_chart() -> EncodedBody:
+        async with AsyncSession(session.bind, info=dict(session.info)) as shared_session:
+            rows = await line_chart_cache.get(
+                lambda begin, end, equipment_ids: async_crud.get_hourly_averages(
+                    session=shared_session, begin=begin, end=end, equipment_ids=equipment_ids
+                ),
+                lambda begin, end: async_crud.get_hour_watermarks(
+                    session=shared_session, begin=begin, end=end
+                ),
+                now=now
+            )
+        return await encode_and_cache(etag, {"data": rows})
+
+    body = await cancel_on_disconnect(
+        request, dashboard_single_flight.do(("line-chart",), fetch_line_chart)
     )
 
-    sensors: List[SensorDataLineChartDashboardItem] = [
-        SensorDataLineChartDashboardItem(row)
-        for row in result.mappings().all()
-    ]
-
-    return SensorDataLineChartDashboard(data=sensors)
+    return encoded_response(request, body, etag)
 
 
 @router.post("/dashboard/bar-chart", response_model=SensorDataDashboardList)
-def read_sensor_data_for_bar_chart(
-    session: SessionDependency,
-    current_user: CurrentUserDependency,
+async def read_sensor_data_for_bar_chart(
+    session: AsyncReadSessionDependency,
+    request: Request,
+    current_user: AsyncCurrentUserDependency,
     fetch_data: SensorDataDashboardFetch) -> Any:
     """
     Get average of values from the specified time period.
     
-    Used for the dashboard bar chart and table.
+    Used for the dashboard bar chart and table. 
+    
+    With accuracy=approximate, averages are computed over a sample of the data, with 
+    the error bound of each average, and count is estimated from the equipment seen
+    in the sample (equipment with little data may be missed), with its relative
+    standard error in count_error_bound. Exact
+    requests too expensive for the database are answered the same way, or rejected
+    with a 400, depending on DASHBOARD_OVER_BUDGET. The accuracy field of the
+    response tells which mode was used.
+
+    Answers 304 to a matching If-None-Match, even though the route is a POST.
     """
     if(not current_user):
         raise HTTPException(
@@ -147,66 +233,105 @@ def read_sensor_data_for_bar_chart(
         (date_interval_begin, date_interval_end) = get_data_interval(fetch_data)
     except ValueError as e: 
         raise HTTPException(status_code=400, detail= " ".join(e.args))
-        
-    count_query = select(
-        func.count(SensorData.equipment_id.distinct())
-    ).select_from(
-        SensorData
-    ).where(
-        and_(
-            SensorData.timestamp > date_interval_begin,
-            SensorData.timestamp <= date_interval_end
-        )
-    )
 
-    count = session.exec(count_query).one()
-
-    query = select(
-        SensorData.equipment_id, 
-        func.avg(SensorData.value).label("avg")
-    ).select_from(
-        SensorData
-    ).where(
-        and_(
-            SensorData.timestamp > date_interval_begin,
-            SensorData.timestamp <= date_interval_end
-        )
+    # Relative intervals move continuously, so they are considered unchanged for
+    # up to a minute. The count covers all equipment, hence the global watermark.
+    etag = make_etag(
+        "bar-chart",
+        fetch_data.model_dump_json(),
+        date_interval_begin.replace(second=0, microsecond=0),
+        date_interval_end.replace(second=0, microsecond=0),
+        await async_crud.get_data_watermark(session=session)
     )
-
-    if(fetch_data.equipment_ids is not None and len(fetch_data.equipment_ids)>0):
-        query = query.where(
-            SensorData.equipment_id.in_(fetch_data.equipment_ids)
-        )
-
-    query = query.group_by(
-        SensorData.equipment_id
-    ).order_by(
-        SensorData.equipment_id
-    ).offset(
-        fetch_data.skip
-    ).limit(
-        fetch_data.limit
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    await session.commit()
+
+    # Identical concurrent requests (e.g. at shift change) share a single query.
+    # Requests too expensive for the database are sampled or rejected, long
+    # ones are split in time slices aggregated in parallel.
+    is_long_interval = (
+        settings.DASHBOARD_PARALLEL_SLICES > 1
+        and date_interval_end - date_interval_begin 
+            > timedelta(hours=settings.DASHBOARD_PARALLEL_MIN_HOURS)
     )
-    
-    result = session.exec(query)
 
-    sensors: List[SensorDataBarChartDashboardItem] = [
-        SensorDataBarChartDashboardItem(row)
-        for row in result.mappings().all()
-    ]
+    async def fetch_bar_chart() -> dict[str, Any]:
+        async with AsyncSession(session.bind, info=dict(session.info)) as shared_session:
+            sample_percent: float | None
+            if fetch_data.accuracy == SensorDataAccuracy.APPROXIMATE:
+                sample_percent = settings.DASHBOARD_APPROXIMATE_SAMPLE_PERCENT
+            else:
+                estimate = await estimate_bar_chart_cost(
+                    session=shared_session,
+                    begin=date_interval_begin,
+                    end=date_interval_end,
+                    equipment_ids=fetch_data.equipment_ids
+                )
+                sample_percent = check_bar_chart_cost(estimate)
+
+            if sample_percent is None and is_long_interval:
+                (count, rows) = await async_crud.get_average_by_equipment_parallel(
+                    session=shared_session,
+                    begin=date_interval_begin,
+                    end=date_interval_end,
+                    slices=settings.DASHBOARD_PARALLEL_SLICES,
+                    equipment_ids=fetch_data.equipment_ids,
+                    skip=fetch_data.skip,
+                    limit=fetch_data.limit
+                )
+                return {"data": rows, "count": count, "accuracy": SensorDataAccuracy.EXACT}
+            if sample_percent is None:
+                (count, rows) = await async_crud.get_average_by_equipment(
+                    session=shared_session,
+                    begin=date_interval_begin,
+                    end=date_interval_end,
+                    equipment_ids=fetch_data.equipment_ids,
+                    skip=fetch_data.skip,
+                    limit=fetch_data.limit
+                )
+                return {"data": rows, "count": count, "accuracy": SensorDataAccuracy.EXACT}
+
+            (count, count_error, rows) = await async_crud.get_sampled_average_by_equipment(
+                session=shared_session,
+                begin=date_interval_begin,
+                end=date_interval_end,
+                percent=sample_percent,
+                equipment_ids=fetch_data.equipment_ids,
+                skip=fetch_data.skip,
+                limit=fetch_data.limit
+            )
+            return {
+                "data": rows, 
+                "count": count, 
+                "accuracy": SensorDataAccuracy.APPROXIMATE,
+                "sample_percent": sample_percent,
+                "count_error_bound": count_error
+            }
+
+    result = await cancel_on_disconnect(
+        request,
+        dashboard_single_flight.do(("bar-chart", fetch_data.model_dump_json()), fetch_bar_chart)
+    )
 
-    return SensorDataDashboardList(data=sensors, count=count)
+    response = ORJSONResponse(result)
+    set_etag(response, etag)
+    return response
 
 
 @router.post("/", response_model=SensorDataPublic)
-def create_sensor_data(
+async def create_sensor_data(
     *, 
-    session: SessionDependency, 
+    session: AsyncSessionDependency, 
+    response: Response,
     sensor_data_create: SensorDataCreate,
-    current_user: CurrentUserDependency
+    current_user: AsyncIngestClientDependency
 ) -> Any:
     """
     Creates a new registry of a Sensor data.
+
+    Gateways can authenticate with an API key with the sensor_data:write scope,
+    in the X-API-Key header, instead of a token.
     """
     if(not current_user):
         raise HTTPException(
@@ -214,25 +339,25 @@ def create_sensor_data(
             detail="Not authenticated",
         )
 
-    sensor_data = SensorData.model_validate(
-        sensor_data_create
+    sensor_data = await async_crud.create_sensor_data(
+        session=session, sensor_create_data=sensor_data_create
     )
-
-    session.add(sensor_data)
-    session.commit()
-    session.refresh(sensor_data)
+    stick_to_primary(response)
     return sensor_data
 
 
 @router.post("/csv", response_model=SensorDataCsvImportStatus)
 async def create_sensor_data_from_csv(
     *, 
-    session: SessionDependency, 
+    session: AsyncSessionDependency, 
+    response: Response,
     sensor_data_csv_file: UploadFile = File(...),
-    current_user: CurrentUserDependency
+    current_user: AsyncIngestClientDependency
 ) -> Any:
     """
     Creates registries of all sensors data present in the csv file.
+
+    Also accepts an API key with the sensor_data:write scope, of a superuser.
     """
     if(not current_user):
         raise HTTPException(
@@ -245,29 +370,40 @@ async def create_sensor_data_from_csv(
             detail="The user doesn't have enough privileges",
         )
 
-    try:
-        sensor_data_create_list = await read_csv_sensor_data_file(sensor_data_csv_file)
-    except ValueError as e: 
-        raise HTTPException(status_code=400, detail= " ".join(e.args))
+    start = time.perf_counter()
+    contents = await sensor_data_csv_file.read()
 
     error_data_list = []
 
-    def validate_sensor_data_or_null(data):
+    def validate_sensor_data_or_null(data: dict[str, Any]) -> SensorData | None:
         try:
             return SensorData.model_validate(data)
         except Exception:
             error_data_list.append(data)
             return None
 
-    sensor_data_create_list = list(
-        filter(
-            lambda x: x != None,
-            map(validate_sensor_data_or_null, sensor_data_create_list)
-        )
+    def parse_and_validate() -> list[SensorData]:
+        sensor_data_create_list = parse_csv_sensor_data_file(contents)
+        return [
+            sensor_data
+            for sensor_data in map(validate_sensor_data_or_null, sensor_data_create_list)
+            if sensor_data is not None
+        ]
+
+    # Parsing and validation are CPU bound, keep them off the event loop
+    try:
+        sensor_data_create_list = await run_in_threadpool(parse_and_validate)
+    except ValueError as e: 
+        raise HTTPException(status_code=400, detail= " ".join(e.args))
+
+    await async_crud.create_sensor_data_bulk(
+        session=session, sensor_data_list=sensor_data_create_list
     )
+    stick_to_primary(response)
 
-    session.bulk_insert_mappings(SensorData, sensor_data_create_list)
-    session.commit()
+    metrics.sensor_data_csv_rows.labels(outcome="imported").inc(len(sensor_data_create_list))
+    metrics.sensor_data_csv_rows.labels(outcome="rejected").inc(len(error_data_list))
+    metrics.sensor_data_csv_import_duration.observe(time.perf_counter() - start)
     
     return SensorDataCsvImportStatus(
         count_success=len(sensor_data_create_list),
@@ -276,9 +412,10 @@ async def create_sensor_data_from_csv(
 
 
 @router.put("/{id}", response_model=SensorDataPublic)
-def update_sensor_data(
+async def update_sensor_data(
     *,
-    session: SessionDependency,
+    session: AsyncSessionDependency,
+    response: Response,
     id: uuid.UUID,
     sensor_data_update: SensorDataUpdate,
 ) -> Any:
@@ -288,21 +425,21 @@ def update_sensor_data(
     Usually, this endpoint should not be called. Invalid registries must not be registered,
     and further updates must be created normally.
     """
-    sensor_data = session.get(SensorData, id)
+    sensor_data = await async_crud.get_sensor_data_by_id(session=session, id=id)
     if not sensor_data:
         raise HTTPException(status_code=404, detail="Sensor data not found")
 
-    update_dict = sensor_data_update.model_dump(exclude_unset=True)
-    sensor_data.sqlmodel_update(update_dict)
-    session.add(sensor_data)
-    session.commit()
-    session.refresh(sensor_data)
+    sensor_data = await async_crud.update_sensor_data(
+        session=session, sensor_data=sensor_data, sensor_data_update=sensor_data_update
+    )
+    stick_to_primary(response)
     return sensor_data
 
 
 @router.delete("/{id}")
-def delete_sensor_data(
-    session: SessionDependency, 
+async def delete_sensor_data(
+    session: AsyncSessionDependency, 
+    response: Response,
     id: uuid.UUID
 ) -> Message:
     """
@@ -311,9 +448,9 @@ def delete_sensor_data(
     Usually, this endpoint should not be called. Invalid registries must not be registered,
     and further updates must be created normally.
     """
-    sensor_data = session.get(SensorData, id)
+    sensor_data = await async_crud.get_sensor_data_by_id(session=session, id=id)
     if not sensor_data:
         raise HTTPException(status_code=404, detail="Sensor data not found")
-    session.delete(sensor_data)
-    session.commit()
+    await async_crud.delete_sensor_data(session=session, sensor_data=sensor_data)
+    stick_to_primary(response)
     return Message(message="Sensor data deleted successfully")
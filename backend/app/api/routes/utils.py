@@ -1,9 +1,22 @@
-from fastapi import APIRouter, Depends
+from typing import Any, Literal
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic.networks import EmailStr
 
-from app.api.deps import get_current_active_superuser
-from app.models import Message
-from app.utils import generate_test_email, send_email
+from app import crud
+from app.api.deps import SessionDependency, get_current_active_superuser
+from app.core import metrics
+from app.core.profiling import Profile, profile_store
+from app.core.slow_queries import slow_query_log
+from app.models import (
+    Message,
+    ProfilePublic,
+    ProfilesPublic,
+    SlowQueriesPublic,
+    SlowQueryPublic,
+)
+from app.utils import generate_test_email
 
 router = APIRouter()
 
@@ -13,14 +26,96 @@ router = APIRouter()
     dependencies=[Depends(get_current_active_superuser)],
     status_code=201,
 )
-def test_email(email_to: EmailStr) -> Message:
+def test_email(session: SessionDependency, email_to: EmailStr) -> Message:
     """
     Test emails.
     """
     email_data = generate_test_email(email_to=email_to)
-    send_email(
+    crud.enqueue_email(
+        session=session,
         email_to=email_to,
         subject=email_data.subject,
         html_content=email_data.html_content,
     )
     return Message(message="Test email sent")
+
+
+@router.get(
+    "/metrics/",
+    dependencies=[Depends(get_current_active_superuser)],
+)
+def read_metrics() -> list[dict[str, Any]]:
+    """
+    Current values of the metrics collected by this worker.
+    """
+    return metrics.collect()
+
+
+@router.get(
+    "/slow-queries/",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=SlowQueriesPublic,
+)
+def read_slow_queries(limit: int = 50) -> Any:
+    """
+    Last statements slower than SLOW_QUERY_THRESHOLD_SECONDS on this worker,
+    newest first, with their plan when SLOW_QUERY_EXPLAIN is on. The plan may
+    still be missing for the latest ones, it's captured in the background.
+    """
+    entries = slow_query_log.entries()
+    return SlowQueriesPublic(
+        data=[SlowQueryPublic.model_validate(entry) for entry in entries[:limit]],
+        count=len(entries),
+    )
+
+
+def _profile_public(profile: Profile, with_stacks: bool) -> ProfilePublic:
+    return ProfilePublic(
+        id=profile.id,
+        recorded_at=profile.recorded_at,
+        method=profile.method,
+        path=profile.path,
+        route=profile.route,
+        status=profile.status,
+        duration_seconds=profile.duration_seconds,
+        samples=profile.samples,
+        db_wait_seconds=profile.db_wait_seconds,
+        statements=profile.statements,
+        breakdown=profile.breakdown(),
+        collapsed_stacks=profile.collapsed_stacks() if with_stacks else None,
+    )
+
+
+@router.get(
+    "/profiles/",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=ProfilesPublic,
+)
+def read_profiles() -> Any:
+    """
+    Requests profiled on this worker, newest first, without their stacks.
+    Send the X-Profile header as a superuser to profile a request.
+    """
+    profiles = profile_store.list()
+    return ProfilesPublic(
+        data=[_profile_public(profile, with_stacks=False) for profile in profiles],
+        count=len(profiles),
+    )
+
+
+@router.get(
+    "/profiles/{id}",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=ProfilePublic,
+)
+def read_profile(id: str, format: Literal["json", "collapsed"] = "json") -> Any:
+    """
+    A request profile, by the id returned in its X-Profile-Id header. The
+    collapsed format is the input of flamegraph.pl and speedscope.
+    """
+    profile = profile_store.get(id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        return PlainTextResponse(profile.collapsed_stacks())
+    return _profile_public(profile, with_stacks=True)
@@ -0,0 +1,300 @@
+import asyncio
+from datetime import datetime
+from typing import Any, cast
+
+from sqlalchemy import CursorResult, Result
+from sqlmodel import col, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core import sampling
+from app.core.api_keys import ApiKeyEntry
+from app.core.user_cache import user_cache
+from app.crud import (
+    ACTIVE_API_KEYS,
+    Query,
+    api_key_entries,
+    average_by_equipment_query,
+    data_watermark_query,
+    detached_user,
+    equipment_count_query,
+    explain_query,
+    hour_watermarks_query,
+    hourly_averages_query,
+    oldest_timestamp_estimate_query,
+    partial_sums_by_equipment_query,
+    rows_as_dicts,
+    sampled_average_by_equipment_query,
+    sensor_data_count_query,
+    sensor_data_rows_by_equipment_query,
+    sensor_data_rows_query,
+)
+from app.models import (
+    SensorData,
+    SensorDataCreate,
+    SensorDataHourWatermark,
+    SensorDataUpdate,
+    User,
+)
+
+# Async counterparts of the sensor data functions in app.crud, used by the
+# sensor data routes so slow queries don't hold a threadpool thread.
+
+
+async def execute(session: AsyncSession, query: Query) -> Result[Any]:
+    (statement, params) = query
+    return await session.execute(statement, params)
+
+
+async def get_user_by_id(*, session: AsyncSession, id: str) -> User | None:
+    data = user_cache.get(id)
+    if data is not None:
+        return await session.merge(detached_user(data), load=False)
+
+    version = user_cache.version
+    user = await session.get(User, id)
+    if user:
+        user_cache.set(id, user.model_dump(), version=version)
+    return user
+
+
+async def get_active_api_key_entries(*, session: AsyncSession) -> list[ApiKeyEntry]:
+    return api_key_entries((await session.exec(ACTIVE_API_KEYS)).all())
+
+
+async def create_sensor_data(
+    *, session: AsyncSession, sensor_create_data: SensorDataCreate
+) -> SensorData:
+    sensor_data = SensorData.model_validate(sensor_create_data)
+    session.add(sensor_data)
+    await session.commit()
+    await session.refresh(sensor_data)
+    return sensor_data
+
+
+async def create_sensor_data_bulk(
+    *, session: AsyncSession, sensor_data_list: list[SensorData]
+) -> None:
+    if not sensor_data_list:
+        return
+    mappings = [sensor_data.model_dump() for sensor_data in sensor_data_list]
+    await session.run_sync(
+        lambda sync_session: sync_session.bulk_insert_mappings(SensorData, mappings)
+    )
+    await session.commit()
+
+
+async def get_sensor_data_by_id(*, session: AsyncSession, id: Any) -> SensorData | None:
+    return await session.get(SensorData, id)
+
+
+async def update_sensor_data(
+    *,
+    session: AsyncSession,
+    sensor_data: SensorData,
+    sensor_data_update: SensorDataUpdate,
+) -> SensorData:
+    update_dict = sensor_data_update.model_dump(exclude_unset=True)
+    sensor_data.sqlmodel_update(update_dict)
+    session.add(sensor_data)
+    await session.commit()
+    await session.refresh(sensor_data)
+    return sensor_data
+
+
+async def delete_sensor_data(*, session: AsyncSession, sensor_data: SensorData) -> None:
+    await session.delete(sensor_data)
+    await session.commit()
+
+
+async def count_sensor_data(*, session: AsyncSession) -> int:
+    return int((await execute(session, sensor_data_count_query())).scalar_one())
+
+
+async def get_sensor_data_rows(
+    *, session: AsyncSession, skip: int = 0, limit: int = 100
+) -> list[dict[str, Any]]:
+    return rows_as_dicts(await execute(session, sensor_data_rows_query(skip, limit)))
+
+
+async def get_sensor_data_rows_by_equipment_id(
+    *, session: AsyncSession, equipment_id: str
+) -> list[dict[str, Any]]:
+    return rows_as_dicts(
+        await execute(session, sensor_data_rows_by_equipment_query(equipment_id))
+    )
+
+
+async def get_hourly_averages(
+    *,
+    session: AsyncSession,
+    begin: datetime,
+    end: datetime,
+    equipment_ids: list[str] | None = None,
+) -> list[tuple[str, datetime, float]]:
+    return list(
+        (
+            await execute(session, hourly_averages_query(begin, end, equipment_ids))
+        ).tuples()
+    )
+
+
+async def get_hour_watermarks(
+    *, session: AsyncSession, begin: datetime, end: datetime
+) -> dict[datetime, int]:
+    rows = (await execute(session, hour_watermarks_query(begin, end))).all()
+    return {hour: int(seq_sum) for (hour, seq_sum) in rows}
+
+
+async def delete_old_hour_watermarks(*, session: AsyncSession, before: datetime) -> int:
+    result = cast(
+        CursorResult[Any],
+        await session.execute(
+            delete(SensorDataHourWatermark).where(
+                col(SensorDataHourWatermark.hour) < before
+            )
+        ),
+    )
+    await session.commit()
+    return result.rowcount
+
+
+async def get_average_by_equipment(
+    *,
+    session: AsyncSession,
+    begin: datetime,
+    end: datetime,
+    equipment_ids: list[str] | None = None,
+    skip: int = 0,
+    limit: int = 100,
+) -> tuple[int, list[dict[str, Any]]]:
+    count = int(
+        (await execute(session, equipment_count_query(begin, end))).scalar_one()
+    )
+    query = average_by_equipment_query(begin, end, equipment_ids, skip, limit)
+    return (count, rows_as_dicts(await execute(session, query)))
+
+
+def split_interval(
+    begin: datetime, end: datetime, slices: int
+) -> list[tuple[datetime, datetime]]:
+    step = (end - begin) / slices
+    bounds = [begin + step * index for index in range(slices)] + [end]
+    return list(zip(bounds[:-1], bounds[1:], strict=True))
+
+
+async def get_average_by_equipment_parallel(
+    *,
+    session: AsyncSession,
+    begin: datetime,
+    end: datetime,
+    slices: int,
+    equipment_ids: list[str] | None = None,
+    skip: int = 0,
+    limit: int = 100,
+) -> tuple[int, list[dict[str, Any]]]:
+    """
+    Same result as get_average_by_equipment, with the interval split in slices
+    aggregated concurrently, each on its own connection of the session's engine.
+
+    Every slice returns (sum, count) per equipment, merged here. Slices cover all
+    the equipment, so the count comes from the same pass, and the equipment filter
+    and the pagination are applied after the merge.
+    """
+    # ALL_TIME starts at datetime.min, the slices start at the oldest data instead
+    oldest = (await execute(session, oldest_timestamp_estimate_query())).scalar()
+    if oldest is not None and begin < oldest < end:
+        # Older rows may have been written since the statistics, the first slice
+        # still begins at begin
+        bounds = split_interval(oldest, end, slices)
+        bounds[0] = (begin, bounds[0][1])
+    else:
+        bounds = split_interval(begin, end, slices)
+    # The slices take connections of their own: with as many requests waiting
+    # for them as connections in the pool, they would never get one
+    await session.commit()
+
+    async def aggregate_slice(slice_begin: datetime, slice_end: datetime) -> list[Any]:
+        async with AsyncSession(session.bind, info=dict(session.info)) as slice_session:
+            query = partial_sums_by_equipment_query(slice_begin, slice_end)
+            return list((await execute(slice_session, query)).all())
+
+    partials = await asyncio.gather(
+        *[
+            aggregate_slice(slice_begin, slice_end)
+            for (slice_begin, slice_end) in bounds
+        ]
+    )
+
+    totals: dict[str, tuple[float, int]] = {}
+    for partial in partials:
+        for equipment_id, value_sum, value_count in partial:
+            (total, count) = totals.get(equipment_id, (0.0, 0))
+            totals[equipment_id] = (total + value_sum, count + value_count)
+
+    selected = sorted(
+        totals if not equipment_ids else set(equipment_ids).intersection(totals)
+    )
+    rows = [
+        {
+            "equipment_id": equipment_id,
+            "avg": totals[equipment_id][0] / totals[equipment_id][1],
+        }
+        for equipment_id in selected[skip : skip + limit]
+    ]
+    return (len(totals), rows)
+
+
+async def get_sampled_average_by_equipment(
+    *,
+    session: AsyncSession,
+    begin: datetime,
+    end: datetime,
+    percent: float,
+    equipment_ids: list[str] | None = None,
+    skip: int = 0,
+    limit: int = 100,
+) -> tuple[int, float, list[dict[str, Any]]]:
+    """
+    Approximation of get_average_by_equipment over percent of the table pages.
+
+    Rows carry the error bound of their average. The count is estimated from the
+    equipment seen in the sample, and returned with its relative standard error.
+    Like get_average_by_equipment_parallel, the equipment filter and the
+    pagination are applied here, the count covers all the equipment.
+    """
+    query = sampled_average_by_equipment_query(begin, end, percent)
+    sampled = (await execute(session, query)).all()
+    (count, count_error) = sampling.estimate_distinct_count(
+        [row.pages for row in sampled], percent
+    )
+
+    rows = [
+        {
+            "equipment_id": row.equipment_id,
+            "avg": row.avg,
+            "error_bound": row.error_bound,
+        }
+        for row in sampled
+        if not equipment_ids or row.equipment_id in equipment_ids
+    ]
+    return (round(count), count_error, rows[skip : skip + limit])
+
+
+async def explain(*, session: AsyncSession, query: Query) -> dict[str, Any]:
+    """
+    The planner's estimated plan of the query, without running it.
+    """
+    connection = await session.connection()
+    (sql, parameters) = explain_query(query, connection.dialect)
+    result = await connection.exec_driver_sql(sql, parameters)
+    plan: dict[str, Any] = result.scalar_one()[0]["Plan"]
+    return plan
+
+
+async def get_data_watermark(
+    *, session: AsyncSession, equipment_ids: list[str] | None = None
+) -> tuple[int, int]:
+    (count, seq_sum) = (
+        await execute(session, data_watermark_query(equipment_ids))
+    ).one()
+    return (count, int(seq_sum))
@@ -0,0 +1,344 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter
+from collections.abc import Callable
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+import httpx
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.benchmarks.results import git, summarize
+from app.core.config import settings
+from app.core.db import engine, init_db
+from app.load_synthetic_data import SyntheticSeries, load
+from app.main import app
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Latency percentiles and throughput of the sensor data endpoints over a seeded
+# dataset of synthetic readings (see app/load_synthetic_data.py). The results are
+# written as JSON, tagged with the commit, so two commits can be compared with
+# --compare.
+#
+# Requests go through the app in-process by default, or to a running server with
+# --base-url. Either way the dataset is seeded in the database of the settings.
+# Usage: python -m app.benchmarks.endpoints --equipment 200 --interval-seconds 60 --days 7
+#        python -m app.benchmarks.endpoints --equipment 2000 --interval-seconds 10 --days 90 \
+#            --keep-data --output before.json
+#        python -m app.benchmarks.endpoints --reuse-data --compare before.json
+
+EQUIPMENT_PREFIX = "benchmark-eq-"
+INGEST_EQUIPMENT_ID = "benchmark-ingest"
+
+
+def count_dataset(session: Session) -> int:
+    return int(
+        session.execute(
+            text("SELECT count(*) FROM sensor_data WHERE equipment_id LIKE :prefix"),
+            params={"prefix": f"{EQUIPMENT_PREFIX}%"},
+        ).scalar_one()
+    )
+
+
+def cleanup(session: Session) -> None:
+    session.execute(
+        text(
+            "DELETE FROM sensor_data WHERE equipment_id LIKE :prefix OR equipment_id = :ingest"
+        ),
+        params={"prefix": f"{EQUIPMENT_PREFIX}%", "ingest": INGEST_EQUIPMENT_ID},
+    )
+    session.commit()
+
+
+def csv_file(rows: int, rng: random.Random) -> bytes:
+    now = datetime.today()
+    lines = ["equipmentId,timestamp,value"]
+    for i in range(rows):
+        timestamp = (now - timedelta(seconds=i)).isoformat()
+        lines.append(f"{INGEST_EQUIPMENT_ID},{timestamp},{rng.uniform(20, 80):.2f}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+# A scenario builds the i-th request: (method, path, keyword arguments of httpx)
+Scenario = Callable[[int], tuple[str, str, dict[str, Any]]]
+
+
+def scenarios(
+    equipment: list[str], days: float, csv_rows: int, rng: random.Random
+) -> dict[str, Scenario]:
+    api = settings.API_V1_STR
+    now = datetime.today()
+
+    def bar_chart(fetch_mode: int, **extra: Any) -> Scenario:
+        body = {"skip": 0, "limit": 100, "fetch_mode": fetch_mode, **extra}
+        return lambda i: (
+            "POST",
+            f"{api}/sensor-data/dashboard/bar-chart",
+            {"json": body},
+        )
+
+    csv_contents = csv_file(csv_rows, rng)
+    # Middle of the seeded period, nothing cached there by the relative modes
+    custom_end = now - timedelta(days=days / 2)
+    return {
+        "list": lambda i: (
+            "GET",
+            f"{api}/sensor-data/",
+            {"params": {"skip": (i % 100) * 100, "limit": 100}},
+        ),
+        "equipment_history": lambda i: (
+            "GET",
+            f"{api}/sensor-data/equipment/{equipment[i % len(equipment)]}",
+            {},
+        ),
+        "equipment_options": lambda i: (
+            "GET",
+            f"{api}/sensor-data/options/equipment",
+            {},
+        ),
+        "line_chart": lambda i: ("POST", f"{api}/sensor-data/dashboard/line-chart", {}),
+        "bar_chart_last_24h": bar_chart(1),
+        "bar_chart_last_48h": bar_chart(2),
+        "bar_chart_last_week": bar_chart(3),
+        "bar_chart_last_month": bar_chart(4),
+        "bar_chart_custom": bar_chart(
+            5,
+            begin_custom_date=(custom_end - timedelta(days=1)).isoformat(),
+            end_custom_date=custom_end.isoformat(),
+        ),
+        "bar_chart_all_time": bar_chart(6),
+        "insert": lambda i: (
+            "POST",
+            f"{api}/sensor-data/",
+            {
+                "json": {
+                    "equipment_id": INGEST_EQUIPMENT_ID,
+                    "value": rng.uniform(20, 80),
+                }
+            },
+        ),
+        "csv_import": lambda i: (
+            "POST",
+            f"{api}/sensor-data/csv",
+            {
+                "files": {
+                    "sensor_data_csv_file": ("benchmark.csv", csv_contents, "text/csv")
+                }
+            },
+        ),
+    }
+
+
+async def measure(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+) -> dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses: Counter[int] = Counter()
+
+    async def call(i: int) -> float:
+        (method, path, kwargs) = scenario(i)
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            await response.aread()
+            elapsed = time.perf_counter() - start
+        statuses[response.status_code] += 1
+        return elapsed
+
+    for i in range(warmup):
+        await call(i)
+    statuses.clear()
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*[call(warmup + i) for i in range(requests)])
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+
+async def run(
+    base_url: str | None,
+    selected: dict[str, Scenario],
+    requests: int,
+    concurrency: int,
+    warmup: int,
+) -> dict[str, Any]:
+    transport = None if base_url else httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url=base_url or "http://benchmark", timeout=300
+    ) as client:
+        response = await client.post(
+            f"{settings.API_V1_STR}/login/access-token",
+            data={
+                "username": settings.FIRST_SUPERUSER,
+                "password": settings.FIRST_SUPERUSER_PASSWORD,
+            },
+        )
+        response.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+        results = {}
+        for name, scenario in selected.items():
+            results[name] = await measure(
+                client, scenario, requests, concurrency, warmup
+            )
+            latency = results[name]["latency_ms"]
+            logger.info(
+                f"{name}: {results[name]['throughput']:.1f} req/s, p50 {latency['p50']:.1f} ms, "
+                f"p95 {latency['p95']:.1f} ms, p99 {latency['p99']:.1f} ms, "
+                f"{results[name]['errors']} errors"
+            )
+        return results
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any]) -> None:
+    logger.info(f"Compared with {baseline.get('commit') or 'unknown commit'}:")
+    for name, result in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        changes = ", ".join(
+            f"{metric} {(result['latency_ms'][metric] / before['latency_ms'][metric] - 1) * 100:+.0f}%"
+            for metric in ("p50", "p95", "p99")
+            if before["latency_ms"][metric]
+        )
+        throughput = (result["throughput"] / before["throughput"] - 1) * 100
+        logger.info(f"{name}: throughput {throughput:+.0f}%, {changes}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the sensor data endpoints"
+    )
+    parser.add_argument("--equipment", type=int, default=200, help="Equipment to seed")
+    parser.add_argument(
+        "--interval-seconds",
+        type=int,
+        default=60,
+        help="Seconds between two readings of an equipment",
+    )
+    parser.add_argument(
+        "--days", type=float, default=7, help="Days of readings to seed"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Measured requests per scenario"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=10, help="Concurrent requests"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=5, help="Unmeasured requests per scenario"
+    )
+    parser.add_argument(
+        "--csv-rows", type=int, default=1000, help="Rows of the imported CSV file"
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        dest="scenarios",
+        help="Scenario to run, may be repeated (default: all)",
+    )
+    parser.add_argument(
+        "--base-url", help="Server to benchmark instead of the in-process app"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the synthetic data"
+    )
+    parser.add_argument(
+        "--reuse-data",
+        action="store_true",
+        help="Keep the dataset of a previous --keep-data run instead of seeding",
+    )
+    parser.add_argument(
+        "--keep-data", action="store_true", help="Don't delete the dataset afterwards"
+    )
+    parser.add_argument(
+        "--output", help="Results file (default: benchmark-<commit>.json)"
+    )
+    parser.add_argument(
+        "--compare", help="Results file of a previous run to compare with"
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    series = SyntheticSeries(
+        equipment=args.equipment,
+        interval_seconds=args.interval_seconds,
+        days=args.days,
+        prefix=EQUIPMENT_PREFIX,
+        seed=args.seed,
+    )
+    available = scenarios(series.equipment_ids(), args.days, args.csv_rows, rng)
+    unknown = set(args.scenarios or []) - set(available)
+    if unknown:
+        parser.error(
+            f"Unknown scenarios: {', '.join(sorted(unknown))} (available: {', '.join(available)})"
+        )
+    selected = {name: available[name] for name in args.scenarios or available}
+
+    with Session(engine) as session:
+        init_db(session)
+        rows = count_dataset(session)
+        if args.reuse_data and rows:
+            logger.info(f"Reusing the {rows:,} rows of the previous dataset")
+        else:
+            cleanup(session)
+            logger.info(
+                f"Seeding {args.equipment} equipment x {args.days} days every {args.interval_seconds}s..."
+            )
+            start = time.perf_counter()
+            rows = load(series, workers=os.cpu_count() or 1)
+            logger.info(f"Seeded {rows:,} rows in {time.perf_counter() - start:.1f}s")
+
+        try:
+            commit = git("rev-parse", "HEAD")
+            results = {
+                "commit": commit,
+                "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+                "started_at": datetime.utcnow().isoformat(),
+                "target": args.base_url or "in-process",
+                "dataset": {
+                    "equipment": args.equipment,
+                    "interval_seconds": args.interval_seconds,
+                    "days": args.days,
+                    "rows": rows,
+                    "seed": args.seed,
+                },
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "scenarios": asyncio.run(
+                    run(
+                        args.base_url,
+                        selected,
+                        args.requests,
+                        args.concurrency,
+                        args.warmup,
+                    )
+                ),
+            }
+        finally:
+            if not args.keep_data:
+                cleanup(session)
+
+    output = Path(args.output or f"benchmark-{(commit or 'unknown')[:12]}.json")
+    output.write_text(json.dumps(results, indent=2))
+    logger.info(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == "__main__":
+    main()
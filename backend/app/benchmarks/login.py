@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+import uuid
+
+import httpx
+from sqlmodel import Session
+
+from app import crud
+from app.core import security
+from app.core.config import settings
+from app.core.db import engine
+from app.main import app
+from app.models import UserCreate
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Login throughput under concurrency, with bcrypt run inline in the threadpool
+# versus in the password process pool (PASSWORD_HASH_WORKERS). A cheap request
+# is sent alongside to show how much the logins slow down everything else.
+# Usage: python -m app.benchmarks.login --logins 200 --concurrency 20 --workers 4
+
+
+async def login(client: httpx.AsyncClient, email: str, password: str) -> float:
+    start = time.perf_counter()
+    response = await client.post(
+        f"{settings.API_V1_STR}/login/access-token",
+        data={"username": email, "password": password},
+    )
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def probe(client: httpx.AsyncClient, stop: asyncio.Event) -> list[float]:
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get(f"{settings.API_V1_STR}/openapi.json")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+    return latencies
+
+
+async def run(email: str, password: str, logins: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://benchmark"
+    ) as client:
+        await login(client, email, password)  # warm up the pool
+
+        async def limited_login() -> float:
+            async with semaphore:
+                return await login(client, email, password)
+
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(client, stop))
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*[limited_login() for _ in range(logins)])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        probe_latencies = await probe_task
+
+    logger.info(
+        f"{logins / elapsed:.1f} logins/s, "
+        f"p95 login {statistics.quantiles(latencies, n=20)[-1] * 1000:.0f} ms, "
+        f"p95 concurrent cheap request {statistics.quantiles(probe_latencies, n=20)[-1] * 1000:.0f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark of the login throughput")
+    parser.add_argument("--logins", type=int, default=200, help="Logins to perform")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent logins")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.PASSWORD_HASH_WORKERS,
+        help="Password processes for the pooled run",
+    )
+    args = parser.parse_args()
+
+    email = f"benchmark-{uuid.uuid4().hex[:8]}@example.com"
+    password = uuid.uuid4().hex
+    with Session(engine) as session:
+        user = crud.create_user(
+            session=session, user_create=UserCreate(email=email, password=password)
+        )
+        try:
+            for workers in [0, args.workers]:
+                settings.PASSWORD_HASH_WORKERS = workers
+                security.shutdown_password_executor()
+                logger.info(f"PASSWORD_HASH_WORKERS={workers}:")
+                asyncio.run(run(email, password, args.logins, args.concurrency))
+        finally:
+            security.shutdown_password_executor()
+            session.delete(user)
+            session.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import json
+import logging
+import time
+import uuid
+from collections.abc import Callable
+from datetime import datetime, timedelta
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlmodel import Session, col, delete, select
+
+from app import crud
+from app.core.db import engine
+from app.models import SensorData, SensorDataListPublic
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Compares the ORM read path (ORM instances + SensorDataListPublic validation +
+# jsonable_encoder) with the Core/orjson one used by the list endpoints.
+# Usage: python -m app.benchmarks.read_path --rows 10000 --repeat 20
+
+
+def seed(session: Session, equipment_id: str, rows: int) -> None:
+    now = datetime.today()
+    session.bulk_insert_mappings(
+        SensorData,
+        [
+            {
+                "id": uuid.uuid4(),
+                "equipment_id": equipment_id,
+                "value": float(i % 100),
+                "timestamp": now - timedelta(seconds=10 * i),
+            }
+            for i in range(rows)
+        ],
+    )
+    session.commit()
+
+
+def orm_path(session: Session, equipment_id: str) -> bytes:
+    sensors = session.exec(
+        select(SensorData).where(SensorData.equipment_id == equipment_id)
+    ).all()
+    model = SensorDataListPublic.model_validate(
+        {"data": sensors, "count": len(sensors)}
+    )
+    body = json.dumps(jsonable_encoder(model)).encode("utf-8")
+    # Identity map bookkeeping is part of the cost of each request
+    session.expunge_all()
+    return body
+
+
+def fast_path(session: Session, equipment_id: str) -> bytes:
+    sensors = crud.get_sensor_data_rows_by_equipment_id(
+        session=session, equipment_id=equipment_id
+    )
+    return orjson.dumps({"data": sensors, "count": len(sensors)})
+
+
+def measure(
+    name: str,
+    fn: Callable[[Session, str], bytes],
+    session: Session,
+    equipment_id: str,
+    rows: int,
+    repeat: int,
+) -> float:
+    fn(session, equipment_id)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(session, equipment_id)
+    elapsed = time.perf_counter() - start
+    rows_per_second = rows * repeat / elapsed
+    logger.info(
+        f"{name}: {elapsed / repeat * 1000:.1f} ms per page, {rows_per_second:,.0f} rows/s"
+    )
+    return rows_per_second
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the sensor data read paths"
+    )
+    parser.add_argument("--rows", type=int, default=10_000, help="Rows per page")
+    parser.add_argument("--repeat", type=int, default=20, help="Pages read per path")
+    args = parser.parse_args()
+
+    equipment_id = f"benchmark-{uuid.uuid4().hex[:8]}"
+    with Session(engine) as session:
+        logger.info(f"Seeding {args.rows} rows for {equipment_id}...")
+        seed(session, equipment_id, args.rows)
+        try:
+            orm = measure(
+                "ORM path ", orm_path, session, equipment_id, args.rows, args.repeat
+            )
+            fast = measure(
+                "Fast path", fast_path, session, equipment_id, args.rows, args.repeat
+            )
+            logger.info(f"Speedup: {fast / orm:.1f}x")
+        finally:
+            session.execute(
+                delete(SensorData).where(col(SensorData.equipment_id) == equipment_id)
+            )
+            session.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,502 @@
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+from app.benchmarks.results import git, summarize
+from app.core.config import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Replays recorded traffic against a running instance, at N times its speed,
+# and reports throughput, tail latency and error rate per route.
+#
+# Recordings are the JSON lines written with TRAFFIC_RECORD_DIR set (see
+# app/core/traffic.py), or a synthetic mix of dashboard polling and gateway
+# ingest made by the synthesize command.
+#
+# Requests are sent at their recorded time whether or not the previous ones
+# were answered, and latencies are measured from that time: when the server
+# (or the connection pool) falls behind, the queueing shows up in the latencies
+# instead of slowing the replay down.
+# Usage: python -m app.benchmarks.replay synthesize --dashboards 50 --gateways 500 \
+#            --duration 600 --output traffic.jsonl
+#        python -m app.benchmarks.replay run traffic.jsonl --speed 4 --connections 200 \
+#            --base-url http://localhost:8000 --output replay.json
+
+INGEST_ROUTES = {
+    "sensor-data-create_sensor_data",
+    "sensor-data-create_sensor_data_from_csv",
+}
+
+
+def read_recordings(paths: list[str]) -> list[dict[str, Any]]:
+    """
+    The entries of the recording files (or directories of them), in time order.
+    """
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("*.jsonl")) if path.is_dir() else [path])
+    entries = []
+    for file in files:
+        with file.open(encoding="utf-8") as lines:
+            for line in lines:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # The last line of a worker that was killed
+                    continue
+    entries.sort(key=lambda entry: entry["time"])
+    return entries
+
+
+def synthesize(
+    *,
+    dashboards: int,
+    poll_seconds: float,
+    gateways: int,
+    ingest_seconds: float,
+    csv_every_seconds: float,
+    csv_rows: int,
+    duration: float,
+    equipment: list[str],
+    rng: random.Random,
+) -> list[dict[str, Any]]:
+    """
+    Dashboards loading their page (options, list) then polling the line and bar
+    charts, gateways posting a reading each, and a periodic CSV import.
+    """
+    api = settings.API_V1_STR
+    start = time.time()
+    entries: list[dict[str, Any]] = []
+
+    def entry(
+        at: float,
+        method: str,
+        path: str,
+        route: str,
+        query: str = "",
+        body: bytes | None = None,
+        content_type: str | None = None,
+    ) -> None:
+        entries.append(
+            {
+                "time": start + at,
+                "method": method,
+                "path": path,
+                "query": query,
+                "route": route,
+                "content_type": content_type,
+                "body": base64.b64encode(body).decode("ascii") if body else None,
+                "body_omitted": False,
+            }
+        )
+
+    def json_body(data: Any) -> bytes:
+        return json.dumps(data).encode("utf-8")
+
+    for _ in range(dashboards):
+        at = rng.uniform(0, poll_seconds)
+        entry(
+            at,
+            "GET",
+            f"{api}/sensor-data/options/equipment",
+            "sensor-data-read_equipment_options",
+        )
+        entry(
+            at,
+            "GET",
+            f"{api}/sensor-data/",
+            "sensor-data-read_sensors_data",
+            "skip=0&limit=100",
+        )
+        # Some dashboards follow a few equipment, the others all of them
+        followed = (
+            rng.sample(equipment, min(len(equipment), 5))
+            if rng.random() < 0.5
+            else None
+        )
+        fetch_mode = rng.choice([1, 1, 1, 2, 3, 4])
+        while at < duration:
+            entry(
+                at,
+                "POST",
+                f"{api}/sensor-data/dashboard/line-chart",
+                "sensor-data-read_sensor_data_for_line_chart",
+            )
+            entry(
+                at,
+                "POST",
+                f"{api}/sensor-data/dashboard/bar-chart",
+                "sensor-data-read_sensor_data_for_bar_chart",
+                body=json_body(
+                    {
+                        "skip": 0,
+                        "limit": 100,
+                        "fetch_mode": fetch_mode,
+                        "equipment_ids": followed,
+                    }
+                ),
+                content_type="application/json",
+            )
+            at += poll_seconds * rng.uniform(0.9, 1.1)
+
+    for index in range(gateways):
+        equipment_id = equipment[index % len(equipment)]
+        at = rng.uniform(0, ingest_seconds)
+        while at < duration:
+            entry(
+                at,
+                "POST",
+                f"{api}/sensor-data/",
+                "sensor-data-create_sensor_data",
+                body=json_body(
+                    {"equipment_id": equipment_id, "value": rng.uniform(20, 80)}
+                ),
+                content_type="application/json",
+            )
+            at += ingest_seconds * rng.uniform(0.95, 1.05)
+
+    if csv_every_seconds:
+        boundary = "replay-boundary"
+        at = csv_every_seconds
+        while at < duration:
+            now = datetime.today()
+            rows = "".join(
+                f"{rng.choice(equipment)},{(now - timedelta(seconds=i)).isoformat()},{rng.uniform(20, 80):.2f}\n"
+                for i in range(csv_rows)
+            )
+            body = (
+                f"--{boundary}\r\n"
+                'Content-Disposition: form-data; name="sensor_data_csv_file"; filename="replay.csv"\r\n'
+                "Content-Type: text/csv\r\n\r\n"
+                f"equipmentId,timestamp,value\n{rows}\r\n--{boundary}--\r\n"
+            ).encode()
+            entry(
+                at,
+                "POST",
+                f"{api}/sensor-data/csv",
+                "sensor-data-create_sensor_data_from_csv",
+                body=body,
+                content_type=f"multipart/form-data; boundary={boundary}",
+            )
+            at += csv_every_seconds
+
+    entries.sort(key=lambda entry: entry["time"])
+    return entries
+
+
+async def replay(
+    entries: list[dict[str, Any]],
+    *,
+    base_url: str,
+    speed: float,
+    connections: int,
+    token: str,
+    api_key: str | None,
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> dict[str, Any]:
+    latencies: dict[str, list[float]] = defaultdict(list)
+    statuses: dict[str, Counter[int]] = defaultdict(Counter)
+    max_lag = 0.0
+
+    limits = httpx.Limits(
+        max_connections=connections, max_keepalive_connections=connections
+    )
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=300, transport=transport
+    ) as client:
+
+        async def send(entry: dict[str, Any], scheduled: float) -> None:
+            route = entry.get("route") or f"{entry['method']} {entry['path']}"
+            headers = {"Authorization": f"Bearer {token}"}
+            if api_key and route in INGEST_ROUTES:
+                headers = {"X-API-Key": api_key}
+            if entry.get("content_type"):
+                headers["Content-Type"] = entry["content_type"]
+            try:
+                response = await client.request(
+                    entry["method"],
+                    entry["path"],
+                    params=entry.get("query") or None,
+                    content=base64.b64decode(entry["body"])
+                    if entry.get("body")
+                    else None,
+                    headers=headers,
+                )
+                await response.aread()
+                status = response.status_code
+            except httpx.HTTPError as e:
+                logger.debug(f"{route}: {e!r}")
+                # Counted as an error, like a 5xx
+                status = 599
+            latencies[route].append(time.perf_counter() - scheduled)
+            statuses[route][status] += 1
+
+        tasks = set()
+        first = entries[0]["time"]
+        start = time.perf_counter()
+        for entry in entries:
+            scheduled = start + (entry["time"] - first) / speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+            task = asyncio.create_task(send(entry, scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    routes = {
+        route: summarize(latencies[route], statuses[route], elapsed)
+        for route in sorted(latencies)
+    }
+    return {
+        "elapsed_seconds": elapsed,
+        # Above a few ms, the replayer itself couldn't keep up with the schedule
+        "max_schedule_lag_ms": max_lag * 1000,
+        "total": summarize(
+            [latency for route in latencies.values() for latency in route],
+            sum(statuses.values(), Counter()),
+            elapsed,
+        ),
+        "routes": routes,
+    }
+
+
+def recorded_durations(entries: list[dict[str, Any]]) -> dict[str, float]:
+    # p95 of the recorded durations per route, for reference
+    durations: dict[str, list[float]] = defaultdict(list)
+    for entry in entries:
+        if entry.get("duration") is not None:
+            durations[
+                entry.get("route") or f"{entry['method']} {entry['path']}"
+            ].append(entry["duration"])
+    return {
+        route: sorted(values)[int(0.95 * (len(values) - 1))] * 1000
+        for (route, values) in durations.items()
+    }
+
+
+async def login(base_url: str, transport: httpx.AsyncBaseTransport | None) -> str:
+    async with httpx.AsyncClient(base_url=base_url, transport=transport) as client:
+        response = await client.post(
+            f"{settings.API_V1_STR}/login/access-token",
+            data={
+                "username": settings.FIRST_SUPERUSER,
+                "password": settings.FIRST_SUPERUSER_PASSWORD,
+            },
+        )
+    response.raise_for_status()
+    token: str = response.json()["access_token"]
+    return token
+
+
+def run_command(args: argparse.Namespace) -> None:
+    entries = read_recordings(args.recordings)
+    if args.routes:
+        entries = [entry for entry in entries if entry.get("route") in args.routes]
+    if args.duration:
+        entries = [
+            entry
+            for entry in entries
+            if entry["time"] - entries[0]["time"] < args.duration
+        ]
+    omitted = sum(1 for entry in entries if entry.get("body_omitted"))
+    entries = [entry for entry in entries if not entry.get("body_omitted")]
+    if not entries:
+        raise SystemExit("Nothing to replay")
+    if omitted:
+        logger.info(f"Skipping {omitted} requests recorded without their body")
+
+    transport = None
+    target = args.base_url
+    if args.in_process:
+        # Imported here, the app isn't needed to replay against a server
+        from app.main import app
+
+        transport = httpx.ASGITransport(app=app)
+        target = "in-process"
+
+    async def run() -> dict[str, Any]:
+        return await replay(
+            entries,
+            base_url=args.base_url,
+            speed=args.speed,
+            connections=args.connections,
+            token=args.token or await login(args.base_url, transport),
+            api_key=args.api_key,
+            transport=transport,
+        )
+
+    span = entries[-1]["time"] - entries[0]["time"]
+    logger.info(
+        f"Replaying {len(entries):,} requests ({span:.0f}s recorded) at {args.speed}x "
+        f"against {target}..."
+    )
+    results = asyncio.run(run())
+
+    recorded = recorded_durations(entries)
+    for route, result in results["routes"].items():
+        latency = result["latency_ms"]
+        reference = (
+            f", recorded p95 {recorded[route]:.1f} ms" if route in recorded else ""
+        )
+        logger.info(
+            f"{route}: {result['requests']} requests, {result['throughput']:.1f} req/s, "
+            f"p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms, p99 {latency['p99']:.1f} ms, "
+            f"{result['errors'] / result['requests']:.1%} errors{reference}"
+        )
+    total = results["total"]
+    logger.info(
+        f"Total: {total['throughput']:.1f} req/s, p99 {total['latency_ms']['p99']:.1f} ms, "
+        f"{total['errors'] / total['requests']:.1%} errors, "
+        f"schedule lag up to {results['max_schedule_lag_ms']:.0f} ms"
+    )
+
+    if args.output:
+        Path(args.output).write_text(
+            json.dumps(
+                {
+                    "commit": git("rev-parse", "HEAD"),
+                    "started_at": datetime.utcnow().isoformat(),
+                    "target": target,
+                    "recordings": args.recordings,
+                    "speed": args.speed,
+                    "connections": args.connections,
+                    **results,
+                },
+                indent=2,
+            )
+        )
+        logger.info(f"Results written to {args.output}")
+
+
+def synthesize_command(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    width = max(5, len(str(args.equipment - 1)))
+    entries = synthesize(
+        dashboards=args.dashboards,
+        poll_seconds=args.poll_seconds,
+        gateways=args.gateways,
+        ingest_seconds=args.ingest_seconds,
+        csv_every_seconds=args.csv_every_seconds,
+        csv_rows=args.csv_rows,
+        duration=args.duration,
+        equipment=[
+            f"{args.prefix}{index:0{width}d}" for index in range(args.equipment)
+        ],
+        rng=rng,
+    )
+    with open(args.output, "w", encoding="utf-8") as output:
+        for entry in entries:
+            output.write(json.dumps(entry) + "\n")
+    logger.info(f"{len(entries):,} requests written to {args.output}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay of recorded traffic")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser(
+        "run", help="Replay recordings against a running instance"
+    )
+    run.add_argument(
+        "recordings", nargs="+", help="Recording files, or directories of them"
+    )
+    run.add_argument(
+        "--base-url", default="http://localhost:8000", help="Instance to replay against"
+    )
+    run.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Replay against the app in this process instead (no network, no workers)",
+    )
+    run.add_argument(
+        "--speed", type=float, default=1.0, help="Replay speed, 2 is twice as fast"
+    )
+    run.add_argument(
+        "--connections", type=int, default=100, help="Concurrent connections"
+    )
+    run.add_argument(
+        "--duration", type=float, help="Only replay the first seconds of the recordings"
+    )
+    run.add_argument(
+        "--route",
+        action="append",
+        dest="routes",
+        help="Only replay this route, may be repeated",
+    )
+    run.add_argument(
+        "--token", help="Access token (default: log in as the first superuser)"
+    )
+    run.add_argument(
+        "--api-key", help="API key sent by the ingest requests instead of the token"
+    )
+    run.add_argument("--output", help="Results file")
+    run.set_defaults(handler=run_command)
+
+    synthetic = commands.add_parser(
+        "synthesize", help="Write a synthetic dashboard and ingest recording"
+    )
+    synthetic.add_argument("--dashboards", type=int, default=50, help="Open dashboards")
+    synthetic.add_argument(
+        "--poll-seconds",
+        type=float,
+        default=30,
+        help="Refresh interval of the dashboards",
+    )
+    synthetic.add_argument(
+        "--gateways", type=int, default=500, help="Gateways posting readings"
+    )
+    synthetic.add_argument(
+        "--ingest-seconds",
+        type=float,
+        default=10,
+        help="Interval between two readings of a gateway",
+    )
+    synthetic.add_argument(
+        "--csv-every-seconds",
+        type=float,
+        default=300,
+        help="Interval between CSV imports, 0 for none",
+    )
+    synthetic.add_argument(
+        "--csv-rows", type=int, default=10_000, help="Rows of each CSV import"
+    )
+    synthetic.add_argument(
+        "--duration", type=float, default=600, help="Seconds of traffic"
+    )
+    synthetic.add_argument(
+        "--equipment", type=int, default=2000, help="Equipment of the dataset"
+    )
+    synthetic.add_argument(
+        "--prefix",
+        default="eq-",
+        help="Equipment id prefix (see app.load_synthetic_data)",
+    )
+    synthetic.add_argument("--seed", type=int, default=0, help="Seed of the generator")
+    synthetic.add_argument(
+        "--output", default="traffic.jsonl", help="Recording file to write"
+    )
+    synthetic.set_defaults(handler=synthesize_command)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
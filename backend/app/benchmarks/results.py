@@ -0,0 +1,45 @@
+import math
+import statistics
+import subprocess
+from collections import Counter
+from typing import Any
+
+# Helpers shared by the benchmarks writing their results as JSON
+
+
+def git(*args: str) -> str | None:
+    try:
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(
+    latencies: list[float], statuses: Counter[int], elapsed: float
+) -> dict[str, Any]:
+    # Percentiles over the sorted latencies, in milliseconds
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return (
+            ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)] * 1000
+        )
+
+    return {
+        "requests": len(latencies),
+        "errors": sum(count for (status, count) in statuses.items() if status >= 400),
+        "statuses": {
+            str(status): count for (status, count) in sorted(statuses.items())
+        },
+        "throughput": len(latencies) / elapsed,
+        "latency_ms": {
+            "mean": statistics.fmean(ordered) * 1000,
+            "p50": percentile(50),
+            "p90": percentile(90),
+            "p95": percentile(95),
+            "p99": percentile(99),
+            "max": ordered[-1] * 1000,
+        },
+    }
@@ -0,0 +1,75 @@
+import argparse
+import json
+import logging
+import statistics
+import subprocess
+import sys
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Time to import the app and memory of a fresh worker, each run in a new
+# interpreter (the import caches of the OS are warm after the first run). With
+# --compare, also with the modules imported lazily by the app loaded upfront,
+# as they used to be.
+# Usage: python -m app.benchmarks.startup --runs 10 --compare
+
+LAZY_MODULES = ["pandas", "emails", "emails.backend", "jinja2", "sentry_sdk"]
+
+# Preloaded modules are timed along with the app
+WORKER = """
+import json, resource, sys, time
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    __import__(module)
+import app.main
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(sys.modules),
+}))
+"""
+
+
+def measure(runs: int, preload: list[str]) -> dict[str, float]:
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", WORKER, *preload],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    return {
+        key: statistics.median(result[key] for result in results)
+        for key in ("seconds", "rss_mb", "modules")
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark of the worker startup")
+    parser.add_argument(
+        "--runs", type=int, default=10, help="Fresh interpreters per measure"
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Also measure with the lazily imported modules loaded upfront",
+    )
+    args = parser.parse_args()
+
+    measure(1, [])  # warm up the OS caches
+    runs: list[tuple[str, list[str]]] = [("lazy", [])]
+    if args.compare:
+        runs.append(("eager", LAZY_MODULES))
+    for name, preload in runs:
+        result = measure(args.runs, preload)
+        logger.info(
+            f"{name}: import {result['seconds'] * 1000:.0f} ms, RSS {result['rss_mb']:.1f} MB, "
+            f"{result['modules']:.0f} modules (medians of {args.runs} runs)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import logging
+import time
+import uuid
+from collections.abc import Callable
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import Select, func
+from sqlmodel import Session, col, delete, select
+
+from app import crud
+from app.core.db import engine
+from app.models import SensorData
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Per-request CPU of the hot sensor data queries, rebuilt on every call (as they
+# used to be) versus the cached statements of app.crud.
+#  - Worker: process CPU time spent building, compiling and running each query.
+#  - Postgres: round trip of the same SQL unprepared versus prepared, the
+#    difference being the parsing and planning Postgres no longer does.
+# Usage: python -m app.benchmarks.statements --repeat 2000
+
+
+def seed(session: Session, equipment_ids: list[str], rows: int) -> None:
+    now = datetime.today()
+    session.bulk_insert_mappings(
+        SensorData,
+        [
+            {
+                "id": uuid.uuid4(),
+                "equipment_id": equipment_ids[i % len(equipment_ids)],
+                "value": float(i % 100),
+                "timestamp": now - timedelta(seconds=60 * i),
+            }
+            for i in range(rows)
+        ],
+    )
+    session.commit()
+
+
+# The query builders as they were before the statements were cached
+
+
+def rebuilt_average_by_equipment(
+    begin: datetime, end: datetime, equipment_ids: list[str]
+) -> Select[Any]:
+    return (
+        select(SensorData.equipment_id, func.avg(SensorData.value).label("avg"))
+        .where(SensorData.timestamp > begin, SensorData.timestamp <= end)
+        .where(col(SensorData.equipment_id).in_(equipment_ids))
+        .group_by(SensorData.equipment_id)
+        .order_by(SensorData.equipment_id)
+        .offset(0)
+        .limit(100)
+    )
+
+
+def rebuilt_hourly_averages(
+    begin: datetime, end: datetime, equipment_ids: list[str]
+) -> Select[Any]:
+    hour = func.date_trunc("hour", SensorData.timestamp)
+    return (
+        select(SensorData.equipment_id, hour, func.avg(SensorData.value))
+        .where(SensorData.timestamp >= begin, SensorData.timestamp < end)
+        .where(col(SensorData.equipment_id).in_(equipment_ids))
+        .group_by(SensorData.equipment_id, hour)
+    )
+
+
+def rebuilt_rows_by_equipment(equipment_id: str) -> Select[Any]:
+    return select(*crud.SENSOR_DATA_PUBLIC_COLUMNS).where(
+        SensorData.equipment_id == equipment_id
+    )
+
+
+def worker_cpu(run: Callable[[], Any], repeat: int) -> float:
+    run()  # warm up the compiled cache and the connection
+    start = time.process_time()
+    for _ in range(repeat):
+        run()
+    return (time.process_time() - start) / repeat
+
+
+def postgres_time(
+    session: Session, query: crud.Query, repeat: int, prepare: bool
+) -> float:
+    (statement, params) = query
+    compiled = statement.compile(dialect=engine.dialect)
+    sql = str(compiled)
+    parameters = compiled.construct_params(params)
+    driver_connection = session.connection().connection.driver_connection
+    assert driver_connection is not None
+    cursor = driver_connection.cursor()
+    cursor.execute(sql, parameters, prepare=prepare)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        cursor.execute(sql, parameters, prepare=prepare)
+        cursor.fetchall()
+    return (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the cached sensor data statements"
+    )
+    parser.add_argument("--rows", type=int, default=1_000, help="Rows to seed")
+    parser.add_argument(
+        "--equipments", type=int, default=5, help="Equipment ids to seed"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=2_000, help="Executions per query"
+    )
+    args = parser.parse_args()
+
+    prefix = f"benchmark-{uuid.uuid4().hex[:8]}"
+    equipment_ids = [f"{prefix}-{index}" for index in range(args.equipments)]
+    end = datetime.today()
+    begin = end - timedelta(hours=24)
+
+    cases = {
+        "bar chart": (
+            lambda: rebuilt_average_by_equipment(begin, end, equipment_ids),
+            crud.average_by_equipment_query(begin, end, equipment_ids),
+        ),
+        "line chart": (
+            lambda: rebuilt_hourly_averages(begin, end, equipment_ids),
+            crud.hourly_averages_query(begin, end, equipment_ids),
+        ),
+        "equipment history": (
+            lambda: rebuilt_rows_by_equipment(equipment_ids[0]),
+            crud.sensor_data_rows_by_equipment_query(equipment_ids[0]),
+        ),
+    }
+
+    with Session(engine) as session:
+        logger.info(f"Seeding {args.rows} rows for {prefix}-*...")
+        seed(session, equipment_ids, args.rows)
+        try:
+            for name, (rebuild, query) in cases.items():
+                # Bound as defaults, not looked up in the loop variables
+                def run_rebuilt(rebuild: Callable[[], Select[Any]] = rebuild) -> Any:
+                    return session.execute(rebuild()).all()
+
+                def run_cached(query: crud.Query = query) -> Any:
+                    return crud.execute(session, query).all()
+
+                rebuilt = worker_cpu(run_rebuilt, args.repeat)
+                cached = worker_cpu(run_cached, args.repeat)
+                unprepared = postgres_time(session, query, args.repeat, prepare=False)
+                prepared = postgres_time(session, query, args.repeat, prepare=True)
+                logger.info(
+                    f"{name}: worker CPU {rebuilt * 1e6:.0f} -> {cached * 1e6:.0f} us/request, "
+                    f"Postgres round trip {unprepared * 1e6:.0f} -> {prepared * 1e6:.0f} us/request"
+                )
+        finally:
+            session.rollback()
+            session.execute(
+                delete(SensorData).where(
+                    col(SensorData.equipment_id).in_(equipment_ids)
+                )
+            )
+            session.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import secrets
+import threading
+import uuid
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# API keys of machine clients look like pgk_<prefix>_<secret>. The prefix finds
+# the key in the in-memory table, the secret is checked against its HMAC, so
+# the ingest endpoints authenticate them without any database round trip.
+
+KEY_PREFIX = "pgk"
+
+
+@dataclass(frozen=True)
+class ApiKeyEntry:
+    id: uuid.UUID
+    prefix: str
+    secret_hash: str
+    scopes: frozenset[str]
+    owner_id: uuid.UUID
+    # Of the owner, the key acts on their behalf
+    is_superuser: bool
+
+
+def hash_secret(secret: str) -> str:
+    return hmac.new(
+        settings.SECRET_KEY.encode("utf-8"), secret.encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+
+
+def generate_api_key() -> tuple[str, str, str]:
+    """
+    A new key, as (full key to hand to the client, prefix, HMAC of the secret).
+    """
+    prefix = secrets.token_hex(4)
+    secret = secrets.token_urlsafe(32)
+    return (f"{KEY_PREFIX}_{prefix}_{secret}", prefix, hash_secret(secret))
+
+
+class ApiKeyTable:
+    """
+    Active API keys by prefix. Reloaded every API_KEY_REFRESH_SECONDS, and right
+    away by the worker creating or revoking a key, so a revocation takes effect
+    in the other workers within the refresh period.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[str, ApiKeyEntry] = {}
+        self._lock = threading.Lock()
+
+    def load(self, entries: Iterable[ApiKeyEntry]) -> None:
+        table = {entry.prefix: entry for entry in entries}
+        with self._lock:
+            self._entries = table
+
+    def verify(self, key: str, scope: str) -> ApiKeyEntry:
+        """
+        The entry of a valid key with the given scope. Raises a 401 otherwise,
+        or a 403 when the key is valid but lacks the scope.
+        """
+        (kind, _, rest) = key.partition("_")
+        (prefix, _, secret) = rest.partition("_")
+        with self._lock:
+            entry = self._entries.get(prefix)
+        if (
+            kind != KEY_PREFIX
+            or entry is None
+            or not hmac.compare_digest(entry.secret_hash, hash_secret(secret))
+        ):
+            raise HTTPException(status_code=401, detail="Invalid API key")
+        if scope not in entry.scopes:
+            raise HTTPException(
+                status_code=403, detail=f"The API key doesn't have the {scope} scope"
+            )
+        return entry
+
+    async def run(self, fetch: Callable[[], Awaitable[list[ApiKeyEntry]]]) -> None:
+        while True:
+            try:
+                self.load(await fetch())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keeps the previous table, keys keep working while the DB is down
+                logger.warning(f"Could not refresh the API keys: {e}")
+            await asyncio.sleep(settings.API_KEY_REFRESH_SECONDS)
+
+
+api_key_table = ApiKeyTable()
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import threading
+from collections.abc import Awaitable, Callable, Iterable
+from datetime import datetime, timedelta
+from typing import Any
+
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+HOUR = timedelta(hours=1)
+
+# Signature of the coroutine used to (re)compute buckets: receives the interval
+# [begin, end) and an optional list of equipment ids to restrict the query, and
+# returns (equipment_id, hour, avg) rows.
+BucketFetcher = Callable[
+    [datetime, datetime, list[str] | None],
+    Awaitable[Iterable[tuple[str, datetime, float]]],
+]
+
+# Signature of the coroutine returning the watermark of the hours in [begin, end),
+# changed by every write to their data (see sensor_data_hour_watermark). Hours
+# without data may be left out.
+WatermarkFetcher = Callable[[datetime, datetime], Awaitable[dict[datetime, int]]]
+
+
+def truncate_to_hour(moment: datetime) -> datetime:
+    # The sensor timestamps are stored without timezone, in local time
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class HourlyBucketCache:
+    """
+    Per-equipment, per-hour cache of the averages used by the line chart dashboard.
+
+    Closed hours are treated as immutable: once computed, they are only recomputed
+    when their watermark changes, as late data or deletes bump it in the database
+    whichever worker or process wrote them. On each read only the open hour, the
+    hours never computed and the changed hours are fetched from the database.
+    """
+
+    def __init__(self, window_hours: int = 24):
+        self.window_hours = window_hours
+        self._lock = threading.Lock()
+        # hour -> {equipment_id: avg}, only closed hours are stored
+        self._buckets: dict[datetime, dict[str, float]] = {}
+        # hour -> watermark read before the bucket was computed
+        self._watermarks: dict[datetime, int] = {}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+            self._watermarks.clear()
+
+    async def get(
+        self,
+        fetch: BucketFetcher,
+        fetch_watermarks: WatermarkFetcher,
+        now: datetime | None = None,
+        equipment_ids: list[str] | None = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Returns the hourly averages of the window ending at the open hour,
+        ordered by equipment and hour.
+        """
+        now = now or datetime.today()
+        open_hour = truncate_to_hour(now)
+        first_hour = open_hour - (self.window_hours - 1) * HOUR
+
+        # Read before the buckets: data written in between makes the stored
+        # watermark older than the bucket, which is only recomputed once more
+        watermarks = await fetch_watermarks(first_hour, open_hour)
+
+        with self._lock:
+            for hour in [h for h in self._buckets if h < first_hour]:
+                del self._buckets[hour]
+                self._watermarks.pop(hour, None)
+            missing = [
+                first_hour + i * HOUR
+                for i in range(self.window_hours - 1)
+                if first_hour + i * HOUR not in self._buckets
+            ]
+            changed = [
+                hour
+                for hour in self._buckets
+                if hour >= first_hour
+                and watermarks.get(hour, 0) != self._watermarks.get(hour, 0)
+            ]
+
+        recomputed_hours = len(missing) + len(changed)
+        metrics.cache_requests.labels(cache="line_chart", result="miss").inc(
+            recomputed_hours
+        )
+        metrics.cache_requests.labels(cache="line_chart", result="hit").inc(
+            self.window_hours - 1 - recomputed_hours
+        )
+
+        # The missing hours and the open hour are fetched with a single range query
+        fetch_begin = missing[0] if missing else open_hour
+        fresh: dict[datetime, dict[str, float]] = {
+            fetch_begin + i * HOUR: {}
+            for i in range(int((open_hour - fetch_begin) / HOUR) + 1)
+        }
+        for equipment_id, hour, avg in await fetch(fetch_begin, now, None):
+            fresh.setdefault(hour, {})[equipment_id] = avg
+
+        # Changed hours are replaced as a whole, equipment whose rows were all
+        # deleted disappear from them
+        for hour in changed:
+            fresh[hour] = {}
+            for equipment_id, _, avg in await fetch(hour, hour + HOUR, None):
+                fresh[hour][equipment_id] = avg
+
+        with self._lock:
+            for hour, values in fresh.items():
+                if hour < open_hour:
+                    self._buckets[hour] = values
+                    self._watermarks[hour] = watermarks.get(hour, 0)
+            window = {
+                hour: dict(self._buckets.get(hour, {}))
+                for hour in (
+                    first_hour + i * HOUR for i in range(self.window_hours - 1)
+                )
+            }
+        window[open_hour] = fresh.get(open_hour, {})
+
+        rows = [
+            {"equipment_id": equipment_id, "date_trunc": hour, "avg": avg}
+            for hour, values in window.items()
+            for equipment_id, avg in values.items()
+            if not equipment_ids or equipment_id in equipment_ids
+        ]
+        rows.sort(key=lambda row: (row["equipment_id"], row["date_trunc"]))
+        return rows
+
+
+# Shared by all requests handled by this worker
+line_chart_cache = HourlyBucketCache(window_hours=24)
+
+
+async def prune_hour_watermarks(prune: Callable[[datetime], Awaitable[int]]) -> None:
+    """
+    Deletes the old hour watermarks every HOUR_WATERMARK_PRUNE_SECONDS, with
+    prune(before). Kept out of the sensor_data triggers, so the writes don't
+    all contend on the same deletes.
+    """
+    while True:
+        try:
+            before = datetime.now() - timedelta(
+                days=settings.HOUR_WATERMARK_RETENTION_DAYS
+            )
+            deleted = await prune(before)
+            logger.debug(f"Pruned {deleted} hour watermarks before {before}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Only costs some space, retried next time
+            logger.warning(f"Could not prune the hour watermarks: {e}")
+        await asyncio.sleep(settings.HOUR_WATERMARK_PRUNE_SECONDS)
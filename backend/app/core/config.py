@@ -1,3 +1,4 @@
+import ipaddress
 import secrets
 import warnings
 from typing import Annotated, Any, Literal
@@ -48,6 +49,51 @@ class Settings(BaseSettings):
 
     PROJECT_NAME: str
     SENTRY_DSN: HttpUrl | None = None
+
+    # Directory where each worker writes a snapshot of its metrics, so /metrics
+    # reports all the workers of the host. Must be emptied before the workers
+    # start. Only the answering worker is reported when not set.
+    METRICS_MULTIPROC_DIR: str | None = None
+    METRICS_FLUSH_SECONDS: float = 5.0
+    # Bearer token of the scraper of /metrics, only superusers can read it otherwise
+    METRICS_TOKEN: str | None = None
+
+    # Statements slower than this are kept, with their parameters and route, in
+    # a ring buffer of SLOW_QUERY_LOG_SIZE entries per worker
+    SLOW_QUERY_THRESHOLD_SECONDS: float = 1.0
+    SLOW_QUERY_LOG_SIZE: int = 200
+    # The parameters may be emails, password hashes or API key hashes, only
+    # turn this on where those can be read by the superusers
+    SLOW_QUERY_LOG_PARAMETERS: bool = False
+    SLOW_QUERY_MAX_PARAMETERS_LENGTH: int = 1000
+    # Captures the plan of the slow SELECTs with EXPLAIN (ANALYZE, BUFFERS), which
+    # runs them again, in the background and on the primary
+    SLOW_QUERY_EXPLAIN: bool = False
+    SLOW_QUERY_EXPLAIN_QUEUE_SIZE: int = 4
+    SLOW_QUERY_EXPLAIN_TIMEOUT_SECONDS: float = 30.0
+
+    # Superusers sending this header get their request profiled, the profile is
+    # kept in a store of PROFILE_STORE_SIZE per worker, see /utils/profiles/
+    PROFILE_HEADER: str = "X-Profile"
+    PROFILE_SAMPLE_INTERVAL_SECONDS: float = 0.001
+    PROFILE_STORE_SIZE: int = 20
+
+    # Directory where each worker records the requests to TRAFFIC_RECORD_PATHS
+    # (relative to API_V1_STR), for app.benchmarks.replay. Off when not set.
+    TRAFFIC_RECORD_DIR: str | None = None
+    TRAFFIC_RECORD_PATHS: list[str] = ["/sensor-data"]
+    # Larger bodies (e.g. big CSV files) are left out of the recording
+    TRAFFIC_RECORD_MAX_BODY_BYTES: int = 1_000_000
+
+    # Responses from this size on are compressed (gzip, or brotli when the brotli
+    # package is installed and accepted) for the clients accepting it
+    RESPONSE_COMPRESSION_MIN_BYTES: int = 1000
+    RESPONSE_COMPRESSION_LEVEL: int = 6
+    # Serialized and compressed bodies of the dashboard and options responses,
+    # by ETag, per worker (see core/encoded.py)
+    ENCODED_RESPONSE_CACHE_SIZE: int = 32
+    ENCODED_RESPONSE_CACHE_TTL_SECONDS: float = 3600.0
+
     POSTGRES_SERVER: str
     POSTGRES_PORT: int = 5432
     POSTGRES_USER: str
@@ -66,6 +112,118 @@ class Settings(BaseSettings):
             path=self.POSTGRES_DB,
         )
 
+    # Connection pool of each engine, per worker process. With PgBouncer in
+    # transaction mode, enable POSTGRES_PGBOUNCER_MODE (no server-side prepared
+    # statements) and possibly POSTGRES_NULL_POOL to leave pooling to PgBouncer.
+    POSTGRES_POOL_SIZE: int = 5
+    POSTGRES_POOL_MAX_OVERFLOW: int = 10
+    POSTGRES_POOL_RECYCLE_SECONDS: int = 1800
+    POSTGRES_POOL_PRE_PING: bool = True
+    POSTGRES_POOL_TIMEOUT_SECONDS: float = 30.0
+    POSTGRES_PGBOUNCER_MODE: bool = False
+    # psycopg prepares a statement server-side once it ran this many times on a
+    # connection (ignored in POSTGRES_PGBOUNCER_MODE)
+    POSTGRES_PREPARE_THRESHOLD: int = 2
+    POSTGRES_NULL_POOL: bool = False
+
+    # statement_timeout of the queries, per route name (the endpoint function),
+    # in seconds. Routes not listed get STATEMENT_TIMEOUT_SECONDS.
+    STATEMENT_TIMEOUT_SECONDS: float = 30.0
+    STATEMENT_TIMEOUTS: dict[str, float] = {
+        "read_sensor_data_for_bar_chart": 10.0,
+        "read_sensor_data_for_line_chart": 10.0,
+        "create_sensor_data_from_csv": 120.0,
+    }
+    # How often long requests check whether their client is still connected
+    DISCONNECT_CHECK_INTERVAL_SECONDS: float = 0.5
+
+    # bcrypt cost of the password hashes. Existing hashes are rehashed with the
+    # new cost on the next login of their user.
+    PASSWORD_HASH_ROUNDS: int = 12
+    # Processes hashing and verifying passwords in each worker, 0 runs them inline
+    PASSWORD_HASH_WORKERS: int = 2
+
+    # Token buckets limiting the login attempts, checked before the password is
+    # verified: bursts of LOGIN_*_BURST attempts, refilled at LOGIN_*_PER_MINUTE
+    LOGIN_RATE_LIMIT_ENABLED: bool = True
+    LOGIN_IP_BURST: int = 20
+    LOGIN_IP_PER_MINUTE: float = 20.0
+    LOGIN_ACCOUNT_BURST: int = 10
+    LOGIN_ACCOUNT_PER_MINUTE: float = 5.0
+    # SQLite file holding the buckets, shared by the workers of the host. The
+    # buckets are kept in each worker's memory when not set.
+    LOGIN_RATE_LIMIT_STORE: str | None = None
+    # Addresses or networks of the reverse proxies (Traefik) in front of the
+    # app, as a comma separated list. Their X-Forwarded-For is trusted to get
+    # the client address, anybody else's is ignored.
+    TRUSTED_PROXIES: Annotated[list[str] | str, BeforeValidator(parse_cors)] = [
+        "127.0.0.1",
+        "::1",
+    ]
+
+    @computed_field  # type: ignore[prop-decorator]
+    @property
+    def trusted_proxy_networks(
+        self,
+    ) -> list[ipaddress.IPv4Network | ipaddress.IPv6Network]:
+        return [
+            ipaddress.ip_network(proxy, strict=False) for proxy in self.TRUSTED_PROXIES
+        ]
+
+    # How often each worker reloads the API keys, i.e. the longest delay for a
+    # revoked key to be refused by the other workers
+    API_KEY_REFRESH_SECONDS: float = 30.0
+
+    # The hour watermarks (sensor_data_hour_watermark) older than this are out of
+    # any line chart window, each worker deletes them every HOUR_WATERMARK_PRUNE_SECONDS
+    HOUR_WATERMARK_RETENTION_DAYS: int = 7
+    HOUR_WATERMARK_PRUNE_SECONDS: float = 3600.0
+
+    # Users resolved from the access token, by id, in each worker. Invalidated on
+    # every update or delete through Postgres LISTEN/NOTIFY. 0 disables it.
+    USER_CACHE_SIZE: int = 1024
+    USER_CACHE_TTL_SECONDS: float = 60.0
+    # Verified access token payloads, kept at most until the token expires
+    TOKEN_CACHE_SIZE: int = 4096
+    TOKEN_CACHE_TTL_SECONDS: float = 300.0
+
+    # Dashboard aggregations estimated (by the planner) above this cost are either
+    # computed over a sample of the table, flagged as approximate in the response,
+    # or rejected. Ranges up to DASHBOARD_COST_CHECK_MIN_HOURS are never checked.
+    DASHBOARD_COST_BUDGET: float = 500_000.0
+    DASHBOARD_OVER_BUDGET: Literal["approximate", "reject"] = "approximate"
+    # Requests that would need a smaller sample than this are rejected
+    DASHBOARD_MIN_SAMPLE_PERCENT: float = 1.0
+    DASHBOARD_COST_CHECK_MIN_HOURS: int = 48
+    # Exact bar charts over ranges longer than DASHBOARD_PARALLEL_MIN_HOURS are
+    # split in this many time slices, aggregated concurrently on their own pooled
+    # connections (keep it below POSTGRES_POOL_SIZE). 1 disables it.
+    DASHBOARD_PARALLEL_SLICES: int = 4
+    DASHBOARD_PARALLEL_MIN_HOURS: int = 168
+    # Sample of the bar chart when the client asks for accuracy=approximate
+    DASHBOARD_APPROXIMATE_SAMPLE_PERCENT: float = 1.0
+
+    # Optional read replicas, as a comma separated list of DSNs. Read-only routes
+    # (list, options, dashboards) are routed to them.
+    POSTGRES_REPLICA_URIS: Annotated[
+        list[PostgresDsn] | str, BeforeValidator(parse_cors)
+    ] = []
+    POSTGRES_REPLICA_SELECTION: Literal["round_robin", "least_connections"] = (
+        "round_robin"
+    )
+    # Replicas lagging more than this are skipped, falling back to the primary
+    POSTGRES_REPLICA_MAX_LAG_SECONDS: float = 5.0
+    POSTGRES_REPLICA_LAG_CHECK_SECONDS: float = 5.0
+
+    @computed_field  # type: ignore[prop-decorator]
+    @property
+    def SQLALCHEMY_REPLICA_URIS(self) -> list[str]:
+        # Replicas are always accessed through psycopg, whatever the given scheme
+        return [
+            "postgresql+psycopg://" + str(uri).split("://", 1)[1]
+            for uri in self.POSTGRES_REPLICA_URIS
+        ]
+
     SMTP_TLS: bool = True
     SMTP_SSL: bool = False
     SMTP_PORT: int = 587
@@ -84,6 +242,18 @@ class Settings(BaseSettings):
 
     EMAIL_RESET_TOKEN_EXPIRE_HOURS: int = 48
 
+    # Emails are enqueued in the email_outbox table by the request handlers and
+    # delivered by a background sender, over one SMTP connection kept open
+    # while there is mail to send
+    EMAIL_OUTBOX_POLL_SECONDS: float = 2.0
+    EMAIL_OUTBOX_BATCH_SIZE: int = 20
+    EMAIL_SMTP_IDLE_SECONDS: float = 60.0
+    # Failed sends are retried with an exponential backoff, starting at
+    # EMAIL_RETRY_BACKOFF_SECONDS, until EMAIL_SEND_MAX_ATTEMPTS
+    EMAIL_SEND_MAX_ATTEMPTS: int = 6
+    EMAIL_RETRY_BACKOFF_SECONDS: float = 30.0
+    EMAIL_RETRY_MAX_BACKOFF_SECONDS: float = 3600.0
+
     @computed_field  # type: ignore[prop-decorator]
     @property
     def emails_enabled(self) -> bool:
@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any
+
+from fastapi import HTTPException
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import async_crud
+from app.core.config import settings
+from app.crud import average_by_equipment_query
+
+# Protects the database from dashboard aggregations over huge ranges (ALL_TIME
+# with no equipment filter), estimated from the planner statistics before running.
+
+
+@dataclass
+class CostEstimate:
+    # Planner cost units, and rows the scan is expected to read
+    cost: float
+    rows: int
+    interval: timedelta
+    equipment_count: int | None
+
+    @property
+    def over_budget(self) -> bool:
+        return self.cost > settings.DASHBOARD_COST_BUDGET
+
+    @property
+    def sample_percent(self) -> float:
+        # Share of the table pages that brings the scan back within the budget
+        return min(100.0, 100.0 * settings.DASHBOARD_COST_BUDGET / self.cost)
+
+    def describe(self) -> str:
+        equipments = (
+            "all equipment"
+            if self.equipment_count is None
+            else f"{self.equipment_count} equipment"
+        )
+        return (
+            f"about {self.rows:,} rows over {self.interval.days} days for {equipments}"
+        )
+
+
+def _scanned_rows(plan: dict[str, Any]) -> int:
+    # The scan nodes are the ones reading the most rows
+    return max(
+        [
+            int(plan["Plan Rows"]),
+            *[_scanned_rows(child) for child in plan.get("Plans", [])],
+        ]
+    )
+
+
+async def estimate_bar_chart_cost(
+    *,
+    session: AsyncSession,
+    begin: datetime,
+    end: datetime,
+    equipment_ids: list[str] | None = None,
+) -> CostEstimate | None:
+    """
+    Estimated cost of the bar chart aggregation, or None for ranges short enough
+    to always be cheap, which skip the EXPLAIN round trip.
+    """
+    interval = end - begin
+    if interval <= timedelta(hours=settings.DASHBOARD_COST_CHECK_MIN_HOURS):
+        return None
+
+    plan = await async_crud.explain(
+        session=session, query=average_by_equipment_query(begin, end, equipment_ids)
+    )
+    return CostEstimate(
+        cost=float(plan["Total Cost"]),
+        rows=_scanned_rows(plan),
+        interval=interval,
+        equipment_count=len(equipment_ids) if equipment_ids else None,
+    )
+
+
+def check_bar_chart_cost(estimate: CostEstimate | None) -> float | None:
+    """
+    The sample percentage the bar chart must fall back to, None when it can run
+    exactly. Raises a 400 when the request is over budget and can't be sampled.
+    """
+    if estimate is None or not estimate.over_budget:
+        return None
+
+    percent = estimate.sample_percent
+    if (
+        settings.DASHBOARD_OVER_BUDGET == "reject"
+        or percent < settings.DASHBOARD_MIN_SAMPLE_PERCENT
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": "query_too_expensive",
+                "message": f"This request would aggregate {estimate.describe()}, which is "
+                "over the dashboard budget. Select a shorter time interval or "
+                "filter by equipment.",
+                "estimated_rows": estimate.rows,
+                "estimated_cost": estimate.cost,
+                "budget": settings.DASHBOARD_COST_BUDGET,
+            },
+        )
+    return percent
@@ -1,10 +1,39 @@
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import Session, create_engine, select
 
 from app import crud
 from app.core.config import settings
+from app.core.pool import engine_options, register_pool_metrics
+from app.core.replicas import ReadReplicaRouter
 from app.models import User, UserCreate
 
-engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+engine = create_engine(
+    str(settings.SQLALCHEMY_DATABASE_URI), **engine_options("primary")
+)
+
+# Same database through psycopg's async driver, used by the async routes
+async_engine = create_async_engine(
+    str(settings.SQLALCHEMY_DATABASE_URI), **engine_options("primary-async", is_async=True)
+)
+
+replica_engines = [
+    create_async_engine(uri, **engine_options(f"replica-{index}", is_async=True))
+    for (index, uri) in enumerate(settings.SQLALCHEMY_REPLICA_URIS)
+]
+
+register_pool_metrics(engine, "primary")
+register_pool_metrics(async_engine, "primary-async")
+for (index, replica_engine) in enumerate(replica_engines):
+    register_pool_metrics(replica_engine, f"replica-{index}")
+
+# Engine selection for the read-only routes, see get_async_read_db
+read_router = ReadReplicaRouter(
+    primary=async_engine,
+    replicas=replica_engines,
+    selection=settings.POSTGRES_REPLICA_SELECTION,
+    max_lag_seconds=settings.POSTGRES_REPLICA_MAX_LAG_SECONDS,
+    lag_check_seconds=settings.POSTGRES_REPLICA_LAG_CHECK_SECONDS,
+)
 
 
 def init_db(session: Session) -> None:
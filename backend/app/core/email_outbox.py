@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Callable
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+from app import crud
+from app.core import metrics
+from app.core.config import settings
+from app.models import EmailOutbox, EmailOutboxStatus
+from app.utils import get_smtp_options, send_email
+
+# Imported by the first sender only, see app/utils.py
+if TYPE_CHECKING:
+    from emails.backend import SMTPBackend  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """
+    Exponential backoff after the given number of failed attempts, jittered so
+    the emails that failed together (e.g. while the SMTP server was down) are
+    not all retried at once.
+    """
+    delay = min(
+        settings.EMAIL_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1),
+        settings.EMAIL_RETRY_MAX_BACKOFF_SECONDS,
+    )
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def _smtp_backend() -> "SMTPBackend":
+    from emails.backend import SMTPBackend  # type: ignore
+
+    # fail_silently=False so failures raise and the email is retried
+    return SMTPBackend(fail_silently=False, **get_smtp_options())
+
+
+class EmailOutboxSender:
+    """
+    Delivers the emails of the email_outbox table. One sender runs per worker,
+    they share the work through SKIP LOCKED.
+
+    The SMTP connection is reused from one email to the next, and closed once
+    idle for EMAIL_SMTP_IDLE_SECONDS or after an error.
+    """
+
+    def __init__(
+        self, engine: Engine, smtp_factory: Callable[[], "SMTPBackend"] = _smtp_backend
+    ):
+        self.engine = engine
+        self.smtp_factory = smtp_factory
+        self._smtp: SMTPBackend | None = None
+        self._last_used = 0.0
+
+    def _get_smtp(self) -> "SMTPBackend":
+        if self._smtp is None:
+            self._smtp = self.smtp_factory()
+        self._last_used = time.monotonic()
+        return self._smtp
+
+    def close(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.close()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def _send(self, email: EmailOutbox) -> None:
+        send_email(
+            email_to=email.email_to,
+            subject=email.subject,
+            html_content=email.html_content,
+            smtp=self._get_smtp(),
+        )
+
+    def send_pending(self) -> int:
+        """
+        Sends a batch of due emails, returns how many were attempted.
+        """
+        now = datetime.utcnow()
+        with Session(self.engine) as session:
+            emails = crud.claim_pending_emails(
+                session=session, now=now, limit=settings.EMAIL_OUTBOX_BATCH_SIZE
+            )
+            for email in emails:
+                try:
+                    self._send(email)
+                except Exception as e:
+                    # The connection may be left in any state, start over
+                    self.close()
+                    email.attempts += 1
+                    email.last_error = str(e)[:1000]
+                    if email.attempts >= settings.EMAIL_SEND_MAX_ATTEMPTS:
+                        email.status = EmailOutboxStatus.FAILED
+                        metrics.emails_sent.labels(status="failed").inc()
+                        logger.error(f"Giving up sending email {email.id}: {e}")
+                    else:
+                        email.next_attempt_at = now + retry_delay(email.attempts)
+                        metrics.emails_sent.labels(status="retry").inc()
+                        logger.warning(
+                            f"Could not send email {email.id}, will retry: {e}"
+                        )
+                    session.add(email)
+                else:
+                    session.delete(email)
+                    metrics.emails_sent.labels(status="sent").inc()
+            session.commit()
+        return len(emails)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                attempted = await asyncio.to_thread(self.send_pending)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Could not process the email outbox: {e}")
+                attempted = 0
+            if attempted >= settings.EMAIL_OUTBOX_BATCH_SIZE:
+                # Probably more waiting
+                continue
+            if (
+                self._smtp is not None
+                and time.monotonic() - self._last_used
+                > settings.EMAIL_SMTP_IDLE_SECONDS
+            ):
+                await asyncio.to_thread(self.close)
+            await asyncio.sleep(settings.EMAIL_OUTBOX_POLL_SECONDS)
@@ -0,0 +1,119 @@
+import gzip
+from dataclasses import dataclass, field
+from typing import Any
+
+import orjson
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.etag import set_etag
+from app.core.user_cache import TTLCache
+
+try:
+    import brotli  # type: ignore[import-not-found]
+except ImportError:  # optional, only gzip is offered without it
+    brotli = None
+
+# The biggest responses (dashboards, options) are cached already serialized and
+# compressed, by ETag: a cached request costs no JSON encoding and no
+# compression. The ETag changes with everything the response depends on, so
+# the entries never need invalidating, stale ones just fall out of the LRU.
+#
+# The ETags change with every insert though, so while gateways are sending data
+# the entries are encoded about as often as they are served: moderate levels.
+# Brotli 5 costs about the same as gzip 6, for smaller bodies. The uncached
+# responses are compressed per request by GZipMiddleware.
+BROTLI_QUALITY = 5
+
+# Preferred first, when the client accepts both with the same q
+ENCODINGS = ("br", "gzip")
+
+
+@dataclass(frozen=True)
+class EncodedBody:
+    identity: bytes
+    # Compressed variants of identity, by content coding
+    variants: dict[str, bytes] = field(default_factory=dict)
+
+
+def encode_json(content: Any) -> EncodedBody:
+    # Same options as ORJSONResponse
+    body = orjson.dumps(
+        content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    )
+    if len(body) < settings.RESPONSE_COMPRESSION_MIN_BYTES:
+        return EncodedBody(body)
+    variants = {
+        "gzip": gzip.compress(
+            body, compresslevel=settings.RESPONSE_COMPRESSION_LEVEL, mtime=0
+        )
+    }
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return EncodedBody(body, variants)
+
+
+def accepted_encodings(accept_encoding: str) -> dict[str, float]:
+    # Content codings of an Accept-Encoding header, with their q value
+    accepted = {}
+    for part in accept_encoding.split(","):
+        (coding, _, params) = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            (name, _, value) = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def pick_encoding(accept_encoding: str, available: dict[str, bytes]) -> str | None:
+    accepted = accepted_encodings(accept_encoding)
+    candidates = [
+        (accepted.get(coding, accepted.get("*", 0.0)), -ENCODINGS.index(coding), coding)
+        for coding in ENCODINGS
+        if coding in available
+    ]
+    candidates = [candidate for candidate in candidates if candidate[0] > 0]
+    return max(candidates)[2] if candidates else None
+
+
+# Encoded bodies by ETag
+encoded_response_cache = TTLCache(
+    settings.ENCODED_RESPONSE_CACHE_SIZE,
+    settings.ENCODED_RESPONSE_CACHE_TTL_SECONDS,
+    name="encoded_response",
+)
+
+
+async def encode_and_cache(etag: str, content: Any) -> EncodedBody:
+    # Compressing a large body is CPU bound, keep it off the event loop
+    body = await run_in_threadpool(encode_json, content)
+    encoded_response_cache.set(etag, body)
+    return body
+
+
+def encoded_response(request: Request, body: EncodedBody, etag: str) -> Response:
+    """
+    The variant of body best accepted by the client. All the variants keep the
+    same ETag, as with GZipMiddleware: the responses are private and Vary on
+    Accept-Encoding, so a browser only revalidates the variant it has.
+    """
+    coding = pick_encoding(request.headers.get("accept-encoding", ""), body.variants)
+    headers = {"Vary": "Accept-Encoding"}
+    if coding is not None:
+        headers["Content-Encoding"] = coding
+    response = Response(
+        body.variants[coding] if coding is not None else body.identity,
+        media_type="application/json",
+        headers=headers,
+    )
+    set_etag(response, etag)
+    return response
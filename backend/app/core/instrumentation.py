@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.profiling import current_profile
+from app.core.slow_queries import slow_query_log
+
+logger = logging.getLogger(__name__)
+
+# Request metrics, and the duration and rows of every statement attributed to
+# the route that ran it, the slow ones being also kept in the slow query log.
+# Kept cheap enough to stay on under full load: a few perf_counter calls and
+# histogram observations per request and per statement.
+
+# Scope of the request being handled, the route is only known once routed
+_request_scope: ContextVar[Scope | None] = ContextVar("request_scope", default=None)
+
+
+def route_name(scope: Scope | None) -> str:
+    """
+    The operation id of the matched route (see custom_generate_unique_id),
+    "unmatched" for 404s, "background" outside of any request.
+    """
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return (
+        getattr(route, "unique_id", None) or getattr(route, "name", None) or "unmatched"
+    )
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware, BaseHTTPMiddleware would buffer the streamed CSV and
+    cost a task per request.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        token = _request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_scope.reset(token)
+            route = route_name(scope)
+            metrics.http_request_duration.labels(
+                route=route, method=scope["method"], status=str(status)
+            ).observe(time.perf_counter() - start)
+            metrics.http_response_size.labels(route=route).observe(size)
+
+
+def _operation(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "OTHER"
+
+
+@event.listens_for(Engine, "before_cursor_execute", named=True)
+def _start_query_timer(**kw: Any) -> None:
+    kw["conn"].info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute", named=True)
+def _observe_query(**kw: Any) -> None:
+    (conn, cursor, statement) = (kw["conn"], kw["cursor"], kw["statement"])
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    profile = current_profile.get()
+    if profile is not None:
+        profile.db_wait_seconds += elapsed
+        profile.statements += 1
+    route = route_name(_request_scope.get())
+    operation = _operation(statement)
+    metrics.db_query_duration.labels(route=route, operation=operation).observe(elapsed)
+    if cursor.rowcount >= 0:
+        metrics.db_query_rows.labels(route=route, operation=operation).observe(
+            cursor.rowcount
+        )
+    # The EXPLAINs of the slow query log are slow by construction
+    if elapsed >= settings.SLOW_QUERY_THRESHOLD_SECONDS and operation != "EXPLAIN":
+        metrics.db_slow_queries.labels(route=route).inc()
+        slow_query_log.record(
+            statement=statement,
+            parameters=kw["parameters"],
+            route=route,
+            duration_seconds=elapsed,
+            operation=operation,
+            executemany=kw["executemany"],
+        )
+
+
+@event.listens_for(Engine, "handle_error")
+def _forget_failed_query(context: Any) -> None:
+    starts = context.connection.info.get("query_start") if context.connection else None
+    if starts:
+        starts.pop()
+
+
+async def flush_metrics(directory: str) -> None:
+    """
+    Writes this worker's snapshot every METRICS_FLUSH_SECONDS, for the worker
+    answering the scrapes.
+    """
+    while True:
+        try:
+            await asyncio.to_thread(metrics.write_snapshot, directory)
+        except OSError as e:
+            logger.warning(f"Could not write the metrics snapshot: {e}")
+        await asyncio.sleep(settings.METRICS_FLUSH_SECONDS)
@@ -0,0 +1,476 @@
+import bisect
+import fcntl
+import json
+import os
+import threading
+import uuid
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+# Minimal in-process metrics registry. The API mirrors prometheus_client
+# (Counter(...).labels(...).inc()) so the backing store can be swapped later.
+#
+# Each gunicorn worker has its own registry. With a multiprocess directory set,
+# the workers periodically write a snapshot of their values there, and the
+# worker answering a scrape merges them (see collect_all), like the
+# multiprocess mode of prometheus_client. The counters and histograms of the
+# workers that exited are folded into a single archive.
+
+REGISTRY: list["_Metric"] = []
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self) -> list[dict[str, Any]]:
+        raise NotImplementedError
+
+    def collect(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "documentation": self.documentation,
+            "type": self.type,
+            "samples": self.samples(),
+        }
+
+
+class _CounterChild:
+    def __init__(self, counter: "Counter", key: tuple[str, ...]):
+        self._counter = counter
+        self._key = key
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._counter._lock:
+            self._counter._values[self._key] = (
+                self._counter._values.get(self._key, 0.0) + amount
+            )
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def labels(self, **labels: str) -> _CounterChild:
+        return _CounterChild(self, self._key(labels))
+
+    def inc(self, amount: float = 1.0) -> None:
+        _CounterChild(self, ()).inc(amount)
+
+    def samples(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [
+                {"labels": dict(zip(self.labelnames, key, strict=True)), "value": value}
+                for key, value in self._values.items()
+            ]
+
+
+class _GaugeChild:
+    def __init__(self, gauge: "Gauge", key: tuple[str, ...]):
+        self._gauge = gauge
+        self._key = key
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        # The value is read from the function on every collection
+        with self._gauge._lock:
+            self._gauge._functions[self._key] = function
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._functions: dict[tuple[str, ...], Callable[[], float]] = {}
+
+    def labels(self, **labels: str) -> _GaugeChild:
+        return _GaugeChild(self, self._key(labels))
+
+    def samples(self) -> list[dict[str, Any]]:
+        with self._lock:
+            functions = list(self._functions.items())
+        return [
+            {
+                "labels": dict(zip(self.labelnames, key, strict=True)),
+                "value": function(),
+            }
+            for key, function in functions
+        ]
+
+
+class _HistogramChild:
+    def __init__(self, histogram: "Histogram", key: tuple[str, ...]):
+        self._histogram = histogram
+        self._key = key
+
+    def observe(self, value: float) -> None:
+        histogram = self._histogram
+        with histogram._lock:
+            (counts, total) = histogram._values.get(
+                self._key, ([0] * (len(histogram.buckets) + 1), 0.0)
+            )
+            counts[bisect.bisect_left(histogram.buckets, value)] += 1
+            histogram._values[self._key] = (counts, total + value)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+    DEFAULT_BUCKETS = (
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.075,
+        0.1,
+        0.25,
+        0.5,
+        0.75,
+        1.0,
+        2.5,
+        5.0,
+        7.5,
+        10.0,
+    )
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # key -> (count per bucket, the last one being +Inf, sum of observations)
+        self._values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+
+    def labels(self, **labels: str) -> _HistogramChild:
+        return _HistogramChild(self, self._key(labels))
+
+    def observe(self, value: float) -> None:
+        _HistogramChild(self, ()).observe(value)
+
+    def samples(self) -> list[dict[str, Any]]:
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            ]
+        samples = []
+        for key, counts, total in values:
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip([*self.buckets, "+Inf"], counts, strict=True):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            samples.append(
+                {
+                    "labels": dict(zip(self.labelnames, key, strict=True)),
+                    "buckets": buckets,
+                    "count": cumulative,
+                    "sum": total,
+                }
+            )
+        return samples
+
+
+def collect() -> list[dict[str, Any]]:
+    return [metric.collect() for metric in REGISTRY]
+
+
+# Snapshots are named {pid}-{id}.json: a new worker reusing the pid of one that
+# exited doesn't overwrite its values
+_WORKER_ID = uuid.uuid4().hex[:8]
+ARCHIVE_NAME = "archive.json"
+
+
+def _snapshot_name() -> str:
+    return f"{os.getpid()}-{_WORKER_ID}.json"
+
+
+def write_snapshot(directory: str) -> None:
+    """
+    Writes the values of this worker for the others to merge. Replaced
+    atomically, a scrape never reads a partial file.
+    """
+    path = Path(directory) / _snapshot_name()
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(json.dumps(collect()))
+    os.replace(temporary, path)
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(metric: dict[str, Any], samples: list[dict[str, Any]]) -> None:
+    merged = {
+        tuple(sorted(sample["labels"].items())): sample for sample in metric["samples"]
+    }
+    for sample in samples:
+        key = tuple(sorted(sample["labels"].items()))
+        current = merged.get(key)
+        if current is None:
+            merged[key] = sample
+        elif metric["type"] == "histogram":
+            merged[key] = {
+                "labels": sample["labels"],
+                "buckets": {
+                    bound: count + sample["buckets"].get(bound, 0)
+                    for bound, count in current["buckets"].items()
+                },
+                "count": current["count"] + sample["count"],
+                "sum": current["sum"] + sample["sum"],
+            }
+        else:
+            merged[key] = {
+                "labels": sample["labels"],
+                "value": current["value"] + sample["value"],
+            }
+    metric["samples"] = list(merged.values())
+
+
+def _read_json(path: Path, default: Any) -> Any:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return default
+
+
+def archive_exited(directory: str) -> None:
+    """
+    Folds the counters and histograms of the workers that exited into the
+    archive, and deletes their snapshots, so they don't pile up with each
+    respawn. The archive remembers the snapshots it folded: one left behind
+    by an interrupted run isn't counted twice.
+    """
+    root = Path(directory)
+    with open(root / "archive.lock", "w") as lock:
+        # Another worker may be answering a scrape too
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        exited = [
+            path
+            for path in root.glob("*-*.json")
+            if not _is_alive(int(path.stem.split("-")[0]))
+        ]
+        if not exited:
+            return
+        archive = _read_json(root / ARCHIVE_NAME, {"snapshots": [], "metrics": []})
+        by_name = {metric["name"]: metric for metric in archive["metrics"]}
+        for path in exited:
+            if path.name in archive["snapshots"]:
+                continue
+            for other in _read_json(path, []):
+                if other["type"] == "gauge":
+                    continue
+                metric = by_name.setdefault(
+                    other["name"],
+                    {"name": other["name"], "type": other["type"], "samples": []},
+                )
+                _merge(metric, other["samples"])
+        archive = {
+            # Only the snapshots that may still be there
+            "snapshots": [path.name for path in exited],
+            "metrics": list(by_name.values()),
+        }
+        temporary = root / "archive.tmp"
+        temporary.write_text(json.dumps(archive))
+        os.replace(temporary, root / ARCHIVE_NAME)
+        for path in exited:
+            path.unlink(missing_ok=True)
+
+
+def collect_all(directory: str | None) -> list[dict[str, Any]]:
+    """
+    The values of all workers: the live ones of this worker, the snapshots of
+    the others and the archive of those that exited. Counters and histograms of
+    workers that exited are kept, so the totals never go down, gauges are only
+    summed over the live workers.
+    """
+    metrics = collect()
+    if not directory:
+        return metrics
+
+    archive_exited(directory)
+    by_name = {metric["name"]: metric for metric in metrics}
+    snapshots = [
+        _read_json(path, [])
+        for path in Path(directory).glob("*-*.json")
+        if path.name != _snapshot_name()
+    ]
+    archived = _read_json(Path(directory) / ARCHIVE_NAME, {"metrics": []})["metrics"]
+    for snapshot in [*snapshots, archived]:
+        for other in snapshot:
+            metric = by_name.get(other["name"])
+            if metric is not None:
+                _merge(metric, other["samples"])
+    return metrics
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+        + "}"
+    )
+
+
+def generate_latest(metrics: list[dict[str, Any]]) -> str:
+    """
+    The metrics in the Prometheus text exposition format (version 0.0.4).
+    """
+    lines = []
+    for metric in metrics:
+        name = metric["name"]
+        lines.append(f"# HELP {name} {metric['documentation']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for sample in metric["samples"]:
+            labels = sample["labels"]
+            if metric["type"] == "histogram":
+                for bound, count in sample["buckets"].items():
+                    lines.append(
+                        f"{name}_bucket{_format_labels({**labels, 'le': bound})} {count}"
+                    )
+                lines.append(f"{name}_sum{_format_labels(labels)} {sample['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {sample['count']}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {sample['value']}")
+    return "\n".join(lines) + "\n"
+
+
+dashboard_query_executions = Counter(
+    "dashboard_query_executions_total",
+    "Dashboard queries actually executed against the database.",
+    ("query",),
+)
+dashboard_query_coalesced = Counter(
+    "dashboard_query_coalesced_total",
+    "Dashboard queries that waited for and shared an identical in-flight query.",
+    ("query",),
+)
+
+db_pool_checked_out = Gauge(
+    "db_pool_checked_out_connections",
+    "Connections currently checked out of the pool.",
+    ("pool",),
+)
+db_pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the pool.",
+    ("pool",),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0),
+)
+db_pool_overflow = Counter(
+    "db_pool_overflow_total",
+    "Connections opened beyond the pool size (max_overflow).",
+    ("pool",),
+)
+db_pool_timeouts = Counter(
+    "db_pool_timeouts_total",
+    "Checkouts that gave up after waiting pool_timeout seconds.",
+    ("pool",),
+)
+
+emails_sent = Counter(
+    "emails_sent_total",
+    "Outbox emails by outcome: sent, retried later, or failed for good.",
+    ("status",),
+)
+
+login_attempts_rejected = Counter(
+    "login_attempts_rejected_total",
+    "Login attempts rejected by the rate limiter, before verifying the password.",
+    ("scope",),
+)
+login_cpu_seconds_saved = Counter(
+    "login_cpu_seconds_saved_total",
+    "Estimated password verification time not spent on rejected login attempts.",
+)
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time to answer a request, by route (operation id), method and status.",
+    ("route", "method", "status"),
+)
+http_response_size = Histogram(
+    "http_response_size_bytes",
+    "Size of the response bodies, by route.",
+    ("route",),
+    buckets=(100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000),
+)
+db_query_duration = Histogram(
+    "db_query_duration_seconds",
+    "Time to execute a statement, by route and SQL operation.",
+    ("route", "operation"),
+    buckets=(
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+        30.0,
+    ),
+)
+db_query_rows = Histogram(
+    "db_query_rows",
+    "Rows returned (or affected) by a statement, by route and SQL operation.",
+    ("route", "operation"),
+    buckets=(0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000),
+)
+
+sensor_data_csv_rows = Counter(
+    "sensor_data_csv_rows_total",
+    "Rows of the imported CSV files, imported or rejected by validation.",
+    ("outcome",),
+)
+sensor_data_csv_import_duration = Histogram(
+    "sensor_data_csv_import_seconds",
+    "Time to parse, validate and insert a CSV file.",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+
+cache_requests = Counter(
+    "cache_requests_total",
+    "Cache lookups by cache and result (hit or miss). The line chart cache counts hours.",
+    ("cache", "result"),
+)
+
+db_slow_queries = Counter(
+    "db_slow_queries_total",
+    "Statements slower than SLOW_QUERY_THRESHOLD_SECONDS, by route.",
+    ("route",),
+)
@@ -0,0 +1,90 @@
+import time
+from typing import Any
+
+from sqlalchemy import exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+from app.core.config import settings
+from app.core.metrics import (
+    db_pool_checked_out,
+    db_pool_checkout_wait,
+    db_pool_overflow,
+    db_pool_timeouts,
+)
+
+
+class _InstrumentedPoolMixin:
+    """
+    Records the checkout wait time, overflow connections and timeouts of a QueuePool.
+
+    The pool is identified in the metrics by its logging name (pool_logging_name),
+    which is kept when the pool is recreated on engine.dispose().
+    """
+
+    def _do_get(self) -> Any:
+        name = self.logging_name or "default"  # type: ignore[attr-defined]
+        overflow = self.overflow()  # type: ignore[attr-defined]
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()  # type: ignore[misc]
+        except exc.TimeoutError:
+            db_pool_timeouts.labels(pool=name).inc()
+            raise
+        finally:
+            db_pool_checkout_wait.labels(pool=name).observe(time.perf_counter() - start)
+        # The overflow counter starts at -pool_size, it is positive beyond it
+        if self.overflow() > max(overflow, 0):  # type: ignore[attr-defined]
+            db_pool_overflow.labels(pool=name).inc()
+        return connection
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(name: str, *, is_async: bool = False) -> dict[str, Any]:
+    """
+    Keyword arguments for create_engine / create_async_engine, from the pool settings.
+    """
+    options: dict[str, Any] = {
+        "pool_pre_ping": settings.POSTGRES_POOL_PRE_PING,
+        "pool_logging_name": name,
+    }
+
+    # PgBouncer in transaction mode can't keep server-side prepared statements
+    # between transactions, so psycopg must never prepare them
+    if settings.POSTGRES_PGBOUNCER_MODE:
+        options["connect_args"] = {"prepare_threshold": None}
+    else:
+        options["connect_args"] = {
+            "prepare_threshold": settings.POSTGRES_PREPARE_THRESHOLD
+        }
+
+    if settings.POSTGRES_NULL_POOL:
+        # Every checkout opens a new connection, pooling is left to PgBouncer
+        options["poolclass"] = NullPool
+        return options
+
+    options.update(
+        poolclass=InstrumentedAsyncAdaptedQueuePool
+        if is_async
+        else InstrumentedQueuePool,
+        pool_size=settings.POSTGRES_POOL_SIZE,
+        max_overflow=settings.POSTGRES_POOL_MAX_OVERFLOW,
+        pool_recycle=settings.POSTGRES_POOL_RECYCLE_SECONDS,
+        pool_timeout=settings.POSTGRES_POOL_TIMEOUT_SECONDS,
+    )
+    return options
+
+
+def register_pool_metrics(engine: Engine | AsyncEngine, name: str) -> None:
+    # Reads engine.pool on every collection, as dispose() replaces the pool
+    db_pool_checked_out.labels(pool=name).set_function(
+        lambda: engine.pool.checkedout() if hasattr(engine.pool, "checkedout") else 0
+    )
@@ -0,0 +1,260 @@
+import contextvars
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from types import FrameType
+
+import jwt
+from fastapi.concurrency import run_in_threadpool
+from jwt.exceptions import InvalidTokenError
+from sqlmodel import Session
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app import crud
+from app.core import security
+from app.core.config import settings
+from app.core.db import engine
+
+# Sampling profiler of a single request, turned on by a superuser with the
+# PROFILE_HEADER request header. Requests without the header only pay for a
+# header lookup.
+#
+# A sampler thread reads the stacks of all threads every
+# PROFILE_SAMPLE_INTERVAL_SECONDS and keeps those running the profiled request:
+# on the event loop, the stacks going through the middleware frame of the
+# request, in the threadpool (sync routes, run_in_threadpool), the stacks of
+# threads running a context that carries the request's profile. The database
+# wait is measured exactly by the cursor events, see core/instrumentation.py.
+
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+# Checked in order, the first category with a frame in the stack wins: the
+# encoders call pydantic, the ORM calls the driver...
+CATEGORIES = (
+    (
+        "serialization",
+        (
+            "/fastapi/encoders.py",
+            "/starlette/responses.py",
+            "/fastapi/responses.py",
+            "/json/",
+        ),
+    ),
+    (
+        "db",
+        (
+            "/psycopg/",
+            "/sqlalchemy/engine/",
+            "/sqlalchemy/dialects/",
+            "/sqlalchemy/pool/",
+        ),
+    ),
+    ("orm", ("/sqlalchemy/orm/",)),
+    ("validation", ("/pydantic/", "/pydantic_core/", "/sqlmodel/", "/fastapi/_compat")),
+)
+
+current_profile: ContextVar["Profile | None"] = ContextVar(
+    "current_profile", default=None
+)
+
+
+@dataclass
+class Profile:
+    method: str
+    path: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    recorded_at: datetime = field(default_factory=datetime.utcnow)
+    route: str | None = None
+    status: int | None = None
+    duration_seconds: float = 0.0
+    samples: int = 0
+    # Exact, from the cursor events
+    db_wait_seconds: float = 0.0
+    statements: int = 0
+    # Sampled seconds by category, and samples by stack (root first) for the
+    # flame graph
+    categories: defaultdict[str, float] = field(
+        default_factory=lambda: defaultdict(float)
+    )
+    stacks: Counter[tuple[str, ...]] = field(default_factory=Counter)
+
+    def breakdown(self) -> dict[str, float]:
+        return {
+            category: self.categories.get(category, 0.0)
+            for category in [*(name for (name, _) in CATEGORIES), "other"]
+        }
+
+    def collapsed_stacks(self) -> str:
+        # The "folded" format of flamegraph.pl and speedscope
+        return "\n".join(
+            f"{';'.join(stack)} {count}" for (stack, count) in self.stacks.most_common()
+        )
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    filename = "/".join(code.co_filename.rsplit("/", 2)[-2:])
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _category(filenames: list[str]) -> str:
+    for category, patterns in CATEGORIES:
+        if any(pattern in filename for filename in filenames for pattern in patterns):
+            return category
+    return "other"
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, profile: Profile, marker: object):
+        super().__init__(name="request-profiler", daemon=True)
+        self.profile = profile
+        self.marker = marker
+        self._stop_event = threading.Event()
+
+    def _request_frames(self, frame: FrameType | None) -> list[FrameType] | None:
+        # The frames of the request, leaf first, None for other work
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            if frame.f_code is _MIDDLEWARE_CODE:
+                if frame.f_locals.get("marker") is self.marker:
+                    return frames
+            else:
+                for value in list(frame.f_locals.values()):
+                    if (
+                        type(value) is contextvars.Context
+                        and value.get(current_profile) is self.profile
+                    ):
+                        return frames
+            frame = frame.f_back
+        return None
+
+    def run(self) -> None:
+        own = threading.get_ident()
+        interval = settings.PROFILE_SAMPLE_INTERVAL_SECONDS
+        last = time.perf_counter()
+        while not self._stop_event.wait(interval):
+            # Each sample stands for the time since the previous one, which is
+            # longer than the interval when the GIL is busy
+            now = time.perf_counter()
+            (elapsed, last) = (now - last, now)
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = self._request_frames(frame)
+                if not frames:
+                    continue
+                frames.reverse()
+                self.profile.samples += 1
+                self.profile.categories[
+                    _category([f.f_code.co_filename for f in frames])
+                ] += elapsed
+                self.profile.stacks[tuple(_frame_label(f) for f in frames)] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+def _is_superuser(authorization: str | None) -> bool:
+    (scheme, _, token) = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        payload = jwt.decode(
+            token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
+        )
+    except InvalidTokenError:
+        return False
+    sub = payload.get("sub")
+    if not isinstance(sub, str):
+        return False
+    with Session(engine) as session:
+        user = crud.get_user_by_id(session=session, id=sub)
+        return bool(user and user.is_active and user.is_superuser)
+
+
+class ProfileStore:
+    """
+    The last maxsize profiles of this worker.
+    """
+
+    def __init__(self, maxsize: int):
+        self._profiles: deque[Profile] = deque(maxlen=maxsize)
+        self._lock = threading.Lock()
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+
+    def get(self, id: str) -> Profile | None:
+        with self._lock:
+            return next(
+                (profile for profile in self._profiles if profile.id == id), None
+            )
+
+    def list(self) -> list[Profile]:
+        with self._lock:
+            return list(reversed(self._profiles))
+
+
+profile_store = ProfileStore(settings.PROFILE_STORE_SIZE)
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._header = settings.PROFILE_HEADER.lower().encode("latin-1")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if not any(name == self._header for (name, _) in scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+        authorization = (
+            dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+        )
+        # Silently ignored for anybody else
+        if not await run_in_threadpool(_is_superuser, authorization):
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(method=scope["method"], path=scope["path"])
+        # Found by the sampler in this frame's locals
+        marker = object()
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (
+                        PROFILE_ID_HEADER.lower().encode("latin-1"),
+                        profile.id.encode("latin-1"),
+                    ),
+                ]
+            await send(message)
+
+        token = current_profile.set(profile)
+        sampler = _Sampler(profile, marker)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.duration_seconds = time.perf_counter() - start
+            sampler.stop()
+            current_profile.reset(token)
+            route = scope.get("route")
+            profile.route = getattr(route, "unique_id", None)
+            profile_store.add(profile)
+
+
+_MIDDLEWARE_CODE = ProfilingMiddleware.__call__.__code__
@@ -0,0 +1,209 @@
+import ipaddress
+import logging
+import math
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Protocol
+
+from fastapi import HTTPException, Request
+
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Admission control of the login endpoint. Every attempt costs a bcrypt
+# verification, the buckets reject the excess ones (e.g. credential stuffing)
+# before any of that CPU is spent.
+
+
+def take_token(
+    tokens: float | None,
+    updated_at: float,
+    capacity: float,
+    per_second: float,
+    now: float,
+) -> tuple[float, float]:
+    """
+    Refills the bucket for the time elapsed since updated_at and takes a token
+    from it. Returns the tokens left and the seconds to wait when it was empty
+    (0 when the token was taken). A missing bucket (None) is full.
+    """
+    if tokens is None:
+        tokens = capacity
+    else:
+        tokens = min(capacity, tokens + (now - updated_at) * per_second)
+    if tokens >= 1:
+        return (tokens - 1, 0.0)
+    return (tokens, (1 - tokens) / per_second)
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in settings.trusted_proxy_networks)
+
+
+def client_address(request: Request) -> str | None:
+    """
+    Address of the client, behind the trusted proxies. Each proxy appends the
+    address it got the request from to X-Forwarded-For, so the hops are walked
+    from the right and the first one not sent by a trusted proxy is the client.
+    The hops left of it may have been made up by the client itself.
+    """
+    if request.client is None:
+        return None
+    address = request.client.host
+    hops = [
+        hop.strip()
+        for header in request.headers.getlist("x-forwarded-for")
+        for hop in header.split(",")
+    ]
+    while hops and _is_trusted_proxy(address):
+        address = hops.pop()
+    return address or None
+
+
+class BucketStore(Protocol):
+    def take(self, key: str, capacity: float, per_second: float) -> float: ...
+
+
+class MemoryBucketStore:
+    """
+    Buckets of a single worker. The least recently used are dropped past
+    maxsize, a dropped bucket being as good as full anyway.
+    """
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, per_second: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            (tokens, updated_at) = self._buckets.get(key, (None, now))
+            (tokens, wait) = take_token(tokens, updated_at, capacity, per_second, now)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class SqliteBucketStore:
+    """
+    Buckets in a SQLite file, shared by all the workers of the host. Each
+    thread has its own connection, the read-modify-write of a bucket runs in an
+    IMMEDIATE transaction so concurrent workers can't both take the last token.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS login_bucket "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def take(self, key: str, capacity: float, per_second: float) -> float:
+        connection = self._connection()
+        # Wall clock, as the monotonic clock isn't comparable across processes
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT tokens, updated_at FROM login_bucket WHERE key = ?", (key,)
+            ).fetchone()
+            (tokens, updated_at) = row or (None, now)
+            (tokens, wait) = take_token(tokens, updated_at, capacity, per_second, now)
+            connection.execute(
+                "INSERT INTO login_bucket (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, "
+                "updated_at = excluded.updated_at",
+                (key, tokens, now),
+            )
+            # Now and then, forget the buckets that have had time to refill
+            if random.random() < 0.001:
+                connection.execute(
+                    "DELETE FROM login_bucket WHERE updated_at < ?",
+                    (now - capacity / per_second,),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+
+class LoginLimiter:
+    def __init__(self, store: BucketStore):
+        self.store = store
+        # Moving average of the password verification time, to report the CPU
+        # saved by each rejection
+        self.check_seconds = 0.0
+
+    def observe_check(self, seconds: float) -> None:
+        if self.check_seconds == 0.0:
+            self.check_seconds = seconds
+        else:
+            self.check_seconds += 0.1 * (seconds - self.check_seconds)
+
+    def _take(self, scope: str, key: str, burst: int, per_minute: float) -> float:
+        try:
+            return self.store.take(f"{scope}:{key}", burst, per_minute / 60)
+        except Exception as e:
+            # Better let the attempt through than lock everybody out
+            logger.warning(f"Login rate limiter unavailable: {e}")
+            return 0.0
+
+    def check(self, ip: str | None, account: str) -> None:
+        """
+        Takes a token from the buckets of the client IP and of the account.
+        Raises a 429 when either is empty.
+        """
+        if not settings.LOGIN_RATE_LIMIT_ENABLED:
+            return
+
+        buckets = [
+            (
+                "account",
+                account.lower(),
+                settings.LOGIN_ACCOUNT_BURST,
+                settings.LOGIN_ACCOUNT_PER_MINUTE,
+            ),
+        ]
+        if ip:
+            buckets.insert(
+                0, ("ip", ip, settings.LOGIN_IP_BURST, settings.LOGIN_IP_PER_MINUTE)
+            )
+        for scope, key, burst, per_minute in buckets:
+            wait = self._take(scope, key, burst, per_minute)
+            if wait > 0:
+                metrics.login_attempts_rejected.labels(scope=scope).inc()
+                metrics.login_cpu_seconds_saved.inc(self.check_seconds)
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many login attempts, please try again later",
+                    headers={"Retry-After": str(math.ceil(wait))},
+                )
+
+
+login_limiter = LoginLimiter(
+    SqliteBucketStore(settings.LOGIN_RATE_LIMIT_STORE)
+    if settings.LOGIN_RATE_LIMIT_STORE
+    else MemoryBucketStore()
+)
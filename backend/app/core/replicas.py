@@ -0,0 +1,100 @@
+import asyncio
+import itertools
+import logging
+import math
+import time
+from typing import Literal
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# Seconds since the last replayed transaction, or 0 when the replica has replayed
+# everything it received (an idle primary doesn't make the replica "late")
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class ReadReplicaRouter:
+    """
+    Chooses the engine used by read-only routes.
+
+    Replicas are selected by round robin or by least checked out connections,
+    skipping the ones whose replication lag is above max_lag_seconds. The lag is
+    measured in background tasks, every lag_check_seconds at most, so requests
+    never wait for it. Until a replica is first measured it is not used.
+    When no replica is usable, the primary is returned.
+    """
+
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replicas: list[AsyncEngine],
+        selection: Literal["round_robin", "least_connections"] = "round_robin",
+        max_lag_seconds: float = 5.0,
+        lag_check_seconds: float = 5.0,
+    ):
+        self.primary = primary
+        self.replicas = replicas
+        self.selection = selection
+        self.max_lag_seconds = max_lag_seconds
+        self.lag_check_seconds = lag_check_seconds
+        self._lag = [math.inf] * len(replicas)
+        self._checked_at = [-math.inf] * len(replicas)
+        self._checking: set[int] = set()
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._round_robin = itertools.count()
+
+    def choose(self, prefer_primary: bool = False) -> AsyncEngine:
+        if prefer_primary or not self.replicas:
+            return self.primary
+
+        self._schedule_lag_checks()
+        healthy = [
+            replica
+            for index, replica in enumerate(self.replicas)
+            if self._lag[index] <= self.max_lag_seconds
+        ]
+        if not healthy:
+            return self.primary
+
+        if self.selection == "least_connections":
+            return min(
+                healthy,
+                key=lambda replica: getattr(replica.pool, "checkedout", lambda: 0)(),
+            )
+        return healthy[next(self._round_robin) % len(healthy)]
+
+    def _schedule_lag_checks(self) -> None:
+        now = time.monotonic()
+        for index in range(len(self.replicas)):
+            if (
+                index in self._checking
+                or now - self._checked_at[index] < self.lag_check_seconds
+            ):
+                continue
+            self._checking.add(index)
+            task = asyncio.ensure_future(self._check_lag(index))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _check_lag(self, index: int) -> None:
+        try:
+            async with self.replicas[index].connect() as connection:
+                lag = (await connection.execute(REPLICA_LAG_QUERY)).scalar()
+            self._lag[index] = float(lag or 0)
+        except Exception as e:
+            logger.warning(f"Read replica {index} is unavailable: {e}")
+            self._lag[index] = math.inf
+        finally:
+            self._checked_at[index] = time.monotonic()
+            self._checking.discard(index)
+
+    async def dispose(self) -> None:
+        for replica in self.replicas:
+            await replica.dispose()
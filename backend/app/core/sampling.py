@@ -0,0 +1,31 @@
+import math
+
+# Estimate of the number of distinct equipment in a range from a sample of the
+# table pages (see crud.SAMPLED_AVERAGE_BY_EQUIPMENT). Equipment with few rows
+# in the range are easily missed by the sample, so the equipment seen are only a
+# lower bound. The ones never seen are estimated from those seen in one or two
+# pages (the incidence-based Chao2 estimator, bias corrected): many equipment
+# seen in a single page means many were missed.
+
+
+def estimate_distinct_count(
+    pages_seen: list[int], percent: float
+) -> tuple[float, float]:
+    """
+    Estimated distinct count and its relative standard error, from the number
+    of sampled pages each equipment was seen in.
+    """
+    seen = len(pages_seen)
+    if percent >= 100 or seen == 0:
+        return (float(seen), 0.0)
+
+    once = sum(1 for pages in pages_seen if pages == 1)
+    twice = sum(1 for pages in pages_seen if pages == 2)
+    unseen = once * (once - 1) / (2 * (twice + 1))
+    variance = (
+        unseen
+        + once * (2 * once - 1) ** 2 / (4 * (twice + 1) ** 2)
+        + once**2 * twice * (once - 1) ** 2 / (4 * (twice + 1) ** 4)
+    )
+    estimate = seen + unseen
+    return (estimate, math.sqrt(variance) / estimate)
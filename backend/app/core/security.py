@@ -1,14 +1,23 @@
+import multiprocessing
+import threading
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Any
+from typing import Any, TypeVar, cast
 
 import jwt
 from passlib.context import CryptContext
 
 from app.core.config import settings
 
+# Hashes with another cost than PASSWORD_HASH_ROUNDS still verify, but need an
+# update, which is done on the next successful login (see crud.authenticate)
 pwd_context = CryptContext(
     schemes=["bcrypt"], 
-    deprecated="auto"
+    deprecated="auto",
+    bcrypt__default_rounds=settings.PASSWORD_HASH_ROUNDS,
+    bcrypt__min_rounds=settings.PASSWORD_HASH_ROUNDS,
+    bcrypt__max_rounds=settings.PASSWORD_HASH_ROUNDS,
 )
 
 
@@ -22,9 +31,72 @@ def create_access_token(subject: str | Any, time_to_expire: timedelta) -> str:
     return encoded_jwt
 
 
+# bcrypt burns tens to hundreds of milliseconds of CPU per call. It runs in a
+# bounded pool of processes, so a login storm neither holds the GIL against the
+# other requests nor takes every thread of the threadpool.
+# Created on first use, after the server forked its workers.
+_password_executor: ProcessPoolExecutor | None = None
+_password_executor_lock = threading.Lock()
+
+T = TypeVar("T")
+
+
+def _get_password_executor() -> ProcessPoolExecutor | None:
+    global _password_executor
+    if settings.PASSWORD_HASH_WORKERS <= 0:
+        return None
+    with _password_executor_lock:
+        if _password_executor is None:
+            # Forking a process running threads isn't safe
+            _password_executor = ProcessPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _password_executor
+
+
+# Module level, so the pool can pickle them by name
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return bool(pwd_context.verify(password, hashed_password))
+
+
+def _verify_and_update(password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return cast(
+        tuple[bool, str | None], pwd_context.verify_and_update(password, hashed_password)
+    )
+
+
+def _hash(password: str) -> str:
+    return str(pwd_context.hash(password))
+
+
+def _run_password_task(fn: Callable[..., T], *args: Any) -> T:
+    executor = _get_password_executor()
+    if executor is None:
+        return fn(*args)
+    return executor.submit(fn, *args).result()
+
+
+def shutdown_password_executor() -> None:
+    global _password_executor
+    with _password_executor_lock:
+        if _password_executor is not None:
+            _password_executor.shutdown(cancel_futures=True)
+            _password_executor = None
+
+
 def verify_password(password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(password, hashed_password)
+    return _run_password_task(_verify, password, hashed_password)
+
+
+def verify_and_update_password(password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """
+    Verifies the password, also returning its new hash when the stored one uses
+    outdated settings (e.g. PASSWORD_HASH_ROUNDS changed), None otherwise.
+    """
+    return _run_password_task(_verify_and_update, password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return _run_password_task(_hash, password)
@@ -0,0 +1,54 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any, TypeVar
+
+from app.core.metrics import dashboard_query_coalesced, dashboard_query_executions
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: while a call for a given key is in flight,
+    later callers with the same key wait for it and share its result instead of
+    running the coroutine again.
+
+    The call runs in its own task, so a caller going away doesn't cancel it for the
+    others, only the last one leaving cancels it. For the same reason it must not
+    use the session of the request that started it. The first element of the key
+    is the "query" label in the metrics.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, asyncio.Task[Any]] = {}
+        self._waiters: dict[asyncio.Task[Any], int] = {}
+
+    async def do(self, key: tuple[Hashable, ...], fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            dashboard_query_executions.labels(query=str(key[0])).inc()
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            dashboard_query_coalesced.labels(query=str(key[0])).inc()
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                # Every caller was cancelled (e.g. the clients disconnected)
+                task.cancel()
+
+    def _finish(self, key: tuple[Hashable, ...], task: asyncio.Task[Any]) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Avoids "exception was never retrieved" when every caller went away
+        if not task.cancelled():
+            task.exception()
+
+
+dashboard_single_flight = SingleFlight()
@@ -0,0 +1,154 @@
+import itertools
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import text
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than SLOW_QUERY_THRESHOLD_SECONDS, recorded by the cursor
+# events of core/instrumentation.py with their parameters and route. Their plan
+# can be captured with EXPLAIN (ANALYZE, BUFFERS) in the background.
+
+# Only these are safe to run again for EXPLAIN ANALYZE, which executes them
+EXPLAINABLE_OPERATIONS = {"SELECT", "WITH"}
+
+
+@dataclass
+class SlowQuery:
+    id: int
+    recorded_at: datetime
+    route: str
+    duration_seconds: float
+    statement: str
+    parameters: str | None
+    # Filled in by the background EXPLAIN, when enabled
+    plan: Any = None
+    plan_error: str | None = None
+    _parameters: Any = field(default=None, repr=False)
+
+
+def _format_parameters(parameters: Any) -> str:
+    formatted = repr(parameters)
+    limit = settings.SLOW_QUERY_MAX_PARAMETERS_LENGTH
+    return formatted if len(formatted) <= limit else formatted[:limit] + "..."
+
+
+class SlowQueryLog:
+    """
+    The last maxsize slow queries of this worker, newest last.
+
+    At most one EXPLAIN runs at a time, in its own thread, and slow queries
+    arriving while SLOW_QUERY_EXPLAIN_QUEUE_SIZE are waiting aren't explained:
+    a slow database doesn't get twice the load from its own diagnostics.
+    """
+
+    def __init__(self, maxsize: int):
+        self._entries: deque[SlowQuery] = deque(maxlen=maxsize)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._explain_executor: ThreadPoolExecutor | None = None
+        self._explain_pending = 0
+
+    def record(
+        self,
+        *,
+        statement: str,
+        parameters: Any,
+        route: str,
+        duration_seconds: float,
+        operation: str,
+        executemany: bool,
+    ) -> SlowQuery:
+        entry = SlowQuery(
+            id=next(self._ids),
+            recorded_at=datetime.utcnow(),
+            route=route,
+            duration_seconds=duration_seconds,
+            statement=statement,
+            parameters=(
+                _format_parameters(parameters)
+                if settings.SLOW_QUERY_LOG_PARAMETERS
+                else None
+            ),
+            _parameters=parameters,
+        )
+        with self._lock:
+            self._entries.append(entry)
+        logger.warning(
+            f"Slow query ({duration_seconds:.3f}s) in {route}: {statement[:200]}"
+        )
+        if (
+            settings.SLOW_QUERY_EXPLAIN
+            and operation in EXPLAINABLE_OPERATIONS
+            and not executemany
+        ):
+            self._schedule_explain(entry)
+        else:
+            entry._parameters = None
+        return entry
+
+    def entries(self) -> list[SlowQuery]:
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _schedule_explain(self, entry: SlowQuery) -> None:
+        with self._lock:
+            if self._explain_pending >= settings.SLOW_QUERY_EXPLAIN_QUEUE_SIZE:
+                entry._parameters = None
+                entry.plan_error = "Not explained, too many plans being captured"
+                return
+            self._explain_pending += 1
+            if self._explain_executor is None:
+                self._explain_executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="slow-query-explain"
+                )
+        self._explain_executor.submit(self._explain, entry)
+
+    def _explain(self, entry: SlowQuery) -> None:
+        # Imported here, core.db imports the whole crud module
+        from app.core.db import engine
+
+        try:
+            with engine.connect() as connection:
+                connection.execute(
+                    text("SELECT set_config('statement_timeout', :timeout, true)"),
+                    {
+                        "timeout": f"{int(settings.SLOW_QUERY_EXPLAIN_TIMEOUT_SECONDS * 1000)}ms"
+                    },
+                )
+                # The statement is in the driver's paramstyle, it's passed as is
+                result = connection.exec_driver_sql(
+                    f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {entry.statement}",
+                    entry._parameters or (),
+                )
+                entry.plan = result.scalar_one()
+                # Nothing the statement did is kept
+                connection.rollback()
+        except Exception as e:
+            entry.plan_error = str(e).splitlines()[0] if str(e) else type(e).__name__
+        finally:
+            entry._parameters = None
+            with self._lock:
+                self._explain_pending -= 1
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor = self._explain_executor
+            self._explain_executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+slow_query_log = SlowQueryLog(settings.SLOW_QUERY_LOG_SIZE)
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from collections.abc import Awaitable
+from typing import Any
+
+import psycopg.errors
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import event, exc, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session, SessionTransaction
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Per-route statement_timeout budgets, and cancellation of the queries of
+# clients that went away, so one heavy request can't hold a connection for minutes.
+
+STATEMENT_TIMEOUT_KEY = "statement_timeout"
+
+# Nginx's convention for "the client closed the connection before the response"
+CLIENT_CLOSED_REQUEST = 499
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def statement_timeout_for(request: Request) -> float:
+    """
+    The statement_timeout budget of the route serving the request, in seconds.
+    """
+    route = request.scope.get("route")
+    name = getattr(route, "name", "")
+    return settings.STATEMENT_TIMEOUTS.get(name, settings.STATEMENT_TIMEOUT_SECONDS)
+
+
+def set_statement_timeout(session: Any, seconds: float) -> None:
+    # Applied at the beginning of every transaction of the session, see below.
+    # Works for both Session and AsyncSession, which share their info dict.
+    session.info[STATEMENT_TIMEOUT_KEY] = seconds
+
+
+@event.listens_for(Session, "after_begin")
+def _apply_statement_timeout(
+    session: Session, _transaction: SessionTransaction, connection: Connection
+) -> None:
+    seconds = session.info.get(STATEMENT_TIMEOUT_KEY)
+    if not seconds:
+        return
+    # SET LOCAL doesn't take bind parameters, set_config(..., true) is the same
+    connection.execute(
+        text("SELECT set_config('statement_timeout', :timeout, true)"),
+        {"timeout": f"{int(seconds * 1000)}ms"},
+    )
+
+
+async def cancel_on_disconnect(request: Request, awaitable: Awaitable[Any]) -> Any:
+    """
+    Awaits the route's work, cancelling it if the client disconnects meanwhile.
+
+    Cancelling an asyncio task waiting on psycopg also cancels the query on the
+    server, so the connection goes back to the pool right away. The request body
+    must already have been read, as checking for a disconnect consumes it.
+
+    Raises ClientDisconnected, answered with a 499 by client_disconnected_handler.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            (done, _) = await asyncio.wait(
+                {task}, timeout=settings.DISCONNECT_CHECK_INTERVAL_SECONDS
+            )
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info(f"Client disconnected, cancelling {request.url.path}")
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+            # The session is closed after the route, once the query is cancelled
+            await asyncio.wait({task})
+            if not task.cancelled():
+                task.exception()
+
+
+def is_statement_timeout(error: exc.DBAPIError) -> bool:
+    return isinstance(error.orig, psycopg.errors.QueryCanceled)
+
+
+async def database_error_handler(request: Request, error: Exception) -> Response:
+    # Registered for OperationalError only, QueryCanceled is one of them. The
+    # other ones go on to the default 500.
+    if not isinstance(error, exc.OperationalError) or not is_statement_timeout(error):
+        raise error
+    timeout = statement_timeout_for(request)
+    return JSONResponse(
+        status_code=504,
+        content={
+            "detail": f"The query took longer than the {timeout:g}s allowed for this endpoint. "
+            "Narrow the time interval or filter by equipment.",
+            "code": "statement_timeout",
+            "timeout_seconds": timeout,
+        },
+    )
+
+
+async def client_disconnected_handler(_request: Request, _error: Exception) -> Response:
+    # Nobody will read it, but the route must still answer something
+    return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+
+async def pool_timeout_handler(_request: Request, _error: Exception) -> Response:
+    # Every connection is busy, let the client retry later
+    return JSONResponse(
+        status_code=503,
+        content={
+            "detail": "The database is busy, try again in a few seconds.",
+            "code": "database_busy",
+        },
+        headers={"Retry-After": str(int(settings.POSTGRES_POOL_TIMEOUT_SECONDS))},
+    )
@@ -0,0 +1,113 @@
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import IO, Any
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Records the requests to the paths of TRAFFIC_RECORD_PATHS (route, query,
+# body, timing), one JSON line per request, in a file per worker of
+# TRAFFIC_RECORD_DIR. They are replayed by app.benchmarks.replay.
+#
+# Headers aren't recorded, nor are the routes out of TRAFFIC_RECORD_PATHS
+# (e.g. the login form with its password).
+
+
+class TrafficRecorder:
+    def __init__(self, directory: str | None):
+        self.directory = directory
+        self._file: IO[str] | None = None
+        self._lock = threading.Lock()
+
+    def record(self, entry: dict[str, Any]) -> None:
+        if self.directory is None:
+            # Recording is off, the middleware isn't even installed
+            return
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            if self._file is None:
+                path = Path(self.directory) / f"{os.getpid()}.jsonl"
+                self._file = path.open("a", encoding="utf-8")
+            self._file.write(line)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+traffic_recorder = TrafficRecorder(settings.TRAFFIC_RECORD_DIR)
+
+
+class TrafficRecordingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.prefixes = [
+            settings.API_V1_STR + path for path in settings.TRAFFIC_RECORD_PATHS
+        ]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(
+            tuple(self.prefixes)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.time()
+        start = time.perf_counter()
+        status = 500
+        body = bytearray()
+        body_omitted = False
+
+        async def receive_wrapper() -> Message:
+            nonlocal body_omitted
+            message = await receive()
+            if message["type"] == "http.request" and not body_omitted:
+                body.extend(message.get("body", b""))
+                if len(body) > settings.TRAFFIC_RECORD_MAX_BODY_BYTES:
+                    body_omitted = True
+                    body.clear()
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            headers = dict(scope["headers"])
+            route = scope.get("route")
+            try:
+                traffic_recorder.record(
+                    {
+                        "time": started_at,
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "query": scope["query_string"].decode("latin-1"),
+                        "route": getattr(route, "unique_id", None),
+                        "status": status,
+                        "duration": time.perf_counter() - start,
+                        "content_type": headers.get(b"content-type", b"").decode(
+                            "latin-1"
+                        )
+                        or None,
+                        "body": base64.b64encode(body).decode("ascii")
+                        if body
+                        else None,
+                        "body_omitted": body_omitted,
+                    }
+                )
+            except OSError as e:
+                logger.warning(f"Could not record the request: {e}")
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
+
+import psycopg
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.models import User
+
+logger = logging.getLogger(__name__)
+
+# Postgres channel notified by the user_cache_invalidate trigger
+USER_CACHE_CHANNEL = "user_cache_invalidate"
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after ttl seconds. Thread safe, as
+    the sync routes resolve their user in the threadpool.
+
+    Every invalidation bumps version: a value read from the database before an
+    invalidation is not stored by set(..., version=...) after it, so a slow
+    reader can't put back a stale value.
+    """
+
+    def __init__(
+        self, maxsize: int, ttl: float, enabled: bool = True, name: str = "ttl"
+    ):
+        # name is the cache label of the hit ratio metrics
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self.version = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        metrics.cache_requests.labels(
+            cache=self.name, result="miss" if entry is None else "hit"
+        ).inc()
+        return None if entry is None else entry[1]
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        ttl: float | None = None,
+        version: int | None = None,
+    ) -> None:
+        if not self.enabled or self.maxsize <= 0:
+            return
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self.version += 1
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+
+# Resolved users by id, as dicts of their columns. Only enabled while the worker
+# listens to the invalidations of the other workers, see UserCacheListener.
+user_cache = TTLCache(
+    settings.USER_CACHE_SIZE,
+    settings.USER_CACHE_TTL_SECONDS,
+    enabled=False,
+    name="user",
+)
+
+# Ids of the users of the verified tokens, by token. Tokens can't change, the
+# entries live at most until the token expires.
+token_cache = TTLCache(
+    settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL_SECONDS, name="token"
+)
+
+
+class UserCacheListener:
+    """
+    LISTENs to the invalidations sent by the user table trigger on every update
+    or delete, whichever worker (or script) made them.
+
+    The cache is disabled while the connection is down, as notifications may be
+    missed, and cleared once it is up again.
+    """
+
+    def __init__(self, cache: TTLCache, dsn: str, retry_seconds: float = 5.0):
+        self.cache = cache
+        self.dsn = dsn
+        self.retry_seconds = retry_seconds
+
+    async def run(self) -> None:
+        while True:
+            try:
+                connection = await psycopg.AsyncConnection.connect(
+                    self.dsn, autocommit=True
+                )
+                async with connection:
+                    await connection.execute(f"LISTEN {USER_CACHE_CHANNEL}")
+                    self.cache.clear()
+                    self.cache.enabled = True
+                    async for notify in connection.notifies():
+                        self.cache.invalidate(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(
+                    f"User cache invalidations unavailable, cache disabled: {e}"
+                )
+            finally:
+                self.cache.enabled = False
+                self.cache.clear()
+            await asyncio.sleep(self.retry_seconds)
+
+
+# The worker that writes a user doesn't wait for its own notification: the user
+# is invalidated when flushed, and again once committed (a concurrent request
+# may have cached the previous version in between).
+
+
+@event.listens_for(Session, "after_flush")
+def _invalidate_flushed_users(session: Session, _flush_context: Any) -> None:
+    user_ids = {
+        str(instance.id)
+        for instance in [*session.dirty, *session.deleted]
+        if isinstance(instance, User)
+    }
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+    session.info.setdefault("flushed_user_ids", set()).update(user_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session: Session) -> None:
+    for user_id in session.info.pop("flushed_user_ids", ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_flushed_users(session: Session) -> None:
+    session.info.pop("flushed_user_ids", None)
@@ -1,10 +1,39 @@
 import uuid
+from datetime import datetime
 from typing import Any
 
-from sqlmodel import Session, select
+from sqlalchemy import (
+    Result,
+    Select,
+    String,
+    TextClause,
+    any_,
+    bindparam,
+    func,
+    literal_column,
+    text,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Mapped, make_transient_to_detached
+from sqlmodel import Session, col, select
 
-from app.core.security import get_password_hash, verify_password
-from app.models import User, UserCreate, UserUpdate, SensorData, SensorDataCreate
+from app.core.api_keys import ApiKeyEntry, generate_api_key
+from app.core.config import settings
+from app.core.security import get_password_hash, verify_and_update_password
+from app.core.user_cache import user_cache
+from app.models import (
+    ApiKey,
+    ApiKeyCreate,
+    EmailOutbox,
+    EmailOutboxStatus,
+    User,
+    UserCreate,
+    UserUpdate,
+    SensorData,
+    SensorDataCreate,
+    SensorDataHourWatermark,
+    SensorDataWatermark
+)
 
 
 def create_user(*, session: Session, user_create: UserCreate) -> User:
@@ -33,6 +62,28 @@ def update_user(*, session: Session, db_user: User, user_in: UserUpdate) -> Any:
     return db_user
 
 
+def detached_user(data: dict[str, Any]) -> User:
+    # As if loaded by another session, to be merge()d without a SELECT
+    user = User.model_validate(data)
+    make_transient_to_detached(user)
+    return user
+
+
+def get_user_by_id(*, session: Session, id: str) -> User | None:
+    """
+    The user with the given id, from the user cache when possible.
+    """
+    data = user_cache.get(id)
+    if data is not None:
+        return session.merge(detached_user(data), load=False)
+
+    version = user_cache.version
+    user = session.get(User, id)
+    if user:
+        user_cache.set(id, user.model_dump(), version=version)
+    return user
+
+
 def get_user_by_email(*, session: Session, email: str) -> User | None:
     query = select(User).where(User.email == email)
     user = session.exec(query).first()
@@ -41,11 +92,105 @@ def get_user_by_email(*, session: Session, email: str) -> User | None:
 
 def authenticate(*, session: Session, email: str, password: str) -> User | None:
     user = get_user_by_email(session=session, email=email)
-    if not user or not verify_password(password, user.hashed_password):
+    if not user:
+        return None
+    (verified, new_hash) = verify_and_update_password(password, user.hashed_password)
+    if not verified:
         return None
+
+    # The hash was made with other settings (e.g. fewer rounds), now is the only
+    # time the password is known to replace it
+    if new_hash:
+        user.hashed_password = new_hash
+        session.add(user)
+        session.commit()
+        session.refresh(user)
     return user
 
 
+def create_api_key(*, session: Session, owner: User, api_key_in: ApiKeyCreate) -> tuple[ApiKey, str]:
+    """
+    Creates an API key acting for owner, returned with the full key, which is
+    not stored and can't be retrieved later.
+    """
+    (key, prefix, secret_hash) = generate_api_key()
+    api_key = ApiKey(
+        name=api_key_in.name,
+        scopes=[scope.value for scope in api_key_in.scopes],
+        prefix=prefix,
+        secret_hash=secret_hash,
+        owner_id=owner.id,
+    )
+    session.add(api_key)
+    session.commit()
+    session.refresh(api_key)
+    return (api_key, key)
+
+
+def revoke_api_key(*, session: Session, api_key: ApiKey) -> ApiKey:
+    api_key.revoked_at = datetime.utcnow()
+    session.add(api_key)
+    session.commit()
+    session.refresh(api_key)
+    return api_key
+
+
+def enqueue_email(*, session: Session, email_to: str, subject: str, html_content: str) -> EmailOutbox:
+    """
+    Stores the email for the outbox sender, which delivers it in the background.
+    """
+    assert settings.emails_enabled, "no provided configuration for email variables"
+    email = EmailOutbox(email_to=email_to, subject=subject, html_content=html_content)
+    session.add(email)
+    session.commit()
+    session.refresh(email)
+    return email
+
+
+# Oldest pending emails due for an attempt. Rows locked by the sender of another
+# worker are skipped rather than waited for.
+PENDING_EMAILS = select(EmailOutbox).where(
+    EmailOutbox.status == EmailOutboxStatus.PENDING.value,
+    EmailOutbox.next_attempt_at <= bindparam("now"),
+).order_by(col(EmailOutbox.next_attempt_at)).limit(bindparam("limit")).with_for_update(skip_locked=True)
+
+
+def claim_pending_emails(*, session: Session, now: datetime, limit: int) -> list[EmailOutbox]:
+    """
+    Pending emails locked until the session's transaction ends.
+    """
+    return list(session.exec(PENDING_EMAILS, params={"now": now, "limit": limit}).all())
+
+
+# Keys not revoked, of active users, with the flags of their owner
+ACTIVE_API_KEYS = select(
+    ApiKey, User.is_superuser
+).join(
+    User, col(ApiKey.owner_id) == col(User.id)
+).where(
+    col(ApiKey.revoked_at).is_(None),
+    col(User.is_active)
+)
+
+
+def api_key_entries(rows: Any) -> list[ApiKeyEntry]:
+    return [
+        ApiKeyEntry(
+            id=api_key.id,
+            prefix=api_key.prefix,
+            secret_hash=api_key.secret_hash,
+            scopes=frozenset(api_key.scopes),
+            owner_id=api_key.owner_id,
+            is_superuser=is_superuser,
+        )
+        for (api_key, is_superuser) in rows
+    ]
+
+
+def get_active_api_key_entries(*, session: Session) -> list[ApiKeyEntry]:
+    return api_key_entries(session.exec(ACTIVE_API_KEYS).all())
+
+
 def create_sensor_data(*, session: Session, sensor_create_data: SensorDataCreate) -> SensorData:
     sensor_data = SensorData.model_validate(sensor_create_data)
     session.add(sensor_data)
@@ -65,7 +210,309 @@ def get_sensor_data_by_equipment_id(*, session: Session, equipment_id: str) -> l
     return sensors
 
 
+# Columns of SensorDataPublic, used by the read paths that skip the ORM
+SENSOR_DATA_PUBLIC_COLUMNS = (
+    SensorData.id,
+    SensorData.equipment_id,
+    SensorData.value,
+    SensorData.timestamp
+)
+
+
+# The queries below are shared by the sync functions of this module and by
+# their async counterparts in app.async_crud.
+#
+# The hot ones are built and compiled once, at import time, with bind parameters
+# for every value, and the *_query functions only return (statement, params).
+# SQLAlchemy memoizes the cache key of a statement object, so reusing it skips
+# rebuilding the select() chain and its cache key lookup on every request. The
+# SQL text is also always the same (equipment ids are one array parameter, not an
+# IN list growing with the ids), so psycopg prepares it server-side after
+# POSTGRES_PREPARE_THRESHOLD executions on a connection and Postgres stops
+# parsing and planning it again.
+
+Query = tuple[Select[Any] | TextClause, dict[str, Any]]
+
+_EQUIPMENT_IDS = bindparam("equipment_ids", type_=ARRAY(String))
+
+
+def _where_equipment_in(query: Select[Any], column: Mapped[str]) -> Select[Any]:
+    return query.where(column == any_(_EQUIPMENT_IDS))
+
+
+def _equipment_params(equipment_ids: list[str] | None) -> dict[str, Any]:
+    return {"equipment_ids": list(equipment_ids)} if equipment_ids else {}
+
+
+SENSOR_DATA_COUNT = select(func.count()).select_from(SensorData)
+
+SENSOR_DATA_ROWS = select(
+    *SENSOR_DATA_PUBLIC_COLUMNS
+).order_by(
+    col(SensorData.timestamp).desc()
+).order_by(
+    SensorData.equipment_id
+).offset(bindparam("skip")).limit(bindparam("limit"))
+
+SENSOR_DATA_ROWS_BY_EQUIPMENT = select(
+    *SENSOR_DATA_PUBLIC_COLUMNS
+).where(SensorData.equipment_id == bindparam("equipment_id"))
+
+_hour = func.date_trunc("hour", SensorData.timestamp)
+HOURLY_AVERAGES = select(
+    SensorData.equipment_id,
+    _hour,
+    func.avg(SensorData.value)
+).where(
+    SensorData.timestamp >= bindparam("begin"),
+    SensorData.timestamp < bindparam("end")
+).group_by(SensorData.equipment_id, _hour)
+HOURLY_AVERAGES_BY_EQUIPMENT = _where_equipment_in(HOURLY_AVERAGES, col(SensorData.equipment_id))
+
+EQUIPMENT_COUNT = select(
+    func.count(col(SensorData.equipment_id).distinct())
+).where(
+    SensorData.timestamp > bindparam("begin"),
+    SensorData.timestamp <= bindparam("end")
+)
+
+_average_by_equipment = select(
+    SensorData.equipment_id,
+    func.avg(SensorData.value).label("avg")
+).where(
+    SensorData.timestamp > bindparam("begin"),
+    SensorData.timestamp <= bindparam("end")
+)
+AVERAGE_BY_EQUIPMENT = _average_by_equipment.group_by(
+    SensorData.equipment_id
+).order_by(
+    SensorData.equipment_id
+).offset(bindparam("skip")).limit(bindparam("limit"))
+AVERAGE_BY_EQUIPMENT_FILTERED = _where_equipment_in(
+    _average_by_equipment, col(SensorData.equipment_id)
+).group_by(
+    SensorData.equipment_id
+).order_by(
+    SensorData.equipment_id
+).offset(bindparam("skip")).limit(bindparam("limit"))
+
+DATA_WATERMARK = select(
+    func.count(),
+    func.coalesce(func.sum(SensorDataWatermark.seq), 0)
+).select_from(SensorDataWatermark)
+DATA_WATERMARK_BY_EQUIPMENT = _where_equipment_in(
+    DATA_WATERMARK, col(SensorDataWatermark.equipment_id)
+)
+
+# Watermark of each hour, for the line chart cache. A sum rather than the max, as
+# sequences are drawn before the commits: a transaction committing after a later
+# one wouldn't raise the max.
+HOUR_WATERMARKS = select(
+    SensorDataHourWatermark.hour,
+    func.sum(SensorDataHourWatermark.seq)
+).where(
+    SensorDataHourWatermark.hour >= bindparam("begin"),
+    SensorDataHourWatermark.hour < bindparam("end")
+).group_by(col(SensorDataHourWatermark.hour))
+
+# Partial aggregates of one time slice of the bar chart, merged by
+# async_crud.get_average_by_equipment_parallel
+PARTIAL_SUMS_BY_EQUIPMENT = select(
+    SensorData.equipment_id,
+    func.sum(SensorData.value),
+    func.count(col(SensorData.value))
+).where(
+    SensorData.timestamp > bindparam("begin"),
+    SensorData.timestamp <= bindparam("end")
+).group_by(SensorData.equipment_id)
+
+# Oldest timestamp according to the planner statistics, as of the last ANALYZE
+OLDEST_TIMESTAMP_ESTIMATE = text(
+    "SELECT (histogram_bounds::text::timestamp[])[1] FROM pg_stats "
+    "WHERE schemaname = current_schema() "
+    "AND tablename = 'sensor_data' AND attname = 'timestamp'"
+)
+
+# Approximations of the bar chart queries over a sample of the table pages. The
+# fixed seed makes repeated requests read the same sample.
+_sample = SensorData.__table__.tablesample(  # type: ignore[attr-defined]
+    func.system(bindparam("percent")), name="sensor_data_sample", seed=literal_column("0")
+)
+
+# Sampled rows summed per equipment and page. Pages are the sampling unit, and
+# the rows of a page were written around the same time: they are correlated, the
+# error of the averages is estimated from the spread between pages, not rows.
+_page: Any = literal_column("(sensor_data_sample.ctid::text::point)[0]")
+_sampled_pages = select(
+    _sample.c.equipment_id,
+    func.sum(_sample.c.value).label("value_sum"),
+    func.count().label("value_count")
+).where(
+    _sample.c.timestamp > bindparam("begin"),
+    _sample.c.timestamp <= bindparam("end")
+).group_by(_sample.c.equipment_id, _page).subquery("sampled_pages")
+
+_page_ratios = select(
+    _sampled_pages.c.equipment_id,
+    _sampled_pages.c.value_sum,
+    _sampled_pages.c.value_count,
+    (
+        func.sum(_sampled_pages.c.value_sum).over(partition_by=_sampled_pages.c.equipment_id)
+        / func.sum(_sampled_pages.c.value_count).over(partition_by=_sampled_pages.c.equipment_id)
+    ).label("avg")
+).subquery("page_ratios")
+
+# Every equipment seen in the sample, with the number of pages it was seen in
+# (see app.core.sampling). The error bound is the half-width of the 95%
+# confidence interval of the ratio estimator of the mean over the sampled pages,
+# with the finite population correction: 0 when the whole table is sampled.
+_pages = func.count()
+SAMPLED_AVERAGE_BY_EQUIPMENT = select(
+    _page_ratios.c.equipment_id,
+    func.min(_page_ratios.c.avg).label("avg"),
+    (
+        literal_column("1.96") * func.sqrt(
+            (1 - bindparam("percent") / 100.0)
+            * func.sum(func.power(
+                _page_ratios.c.value_sum - _page_ratios.c.avg * _page_ratios.c.value_count, 2
+            ))
+            / (_pages * func.nullif(_pages - 1, 0))
+        ) / (func.sum(_page_ratios.c.value_count) / _pages)
+    ).label("error_bound"),
+    _pages.label("pages")
+).group_by(
+    _page_ratios.c.equipment_id
+).order_by(
+    _page_ratios.c.equipment_id
+)
+
+
+def sensor_data_count_query() -> Query:
+    return (SENSOR_DATA_COUNT, {})
+
+
+def sensor_data_rows_query(skip: int, limit: int) -> Query:
+    return (SENSOR_DATA_ROWS, {"skip": skip, "limit": limit})
+
+
+def sensor_data_rows_by_equipment_query(equipment_id: str) -> Query:
+    return (SENSOR_DATA_ROWS_BY_EQUIPMENT, {"equipment_id": equipment_id})
+
+
+def hourly_averages_query(
+    begin: datetime, end: datetime, equipment_ids: list[str] | None = None
+) -> Query:
+    statement = HOURLY_AVERAGES_BY_EQUIPMENT if equipment_ids else HOURLY_AVERAGES
+    return (statement, {"begin": begin, "end": end, **_equipment_params(equipment_ids)})
+
+
+def equipment_count_query(begin: datetime, end: datetime) -> Query:
+    return (EQUIPMENT_COUNT, {"begin": begin, "end": end})
+
+
+def average_by_equipment_query(
+    begin: datetime,
+    end: datetime,
+    equipment_ids: list[str] | None = None,
+    skip: int = 0,
+    limit: int = 100
+) -> Query:
+    statement = AVERAGE_BY_EQUIPMENT_FILTERED if equipment_ids else AVERAGE_BY_EQUIPMENT
+    return (statement, {
+        "begin": begin,
+        "end": end,
+        "skip": skip,
+        "limit": limit,
+        **_equipment_params(equipment_ids)
+    })
+
+
+def data_watermark_query(equipment_ids: list[str] | None = None) -> Query:
+    statement = DATA_WATERMARK_BY_EQUIPMENT if equipment_ids else DATA_WATERMARK
+    return (statement, _equipment_params(equipment_ids))
+
+
+def hour_watermarks_query(begin: datetime, end: datetime) -> Query:
+    return (HOUR_WATERMARKS, {"begin": begin, "end": end})
+
+
+def sampled_average_by_equipment_query(begin: datetime, end: datetime, percent: float) -> Query:
+    return (SAMPLED_AVERAGE_BY_EQUIPMENT, {"begin": begin, "end": end, "percent": percent})
+
+
+def partial_sums_by_equipment_query(begin: datetime, end: datetime) -> Query:
+    return (PARTIAL_SUMS_BY_EQUIPMENT, {"begin": begin, "end": end})
+
+
+def oldest_timestamp_estimate_query() -> Query:
+    return (OLDEST_TIMESTAMP_ESTIMATE, {})
+
+
+def explain_query(query: Query, dialect: Any) -> tuple[str, dict[str, Any]]:
+    """
+    The driver-level SQL and parameters of EXPLAIN (FORMAT JSON) for the query.
+    """
+    (statement, params) = query
+    compiled = statement.compile(dialect=dialect)
+    return ("EXPLAIN (FORMAT JSON) " + str(compiled), dict(compiled.construct_params(params)))
+
+
+def execute(session: Session, query: Query) -> Result[Any]:
+    (statement, params) = query
+    return session.execute(statement, params)
+
+
+def rows_as_dicts(result: Result[Any]) -> list[dict[str, Any]]:
+    keys = list(result.keys())
+    return [dict(zip(keys, row, strict=True)) for row in result]
+
+
+def get_sensor_data_rows(*, session: Session, skip: int = 0, limit: int = 100) -> list[dict[str, Any]]:
+    return rows_as_dicts(execute(session, sensor_data_rows_query(skip, limit)))
+
+
+def get_sensor_data_rows_by_equipment_id(*, session: Session, equipment_id: str) -> list[dict[str, Any]]:
+    return rows_as_dicts(execute(session, sensor_data_rows_by_equipment_query(equipment_id)))
+
+
 def delete_sensor_data_by_id(*, session: Session, id: str):
     sensor_data = session.get(SensorData, id)
     session.delete(sensor_data)
     session.commit()
+
+
+def get_hourly_averages(
+    *,
+    session: Session,
+    begin: datetime,
+    end: datetime,
+    equipment_ids: list[str] | None = None
+) -> list[tuple[str, datetime, float]]:
+    return list(execute(session, hourly_averages_query(begin, end, equipment_ids)).tuples())
+
+
+def get_average_by_equipment(
+    *,
+    session: Session,
+    begin: datetime,
+    end: datetime,
+    equipment_ids: list[str] | None = None,
+    skip: int = 0,
+    limit: int = 100
+) -> tuple[int, list[dict[str, Any]]]:
+    count = int(execute(session, equipment_count_query(begin, end)).scalar_one())
+    query = average_by_equipment_query(begin, end, equipment_ids, skip, limit)
+    return (count, rows_as_dicts(execute(session, query)))
+
+
+def get_data_watermark(
+    *, session: Session, equipment_ids: list[str] | None = None
+) -> tuple[int, int]:
+    """
+    Cheap fingerprint of the sensor data, as (equipment count, sum of ingest sequences).
+
+    Every write stamps the affected equipment with a new, greater, sequence value,
+    so the sum changes on every committed write, regardless of the commit order.
+    """
+    (count, seq_sum) = execute(session, data_watermark_query(equipment_ids)).one()
+    return (count, int(seq_sum))
@@ -0,0 +1,415 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+import numpy as np
+import psycopg
+
+from app.core.config import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Fills sensor_data with synthetic readings, for load tests and staging. The
+# series are generated with NumPy a time window at a time (every equipment at
+# once), encoded straight into COPY's binary format and loaded by parallel
+# COPY streams, one per worker process.
+#
+# Each reading is a baseline per equipment, plus a daily cycle, a slow drift,
+# gaussian noise and rare spikes. Outages leave gaps in the series.
+#
+# The windows are loaded in time order, as the readings would arrive, which
+# keeps the BRIN index on timestamp selective.
+# Usage: python -m app.load_synthetic_data --equipment 2000 --interval-seconds 10 --days 90 \
+#            --workers 8 --drop-indexes
+
+# Postgres' binary timestamps count microseconds from 2000-01-01
+POSTGRES_EPOCH = datetime(2000, 1, 1)
+COPY_SQL = (
+    "COPY sensor_data (id, equipment_id, value, timestamp) FROM STDIN (FORMAT BINARY)"
+)
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + (0).to_bytes(4, "big") + (0).to_bytes(4, "big")
+COPY_TRAILER = (-1).to_bytes(2, "big", signed=True)
+
+
+@dataclass
+class SyntheticSeries:
+    equipment: int = 2000
+    interval_seconds: float = 10
+    days: float = 90
+    end: datetime = field(
+        default_factory=lambda: datetime.today().replace(microsecond=0)
+    )
+    prefix: str = "eq-"
+    seed: int = 0
+    # Probability of a spike on each reading
+    spike_rate: float = 1e-4
+    # Outages per equipment and per day, and their mean length
+    gap_rate: float = 0.2
+    gap_minutes: float = 30
+
+    @property
+    def steps(self) -> int:
+        return int(self.days * 86_400 / self.interval_seconds)
+
+    @property
+    def start(self) -> datetime:
+        return self.end - timedelta(seconds=self.steps * self.interval_seconds)
+
+    def equipment_ids(self) -> list[str]:
+        # Same length for all, the ids are a fixed size field of the COPY rows
+        width = max(5, len(str(self.equipment - 1)))
+        return [f"{self.prefix}{index:0{width}d}" for index in range(self.equipment)]
+
+    def windows(self, rows_per_copy: int) -> list[tuple[int, int]]:
+        # (first step, steps) of each COPY, every equipment in each
+        size = max(1, rows_per_copy // self.equipment)
+        return [
+            (first, min(size, self.steps - first))
+            for first in range(0, self.steps, size)
+        ]
+
+
+def equipment_profiles(series: SyntheticSeries) -> dict[str, np.ndarray]:
+    """
+    The parameters of each equipment's series, the same in every worker.
+    """
+    rng = np.random.default_rng([series.seed, 0])
+    count = series.equipment
+    baseline = rng.uniform(20, 80, count)
+    return {
+        "baseline": baseline,
+        "daily_amplitude": baseline * rng.uniform(0.01, 0.1, count),
+        "daily_phase": rng.uniform(0, 2 * np.pi, count),
+        # Per day, slowly going up or down over the whole period
+        "drift": rng.normal(0, 0.05, count),
+        # A slower wave on top, with a period of a few days
+        "wander_amplitude": baseline * rng.uniform(0, 0.05, count),
+        "wander_period": rng.uniform(2, 10, count) * 86_400,
+        "wander_phase": rng.uniform(0, 2 * np.pi, count),
+        "noise": baseline * rng.uniform(0.005, 0.03, count),
+    }
+
+
+def copy_dtype(equipment_id_size: int) -> np.dtype:
+    # One row of COPY's binary format: the field count, then each field's size
+    # and big-endian value
+    return np.dtype(
+        [
+            ("fields", ">i2"),
+            ("id_size", ">i4"),
+            ("id", "V16"),
+            ("equipment_id_size", ">i4"),
+            ("equipment_id", f"S{equipment_id_size}"),
+            ("value_size", ">i4"),
+            ("value", ">f8"),
+            ("timestamp_size", ">i4"),
+            ("timestamp", ">i8"),
+        ]
+    )
+
+
+def generate_window(
+    series: SyntheticSeries, profiles: dict[str, np.ndarray], first: int, steps: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The readings of every equipment for steps intervals from the first one, in
+    time order: (equipment index, timestamp in seconds from the start, value).
+    """
+    rng = np.random.default_rng([series.seed, 1, first])
+    count = series.equipment
+    # (steps, equipment), rows in time order once flattened
+    seconds = (
+        np.arange(first, first + steps, dtype=np.float64) * series.interval_seconds
+    )[:, None]
+    seconds = seconds + rng.uniform(0, series.interval_seconds / 10, (steps, count))
+    absolute = seconds + (series.start - datetime(1970, 1, 1)).total_seconds()
+
+    values = (
+        profiles["baseline"]
+        + profiles["daily_amplitude"]
+        * np.sin(2 * np.pi * (absolute % 86_400) / 86_400 + profiles["daily_phase"])
+        + profiles["drift"] * seconds / 86_400
+        + profiles["wander_amplitude"]
+        * np.sin(
+            2 * np.pi * absolute / profiles["wander_period"] + profiles["wander_phase"]
+        )
+        + profiles["noise"] * rng.standard_normal((steps, count))
+    )
+
+    spikes = rng.random((steps, count)) < series.spike_rate
+    values[spikes] += (
+        rng.choice([-1.0, 1.0], spikes.sum())
+        * rng.uniform(5, 15, spikes.sum())
+        * np.broadcast_to(profiles["noise"], (steps, count))[spikes]
+    )
+
+    # Outages starting in this window, cut at its end
+    keep = np.ones((steps, count), dtype=bool)
+    window_days = steps * series.interval_seconds / 86_400
+    outages = rng.poisson(series.gap_rate * window_days * count)
+    if outages:
+        equipment = rng.integers(0, count, outages)
+        starts = rng.integers(0, steps, outages)
+        lengths = np.ceil(
+            rng.exponential(series.gap_minutes * 60 / series.interval_seconds, outages)
+        ).astype(np.int64)
+        for index, start, length in zip(equipment, starts, lengths, strict=True):
+            keep[start : start + length, index] = False
+
+    equipment_index = np.broadcast_to(np.arange(count), (steps, count))
+    return (equipment_index[keep], seconds[keep], values[keep])
+
+
+def encode_copy_rows(
+    series: SyntheticSeries,
+    equipment_ids: np.ndarray,
+    equipment_index: np.ndarray,
+    seconds: np.ndarray,
+    values: np.ndarray,
+    rng: np.random.Generator,
+) -> bytes:
+    """
+    The rows in COPY's binary format, without header or trailer.
+    """
+    rows = np.empty(len(values), dtype=copy_dtype(equipment_ids.dtype.itemsize))
+    rows["fields"] = 4
+    rows["id_size"] = 16
+    rows["equipment_id_size"] = equipment_ids.dtype.itemsize
+    rows["value_size"] = 8
+    rows["timestamp_size"] = 8
+
+    # Random (version 4) UUIDs
+    ids = (
+        np.frombuffer(rng.bytes(16 * len(values)), dtype=np.uint8)
+        .reshape(-1, 16)
+        .copy()
+    )
+    ids[:, 6] = (ids[:, 6] & 0x0F) | 0x40
+    ids[:, 8] = (ids[:, 8] & 0x3F) | 0x80
+    rows["id"] = ids.view("V16").ravel()
+
+    rows["equipment_id"] = equipment_ids[equipment_index]
+    rows["value"] = values
+    offset = (series.start - POSTGRES_EPOCH) // timedelta(microseconds=1)
+    rows["timestamp"] = offset + (seconds * 1_000_000).astype(np.int64)
+    return rows.tobytes()
+
+
+def connect() -> psycopg.Connection:
+    return psycopg.connect(
+        host=settings.POSTGRES_SERVER,
+        port=settings.POSTGRES_PORT,
+        user=settings.POSTGRES_USER,
+        password=settings.POSTGRES_PASSWORD,
+        dbname=settings.POSTGRES_DB,
+    )
+
+
+def load_window(series: SyntheticSeries, first: int, steps: int) -> int:
+    """
+    Generates and loads a window in its own COPY and transaction. Runs in the
+    worker processes.
+    """
+    profiles = equipment_profiles(series)
+    equipment_ids = np.array([id.encode() for id in series.equipment_ids()])
+    (equipment_index, seconds, values) = generate_window(series, profiles, first, steps)
+    data = encode_copy_rows(
+        series,
+        equipment_ids,
+        equipment_index,
+        seconds,
+        values,
+        np.random.default_rng([series.seed, 2, first]),
+    )
+    with connect() as connection:
+        # Losing the last windows in a crash is fine, they can be loaded again
+        connection.execute("SET synchronous_commit = off")
+        with connection.cursor().copy(COPY_SQL) as copy:
+            copy.write(COPY_HEADER)
+            copy.write(data)
+            copy.write(COPY_TRAILER)
+    return len(values)
+
+
+def drop_indexes(connection: psycopg.Connection) -> list[str]:
+    """
+    Drops the indexes and constraints of sensor_data. Returns the statements
+    that recreate them.
+    """
+    constraints = connection.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = 'sensor_data'::regclass AND contype IN ('p', 'u')"
+    ).fetchall()
+    indexes = connection.execute(
+        "SELECT indexrelid::regclass::text, pg_get_indexdef(indexrelid) FROM pg_index "
+        "WHERE indrelid = 'sensor_data'::regclass AND indexrelid NOT IN "
+        "(SELECT conindid FROM pg_constraint WHERE conrelid = 'sensor_data'::regclass)"
+    ).fetchall()
+    for name, _ in constraints:
+        connection.execute(f'ALTER TABLE sensor_data DROP CONSTRAINT "{name}"')
+    for name, _ in indexes:
+        connection.execute(f"DROP INDEX {name}")
+    connection.commit()
+    return [
+        *(
+            f'ALTER TABLE sensor_data ADD CONSTRAINT "{name}" {definition}'
+            for (name, definition) in constraints
+        ),
+        *(definition for (_, definition) in indexes),
+    ]
+
+
+def rebuild_index(statement: str, maintenance_work_mem: str) -> None:
+    with connect() as connection:
+        connection.execute(f"SET maintenance_work_mem = '{maintenance_work_mem}'")
+        start = time.perf_counter()
+        connection.execute(statement)
+        logger.info(f"{statement} ({time.perf_counter() - start:.1f}s)")
+
+
+def load(
+    series: SyntheticSeries,
+    *,
+    workers: int,
+    rows_per_copy: int = 1_000_000,
+    drop: bool = False,
+    maintenance_work_mem: str = "512MB",
+) -> int:
+    """
+    Loads the series with a COPY per window, workers at a time. With drop, the
+    indexes are dropped first and rebuilt in parallel at the end, even if the
+    load failed. Returns the rows loaded.
+    """
+    windows = series.windows(rows_per_copy)
+    statements = []
+    if drop:
+        with connect() as connection:
+            statements = drop_indexes(connection)
+        logger.info(f"Dropped {len(statements)} indexes and constraints")
+
+    rows = 0
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(load_window, series, first, steps)
+                for (first, steps) in windows
+            ]
+            for index, future in enumerate(futures, 1):
+                rows += future.result()
+                if index % max(1, len(windows) // 20) == 0 or index == len(windows):
+                    elapsed = time.perf_counter() - start
+                    logger.info(
+                        f"{index}/{len(windows)} windows, {rows:,} rows, {rows / elapsed:,.0f} rows/s"
+                    )
+    finally:
+        if statements:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(
+                    executor.map(
+                        lambda statement: rebuild_index(
+                            statement, maintenance_work_mem
+                        ),
+                        statements,
+                    )
+                )
+
+    with connect() as connection:
+        connection.execute("ANALYZE sensor_data")
+    return rows
+
+
+def delete_series(series: SyntheticSeries) -> int:
+    with connect() as connection:
+        return connection.execute(
+            "DELETE FROM sensor_data WHERE equipment_id LIKE %s",
+            (series.prefix.replace("%", r"\%").replace("_", r"\_") + "%",),
+        ).rowcount
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Loads synthetic sensor data")
+    parser.add_argument(
+        "--equipment", type=int, default=2000, help="Equipment to generate"
+    )
+    parser.add_argument(
+        "--interval-seconds",
+        type=float,
+        default=10,
+        help="Seconds between two readings of an equipment",
+    )
+    parser.add_argument(
+        "--days", type=float, default=90, help="Days of readings, up to now"
+    )
+    parser.add_argument("--prefix", default="eq-", help="Prefix of the equipment ids")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator")
+    parser.add_argument(
+        "--spike-rate",
+        type=float,
+        default=1e-4,
+        help="Probability of a spike per reading",
+    )
+    parser.add_argument(
+        "--gap-rate", type=float, default=0.2, help="Outages per equipment per day"
+    )
+    parser.add_argument(
+        "--gap-minutes", type=float, default=30, help="Mean length of the outages"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="Parallel COPY streams"
+    )
+    parser.add_argument(
+        "--rows-per-copy", type=int, default=1_000_000, help="Rows of each COPY"
+    )
+    parser.add_argument(
+        "--drop-indexes",
+        action="store_true",
+        help="Drop the indexes during the load and rebuild them after (don't serve traffic meanwhile)",
+    )
+    parser.add_argument(
+        "--maintenance-work-mem", default="512MB", help="Memory of each index rebuild"
+    )
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="Delete the existing readings of the prefix first",
+    )
+    args = parser.parse_args()
+
+    series = SyntheticSeries(
+        equipment=args.equipment,
+        interval_seconds=args.interval_seconds,
+        days=args.days,
+        prefix=args.prefix,
+        seed=args.seed,
+        spike_rate=args.spike_rate,
+        gap_rate=args.gap_rate,
+        gap_minutes=args.gap_minutes,
+    )
+    if args.replace:
+        logger.info(f"Deleted {delete_series(series):,} existing readings")
+    logger.info(
+        f"Loading {series.equipment} equipment x {series.steps:,} readings "
+        f"({series.start} to {series.end}) with {args.workers} workers..."
+    )
+    start = time.perf_counter()
+    rows = load(
+        series,
+        workers=args.workers,
+        rows_per_copy=args.rows_per_copy,
+        drop=args.drop_indexes,
+        maintenance_work_mem=args.maintenance_work_mem,
+    )
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Loaded {rows:,} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,36 @@
-import sentry_sdk
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import datetime
+
 from fastapi import FastAPI
 from fastapi.routing import APIRoute
+from sqlalchemy import exc
+from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 
+from app import async_crud
 from app.api.main import api_router
+from app.api.routes import monitoring
+from app.core import metrics
+from app.core.api_keys import ApiKeyEntry, api_key_table
+from app.core.cache import prune_hour_watermarks
 from app.core.config import settings
+from app.core.db import async_engine, engine, read_router
+from app.core.email_outbox import EmailOutboxSender
+from app.core.instrumentation import MetricsMiddleware, flush_metrics
+from app.core.profiling import ProfilingMiddleware
+from app.core.security import shutdown_password_executor
+from app.core.slow_queries import slow_query_log
+from app.core.timeouts import (
+    ClientDisconnected,
+    client_disconnected_handler,
+    database_error_handler,
+    pool_timeout_handler,
+)
+from app.core.traffic import TrafficRecordingMiddleware, traffic_recorder
+from app.core.user_cache import UserCacheListener, user_cache
 
 
 # Allows us to create unique ids without 
@@ -14,14 +40,70 @@ def custom_generate_unique_id(route: APIRoute) -> str:
 
 
 if settings.SENTRY_DSN and settings.ENVIRONMENT != "local":
+    # Only imported when enabled, it pulls in a whole HTTP stack
+    import sentry_sdk
+
     sentry_sdk.init(dsn=str(settings.SENTRY_DSN), enable_tracing=True)
 
+async def fetch_api_keys() -> list[ApiKeyEntry]:
+    async with AsyncSession(async_engine) as session:
+        return await async_crud.get_active_api_key_entries(session=session)
+
+
+async def delete_old_hour_watermarks(before: datetime) -> int:
+    async with AsyncSession(async_engine) as session:
+        return await async_crud.delete_old_hour_watermarks(session=session, before=before)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    # The user cache is only enabled while its invalidations are received
+    listener = UserCacheListener(
+        user_cache, str(settings.SQLALCHEMY_DATABASE_URI).replace("+psycopg", "")
+    )
+    listener_task = asyncio.create_task(listener.run())
+    api_keys_task = asyncio.create_task(api_key_table.run(fetch_api_keys))
+    watermarks_task = asyncio.create_task(prune_hour_watermarks(delete_old_hour_watermarks))
+    email_sender = EmailOutboxSender(engine)
+    email_task = (
+        asyncio.create_task(email_sender.run()) if settings.emails_enabled else None
+    )
+    metrics_task = (
+        asyncio.create_task(flush_metrics(settings.METRICS_MULTIPROC_DIR))
+        if settings.METRICS_MULTIPROC_DIR else None
+    )
+    yield
+    listener_task.cancel()
+    api_keys_task.cancel()
+    watermarks_task.cancel()
+    if email_task:
+        email_task.cancel()
+    if metrics_task:
+        metrics_task.cancel()
+    if settings.METRICS_MULTIPROC_DIR:
+        # The counters of this worker keep being reported once it's gone
+        metrics.write_snapshot(settings.METRICS_MULTIPROC_DIR)
+    email_sender.close()
+    shutdown_password_executor()
+    slow_query_log.shutdown()
+    traffic_recorder.close()
+    # Async connections are bound to the event loop that created them
+    await async_engine.dispose()
+    await read_router.dispose()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
+    lifespan=lifespan,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
 )
 
+# Statement timeouts answer 504, an exhausted connection pool 503
+app.add_exception_handler(exc.OperationalError, database_error_handler)
+app.add_exception_handler(exc.TimeoutError, pool_timeout_handler)
+app.add_exception_handler(ClientDisconnected, client_disconnected_handler)
+
 # CORS setup
 if settings.BACKEND_CORS_ORIGINS:
     app.add_middleware(
@@ -34,5 +116,20 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_headers=["*"],
     )
 
+# Responses already compressed (see core/encoded.py) are left as they are
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=settings.RESPONSE_COMPRESSION_MIN_BYTES,
+    compresslevel=settings.RESPONSE_COMPRESSION_LEVEL,
+)
+
+app.add_middleware(ProfilingMiddleware)
+if settings.TRAFFIC_RECORD_DIR:
+    app.add_middleware(TrafficRecordingMiddleware)
+# Added last so it's the outermost, the time spent in the other middlewares is
+# measured too
+app.add_middleware(MetricsMiddleware)
+
 # Router setup
 app.include_router(api_router, prefix=settings.API_V1_STR)
+app.include_router(monitoring.router, tags=["monitoring"])
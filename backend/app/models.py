@@ -5,6 +5,8 @@ import math
 import uuid
 
 from pydantic import EmailStr, model_validator
+from sqlalchemy import BigInteger, Column, Index, String, Text, text
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlmodel import Field, SQLModel
 
 
@@ -80,6 +82,81 @@ class NewPassword(SQLModel):
     new_password: str = Field(min_length=8, max_length=40)
 
 
+# Permissions an API key can be given
+class ApiKeyScope(str, Enum):
+    SENSOR_DATA_WRITE = "sensor_data:write"
+
+
+# Shared properties of the API keys of machine clients (e.g. sensor gateways)
+class ApiKeyBase(SQLModel):
+    name: str = Field(min_length=1, max_length=255)
+
+
+# Properties to receive via API on creation
+class ApiKeyCreate(ApiKeyBase):
+    scopes: list[ApiKeyScope] = Field(min_length=1)
+
+
+# Database model. Only an HMAC of the secret part of the key is stored.
+class ApiKey(ApiKeyBase, table=True):
+    __tablename__ = "api_key"
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    prefix: str = Field(unique=True, index=True, max_length=16)
+    secret_hash: str = Field(max_length=64)
+    scopes: list[str] = Field(sa_column=Column(ARRAY(String), nullable=False))
+    owner_id: uuid.UUID = Field(foreign_key="user.id", nullable=False, ondelete="CASCADE")
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    revoked_at: datetime | None = None
+
+
+# Properties to return via API, the key itself is never returned again
+class ApiKeyPublic(ApiKeyBase):
+    id: uuid.UUID
+    prefix: str
+    scopes: list[str]
+    created_at: datetime
+    revoked_at: datetime | None
+
+
+# Returned once, on creation
+class ApiKeyCreated(ApiKeyPublic):
+    key: str
+
+
+class ApiKeysPublic(SQLModel):
+    data: list[ApiKeyPublic]
+    count: int
+
+
+# Emails waiting to be delivered by the outbox sender, see core/email_outbox.py.
+# Rows are deleted once sent, failed ones are kept for inspection.
+class EmailOutboxStatus(str, Enum):
+    PENDING = "pending"
+    FAILED = "failed"
+
+
+class EmailOutbox(SQLModel, table=True):
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        # Only the pending emails are ever polled
+        Index(
+            "ix_email_outbox_pending", "next_attempt_at",
+            postgresql_where=text("status = 'pending'"),
+        ),
+    )
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    email_to: str = Field(max_length=255)
+    subject: str = Field(max_length=255)
+    html_content: str = Field(sa_column=Column(Text, nullable=False))
+    status: EmailOutboxStatus = Field(
+        default=EmailOutboxStatus.PENDING, sa_column=Column(String(16), nullable=False)
+    )
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    last_error: str | None = None
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+
+
 # Shared properties 
 class SensorDataBase(SQLModel):
     equipment_id: str = Field(min_length=1, max_length=255)
@@ -106,6 +183,11 @@ class SensorDataUpdate(SensorDataBase):
 # Database model, database table inferred from class name
 class SensorData(SensorDataBase, table=True):
     __tablename__ = "sensor_data"
+    # Readings arrive roughly in time order, a tiny BRIN index lets range queries
+    # (and the slices of the parallel aggregation) skip the other pages
+    __table_args__ = (
+        Index("ix_sensor_data_timestamp_brin", "timestamp", postgresql_using="brin"),
+    )
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     equipment_id: str = Field(min_length=1, max_length=255)
     value: float
@@ -122,6 +204,22 @@ class SensorData(SensorDataBase, table=True):
         return data
 
 
+# Last ingest sequence that touched each equipment, maintained by a database trigger
+class SensorDataWatermark(SQLModel, table=True):
+    __tablename__ = "sensor_data_watermark"
+    equipment_id: str = Field(primary_key=True, max_length=255)
+    seq: int = Field(sa_column=Column(BigInteger, nullable=False))
+
+
+# Last ingest sequence that touched each hour of each equipment, maintained by the
+# same trigger, for the line chart cache. Only the last week is kept.
+class SensorDataHourWatermark(SQLModel, table=True):
+    __tablename__ = "sensor_data_hour_watermark"
+    hour: datetime = Field(primary_key=True)
+    equipment_id: str = Field(primary_key=True, max_length=255)
+    seq: int = Field(sa_column=Column(BigInteger, nullable=False))
+
+
 # Properties to return via API, id is always required
 class SensorDataPublic(SensorDataBase):
     id: uuid.UUID
@@ -150,6 +248,11 @@ class SensorDataFetchMode(Enum):
     ALL_TIME = 6
 
 
+class SensorDataAccuracy(str, Enum):
+    EXACT = "exact"
+    APPROXIMATE = "approximate"
+
+
 # Properties to receive on dashboard queries
 class SensorDataDashboardFetch(SQLModel):
     skip: int 
@@ -158,6 +261,7 @@ class SensorDataDashboardFetch(SQLModel):
     equipment_ids: Optional[list[str]] = Field(None, description="The list of equipments id to filter.")
     begin_custom_date: Optional[datetime] = Field(None, description="The start of the date interval for custom fetch.")
     end_custom_date: Optional[datetime] = Field(None, description="The end of the date interval for custom fetch.")
+    accuracy: SensorDataAccuracy = Field(SensorDataAccuracy.EXACT, description="Approximate answers are computed over a sample of the data, much faster on long intervals.")
 
 
 # Properties to receive on dashboard queries
@@ -166,11 +270,6 @@ class SensorDataLineChartDashboardItem(SQLModel):
     date_trunc: datetime
     avg: float
 
-    def __init__(self, row):
-        self.equipment_id=row['equipment'],
-        self.date_trunc=row['date_trunc'],
-        self.avg=row['avg']
-
 
 # Properties to receive on dashboard queries
 class SensorDataLineChartDashboard(SQLModel):
@@ -180,16 +279,16 @@ class SensorDataLineChartDashboard(SQLModel):
 class SensorDataBarChartDashboardItem(SQLModel):
     equipment_id: str
     avg: float
-
-    def __init__(self, row):
-        self.equipment_id=row['equipment_id']
-        self.avg=row['avg']
+    error_bound: Optional[float] = Field(None, description="Half-width of the 95% confidence interval of avg, when approximate.")
 
 
 # Properties to receive on dashboard queries    
 class SensorDataDashboardList(SQLModel):
     data: list[SensorDataBarChartDashboardItem]
     count: int
+    accuracy: SensorDataAccuracy = Field(SensorDataAccuracy.EXACT, description="Approximate when asked for, or when the exact query was too expensive.")
+    sample_percent: Optional[float] = Field(None, description="Share of the data sampled, when approximate.")
+    count_error_bound: Optional[float] = Field(None, description="Relative standard error of count, when approximate. Equipment with little data in the range may be missing from the sample, count is extrapolated from the rarest ones seen.")
 
 
 class Option(SQLModel):
@@ -203,3 +302,41 @@ class Option(SQLModel):
 
 class OptionList(SQLModel):
     data: list[Option]
+
+
+# Entry of the slow query log, see core/slow_queries.py
+class SlowQueryPublic(SQLModel):
+    id: int
+    recorded_at: datetime
+    route: str
+    duration_seconds: float
+    statement: str
+    parameters: str | None
+    plan: Any = Field(None, description="EXPLAIN (ANALYZE, BUFFERS) output, when captured.")
+    plan_error: str | None
+
+
+class SlowQueriesPublic(SQLModel):
+    data: list[SlowQueryPublic]
+    count: int
+
+
+# Profile of a request, see core/profiling.py
+class ProfilePublic(SQLModel):
+    id: str
+    recorded_at: datetime
+    method: str
+    path: str
+    route: str | None
+    status: int | None
+    duration_seconds: float
+    samples: int
+    db_wait_seconds: float = Field(description="Time spent executing statements, measured exactly.")
+    statements: int
+    breakdown: dict[str, float] = Field(description="Sampled time by category: serialization, db, orm, validation and other.")
+    collapsed_stacks: str | None = Field(None, description="Samples by call stack, in the folded format of flamegraph.pl and speedscope.")
+
+
+class ProfilesPublic(SQLModel):
+    data: list[ProfilePublic]
+    count: int
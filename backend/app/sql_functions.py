@@ -1,4 +1,5 @@
 from alembic_utils.pg_function import PGFunction
+from alembic_utils.pg_trigger import PGTrigger
 
 
 avg_last_24 = PGFunction(
@@ -51,3 +52,119 @@ avg_last_24 = PGFunction(
 				END
 				$func$;
 		""")
+
+
+# Keeps sensor_data_watermark up to date: every statement that writes to sensor_data
+# stamps the affected equipment ids with a new value of sensor_data_ingest_seq.
+# Used to build cheap ETags for the read endpoints.
+#
+# The hours of each equipment it writes to are stamped too, in
+# sensor_data_hour_watermark, so the line chart cache of every worker notices
+# late data and deletes (app.core.cache), whoever wrote them. The old hours are
+# pruned by the workers, see app.core.cache.prune_hour_watermarks.
+sensor_data_bump_watermark = PGFunction(
+    schema="public",
+    signature="sensor_data_bump_watermark()",
+    definition="""
+		RETURNS trigger
+		LANGUAGE plpgsql AS
+		$func$
+		BEGIN
+			IF TG_OP IN ('INSERT', 'UPDATE') THEN
+				INSERT INTO sensor_data_watermark (equipment_id, seq)
+				SELECT changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (SELECT DISTINCT equipment_id FROM new_rows) changed
+				ORDER BY changed.equipment_id
+				ON CONFLICT (equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+				INSERT INTO sensor_data_hour_watermark (hour, equipment_id, seq)
+				SELECT changed.hour, changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (
+					SELECT DISTINCT date_trunc('hour', "timestamp") AS hour, equipment_id
+					FROM new_rows
+				) changed
+				ORDER BY changed.hour, changed.equipment_id
+				ON CONFLICT (hour, equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+			END IF;
+			IF TG_OP IN ('UPDATE', 'DELETE') THEN
+				INSERT INTO sensor_data_watermark (equipment_id, seq)
+				SELECT changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (SELECT DISTINCT equipment_id FROM old_rows) changed
+				ORDER BY changed.equipment_id
+				ON CONFLICT (equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+				INSERT INTO sensor_data_hour_watermark (hour, equipment_id, seq)
+				SELECT changed.hour, changed.equipment_id, nextval('sensor_data_ingest_seq')
+				FROM (
+					SELECT DISTINCT date_trunc('hour', "timestamp") AS hour, equipment_id
+					FROM old_rows
+				) changed
+				ORDER BY changed.hour, changed.equipment_id
+				ON CONFLICT (hour, equipment_id) DO UPDATE SET seq = EXCLUDED.seq;
+			END IF;
+			RETURN NULL;
+		END
+		$func$;
+	""")
+
+
+sensor_data_watermark_insert = PGTrigger(
+    schema="public",
+    signature="sensor_data_watermark_insert",
+    on_entity="public.sensor_data",
+    is_constraint=False,
+    definition="""
+		AFTER INSERT ON public.sensor_data
+		REFERENCING NEW TABLE AS new_rows
+		FOR EACH STATEMENT EXECUTE FUNCTION public.sensor_data_bump_watermark()
+	""")
+
+
+sensor_data_watermark_update = PGTrigger(
+    schema="public",
+    signature="sensor_data_watermark_update",
+    on_entity="public.sensor_data",
+    is_constraint=False,
+    definition="""
+		AFTER UPDATE ON public.sensor_data
+		REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+		FOR EACH STATEMENT EXECUTE FUNCTION public.sensor_data_bump_watermark()
+	""")
+
+
+sensor_data_watermark_delete = PGTrigger(
+    schema="public",
+    signature="sensor_data_watermark_delete",
+    on_entity="public.sensor_data",
+    is_constraint=False,
+    definition="""
+		AFTER DELETE ON public.sensor_data
+		REFERENCING OLD TABLE AS old_rows
+		FOR EACH STATEMENT EXECUTE FUNCTION public.sensor_data_bump_watermark()
+	""")
+
+
+# Tells every worker to drop a user from its cache (app.core.user_cache) once the
+# transaction updating or deleting it commits
+user_cache_invalidate = PGFunction(
+    schema="public",
+    signature="user_cache_invalidate()",
+    definition="""
+		RETURNS trigger
+		LANGUAGE plpgsql AS
+		$func$
+		BEGIN
+			PERFORM pg_notify('user_cache_invalidate', OLD.id::text);
+			RETURN NULL;
+		END
+		$func$;
+	""")
+
+
+user_cache_invalidate_trigger = PGTrigger(
+    schema="public",
+    signature="user_cache_invalidate_trigger",
+    on_entity='public."user"',
+    is_constraint=False,
+    definition="""
+		AFTER UPDATE OR DELETE ON public."user"
+		FOR EACH ROW EXECUTE FUNCTION public.user_cache_invalidate()
+	""")
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app import crud
+from app.core.config import settings
+from app.tests.utils.utils import random_float, random_lower_string
+
+
+def test_ingest_with_api_key(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/api-keys/",
+        headers=normal_user_token_headers,
+        json={"name": "gateway", "scopes": ["sensor_data:write"]},
+    )
+    assert r.status_code == 200
+    created_api_key = r.json()
+    api_key_headers = {"X-API-Key": created_api_key["key"]}
+
+    data = {
+        "equipment_id": random_lower_string(),
+        "value": random_float(),
+        "timestamp": datetime.today().isoformat(),
+    }
+    r = client.post(
+        f"{settings.API_V1_STR}/sensor-data/", headers=api_key_headers, json=data
+    )
+    assert r.status_code == 200
+    crud.delete_sensor_data_by_id(session=db, id=r.json()["id"])
+
+    # The CSV import is for superusers only, so is it for their keys
+    r = client.post(
+        f"{settings.API_V1_STR}/sensor-data/csv",
+        headers=api_key_headers,
+        files={"sensor_data_csv_file": ("data.csv", b"equipmentId,timestamp,value\n")},
+    )
+    assert r.status_code == 403
+
+    r = client.get(
+        f"{settings.API_V1_STR}/api-keys/", headers=normal_user_token_headers
+    )
+    assert r.status_code == 200
+    listed = [api_key["id"] for api_key in r.json()["data"]]
+    assert created_api_key["id"] in listed
+    assert all("key" not in api_key for api_key in r.json()["data"])
+
+    r = client.delete(
+        f"{settings.API_V1_STR}/api-keys/{created_api_key['id']}",
+        headers=normal_user_token_headers,
+    )
+    assert r.status_code == 200
+    assert r.json()["revoked_at"]
+
+    r = client.post(
+        f"{settings.API_V1_STR}/sensor-data/", headers=api_key_headers, json=data
+    )
+    assert r.status_code == 401
+
+
+def test_ingest_with_invalid_api_key(client: TestClient) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/sensor-data/",
+        headers={
+            "X-API-Key": f"pgk_{random_lower_string()[:8]}_{random_lower_string()}"
+        },
+        json={"equipment_id": "EQ-1", "value": 1.0},
+    )
+    assert r.status_code == 401
+
+
+def test_create_api_key_without_scope(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/api-keys/",
+        headers=normal_user_token_headers,
+        json={"name": "gateway", "scopes": []},
+    )
+    assert r.status_code == 422
@@ -4,7 +4,9 @@ from fastapi.testclient import TestClient
 from sqlmodel import Session, select
 
 from app.core.config import settings
+from app.core.rate_limit import LoginLimiter, MemoryBucketStore
 from app.core.security import verify_password
+from app.main import app
 from app.models import User
 from app.utils import generate_password_reset_token
 
@@ -42,6 +44,53 @@ def test_use_access_token(
     assert "email" in result
 
 
+def test_get_access_token_rate_limited(client: TestClient) -> None:
+    limiter = LoginLimiter(MemoryBucketStore())
+    with (
+        patch("app.api.routes.auth.login_limiter", limiter),
+        patch("app.core.config.settings.LOGIN_ACCOUNT_BURST", 2),
+    ):
+        login_data = {"username": "stuffed@example.com", "password": "incorrect"}
+        statuses = [
+            client.post(f"{settings.API_V1_STR}/login/access-token", data=login_data).status_code
+            for _ in range(3)
+        ]
+        # Same address, another account
+        login_data["username"] = "other@example.com"
+        r = client.post(f"{settings.API_V1_STR}/login/access-token", data=login_data)
+
+    assert statuses == [400, 400, 429]
+    assert r.status_code == 400
+    assert limiter.check_seconds > 0
+
+
+def test_get_access_token_rate_limited_by_forwarded_address() -> None:
+    limiter = LoginLimiter(MemoryBucketStore())
+    # As seen behind Traefik: same peer, the client in X-Forwarded-For
+    proxied = TestClient(app, client=("127.0.0.1", 50000))
+    with (
+        patch("app.api.routes.auth.login_limiter", limiter),
+        patch("app.core.config.settings.LOGIN_IP_BURST", 2),
+    ):
+        statuses = [
+            proxied.post(
+                f"{settings.API_V1_STR}/login/access-token",
+                data={"username": f"stuffed{i}@example.com", "password": "incorrect"},
+                headers={"X-Forwarded-For": "203.0.113.7"},
+            ).status_code
+            for i in range(3)
+        ]
+        # Another client behind the same proxy has its own bucket
+        r = proxied.post(
+            f"{settings.API_V1_STR}/login/access-token",
+            data={"username": "other@example.com", "password": "incorrect"},
+            headers={"X-Forwarded-For": "203.0.113.8"},
+        )
+
+    assert statuses == [400, 400, 429]
+    assert r.status_code == 400
+
+
 def test_recovery_password(
     client: TestClient, normal_user_token_headers: dict[str, str]
 ) -> None:
@@ -0,0 +1,48 @@
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+
+
+def test_prometheus_metrics(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    superuser_token_headers: dict[str, str],
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/sensor-data/?limit=1", headers=normal_user_token_headers
+    )
+    assert r.status_code == 200
+
+    r = client.get("/metrics", headers=superuser_token_headers)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    # Named after the operation id of the route
+    assert (
+        'http_request_duration_seconds_count{route="sensor-data-read_sensors_data",'
+        'method="GET",status="200"}' in r.text
+    )
+    assert (
+        'db_query_duration_seconds_count{route="sensor-data-read_sensors_data",operation="SELECT"}'
+        in r.text
+    )
+    assert (
+        'http_response_size_bytes_bucket{route="sensor-data-read_sensors_data",le="+Inf"}'
+        in r.text
+    )
+    assert 'cache_requests_total{cache="token",result=' in r.text
+
+
+def test_prometheus_metrics_require_a_superuser(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers=normal_user_token_headers).status_code == 403
+
+
+def test_prometheus_metrics_token(client: TestClient) -> None:
+    with patch("app.core.config.settings.METRICS_TOKEN", "scraper-token"):
+        assert client.get("/metrics").status_code == 401
+        r = client.get("/metrics", headers={"Authorization": "Bearer scraper-token"})
+        assert r.status_code == 200
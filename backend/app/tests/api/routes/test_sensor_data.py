@@ -1,13 +1,17 @@
 import io
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-from datetime import datetime
+import pytest
+from datetime import datetime, timedelta
 
 from fastapi.testclient import TestClient
+from sqlalchemy import text
 from sqlmodel import Session, select
 
 from app import crud
 from app.core.config import settings
+from app.core.encoded import encoded_response_cache
 from app.models import SensorData, SensorDataCreate
 from app.tests.utils.utils import random_lower_string, random_float
 
@@ -190,6 +194,40 @@ def test_retrieve_equipment_options(
     crud.delete_sensor_data_by_id(session=db, id=sensor.id)
 
 
+def test_retrieve_equipment_options_compressed(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # Large enough to be compressed, whatever the other tests left
+    monkeypatch.setattr(settings, "RESPONSE_COMPRESSION_MIN_BYTES", 1)
+    sensor_in = SensorDataCreate(
+        equipment_id=random_lower_string(), value=random_float(), timestamp=datetime.today()
+    )
+    sensor = crud.create_sensor_data(session=db, sensor_create_data=sensor_in)
+
+    r = client.get(
+        f"{settings.API_V1_STR}/sensor-data/options/equipment",
+        headers={**normal_user_token_headers, "Accept-Encoding": "gzip"}
+    )
+    assert r.status_code == 200
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert sensor.equipment_id in [option["value"] for option in r.json()["data"]]
+
+    # The next ones are served from the encoded entry
+    body = encoded_response_cache.get(r.headers["ETag"])
+    assert body is not None
+    r = client.get(
+        f"{settings.API_V1_STR}/sensor-data/options/equipment",
+        headers={**normal_user_token_headers, "Accept-Encoding": "identity"}
+    )
+    assert "Content-Encoding" not in r.headers
+    assert r.content == body.identity
+    # Cleanup
+    crud.delete_sensor_data_by_id(session=db, id=sensor.id)
+
+
 def test_update_sensor_data(
     client: TestClient, normal_user_token_headers: dict[str, str], db: Session
 ) -> None:
@@ -266,3 +304,252 @@ def test_delete_sensor_data_not_found(
     )
     assert r.status_code == 404
     assert r.json()["detail"] == "Sensor data not found"
+
+
+def test_retrieve_equipment_options_not_modified(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    r = client.get(f"{settings.API_V1_STR}/sensor-data/options/equipment", headers=normal_user_token_headers)
+    assert r.status_code == 200
+    etag = r.headers["ETag"]
+
+    r = client.get(
+        f"{settings.API_V1_STR}/sensor-data/options/equipment",
+        headers={**normal_user_token_headers, "If-None-Match": etag}
+    )
+    assert r.status_code == 304
+    assert r.headers["ETag"] == etag
+
+    # New data changes the watermark, so the response must be sent again
+    sensor_in = SensorDataCreate(
+        equipment_id=random_lower_string(), value=random_float(), timestamp=datetime.today()
+    )
+    sensor = crud.create_sensor_data(session=db, sensor_create_data=sensor_in)
+
+    r = client.get(
+        f"{settings.API_V1_STR}/sensor-data/options/equipment",
+        headers={**normal_user_token_headers, "If-None-Match": etag}
+    )
+    assert r.status_code == 200
+    assert r.headers["ETag"] != etag
+    # Cleanup
+    crud.delete_sensor_data_by_id(session=db, id=sensor.id)
+
+
+def test_bar_chart_over_budget_is_sampled_or_rejected(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    sensor_in = SensorDataCreate(
+        equipment_id=random_lower_string(), value=random_float(), timestamp=datetime.today()
+    )
+    sensor = crud.create_sensor_data(session=db, sensor_create_data=sensor_in)
+    data = {"skip": 0, "limit": 5, "fetch_mode": 6}
+
+    monkeypatch.setattr(settings, "DASHBOARD_COST_BUDGET", 0.001)
+    monkeypatch.setattr(settings, "DASHBOARD_MIN_SAMPLE_PERCENT", 0.0)
+    r = client.post(
+        f"{settings.API_V1_STR}/sensor-data/dashboard/bar-chart",
+        headers=normal_user_token_headers,
+        json=data
+    )
+    assert r.status_code == 200
+    assert r.json()["accuracy"] == "approximate"
+    assert 0 < r.json()["sample_percent"] < 100
+
+    monkeypatch.setattr(settings, "DASHBOARD_OVER_BUDGET", "reject")
+    r = client.post(
+        f"{settings.API_V1_STR}/sensor-data/dashboard/bar-chart",
+        headers=normal_user_token_headers,
+        json=data
+    )
+    assert r.status_code == 400
+    assert r.json()["detail"]["code"] == "query_too_expensive"
+
+    # Cleanup
+    crud.delete_sensor_data_by_id(session=db, id=sensor.id)
+
+
+def test_bar_chart_approximate_accuracy(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    equipment_id = random_lower_string()
+    sensors = [
+        crud.create_sensor_data(
+            session=db,
+            sensor_create_data=SensorDataCreate(
+                equipment_id=equipment_id, value=value, timestamp=datetime.today()
+            )
+        )
+        for value in [1.0, 2.0, 3.0]
+    ]
+
+    # The whole table is sampled, so the averages and the count are the exact ones
+    monkeypatch.setattr(settings, "DASHBOARD_APPROXIMATE_SAMPLE_PERCENT", 100.0)
+    r = client.post(
+        f"{settings.API_V1_STR}/sensor-data/dashboard/bar-chart",
+        headers=normal_user_token_headers,
+        json={
+            "skip": 0,
+            "limit": 100,
+            "fetch_mode": 1,
+            "equipment_ids": [equipment_id],
+            "accuracy": "approximate"
+        }
+    )
+    result = r.json()
+
+    assert r.status_code == 200
+    assert result["accuracy"] == "approximate"
+    assert result["count"] >= 1
+    assert result["count_error_bound"] == 0
+    assert result["data"][0]["avg"] == 2.0
+    assert result["data"][0]["error_bound"] in (0, None)
+
+    # Cleanup
+    for sensor in sensors:
+        crud.delete_sensor_data_by_id(session=db, id=sensor.id)
+
+
+def test_bar_chart_approximate_accuracy_sampled(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # Values rising with time, as a drifting sensor: the pages differ a lot, the
+    # rows of a page much less
+    equipment_id = random_lower_string()
+    rows = 5000
+    db.execute(
+        text(
+            "INSERT INTO sensor_data (id, equipment_id, value, timestamp) "
+            "SELECT gen_random_uuid(), :equipment_id, i, :timestamp "
+            "FROM generate_series(0, :rows - 1) i"
+        ),
+        {"equipment_id": equipment_id, "timestamp": datetime.today(), "rows": rows}
+    )
+    db.commit()
+
+    monkeypatch.setattr(settings, "DASHBOARD_APPROXIMATE_SAMPLE_PERCENT", 50.0)
+    r = client.post(
+        f"{settings.API_V1_STR}/sensor-data/dashboard/bar-chart",
+        headers=normal_user_token_headers,
+        json={
+            "skip": 0,
+            "limit": 100,
+            "fetch_mode": 1,
+            "equipment_ids": [equipment_id],
+            "accuracy": "approximate"
+        }
+    )
+    result = r.json()
+
+    assert r.status_code == 200
+    assert result["sample_percent"] == 50.0
+    assert result["count"] >= 1
+    assert result["count_error_bound"] >= 0
+    [row] = result["data"]
+    assert row["error_bound"] > 0
+    assert abs(row["avg"] - (rows - 1) / 2) < 3 * row["error_bound"]
+
+    # Cleanup
+    db.execute(
+        text("DELETE FROM sensor_data WHERE equipment_id = :equipment_id"),
+        {"equipment_id": equipment_id}
+    )
+    db.commit()
+
+
+def test_concurrent_dashboard_requests_more_than_pool_connections(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    # The requests waiting for the shared query must not hold all the
+    # connections it needs, or it waits for pool_timeout and they all fail
+    requests = settings.POSTGRES_POOL_SIZE + settings.POSTGRES_POOL_MAX_OVERFLOW + 5
+
+    def line_chart(_: int) -> int:
+        return client.post(
+            f"{settings.API_V1_STR}/sensor-data/dashboard/line-chart",
+            headers=normal_user_token_headers,
+        ).status_code
+
+    with ThreadPoolExecutor(max_workers=requests) as executor:
+        statuses = list(executor.map(line_chart, range(requests)))
+
+    assert statuses == [200] * requests
+
+
+def test_line_chart_sees_late_data_written_elsewhere(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    # Straight to the table, as the bulk loader or another worker would
+    equipment_id = random_lower_string()
+    closed_hour = datetime.today().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+
+    def insert(value: float) -> None:
+        db.execute(
+            text(
+                "INSERT INTO sensor_data (id, equipment_id, value, timestamp) "
+                "VALUES (:id, :equipment_id, :value, :timestamp)"
+            ),
+            {
+                "id": uuid.uuid4(),
+                "equipment_id": equipment_id,
+                "value": value,
+                "timestamp": closed_hour + timedelta(minutes=10)
+            }
+        )
+        db.commit()
+
+    def averages() -> list[float]:
+        r = client.post(
+            f"{settings.API_V1_STR}/sensor-data/dashboard/line-chart",
+            headers=normal_user_token_headers,
+        )
+        return [row["avg"] for row in r.json()["data"] if row["equipment_id"] == equipment_id]
+
+    insert(1.0)
+    assert averages() == [1.0]
+
+    insert(3.0)
+    assert averages() == [2.0]
+
+    db.execute(
+        text("DELETE FROM sensor_data WHERE equipment_id = :equipment_id"),
+        {"equipment_id": equipment_id}
+    )
+    db.commit()
+    assert averages() == []
+
+
+def test_concurrent_long_bar_charts_more_than_pool_connections(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    # Distinct long ranges, each aggregated in parallel slices: the requests
+    # waiting for their slices must not hold the connections the slices need
+    requests = settings.POSTGRES_POOL_SIZE + settings.POSTGRES_POOL_MAX_OVERFLOW + 5
+    end = datetime.today()
+
+    def bar_chart(index: int) -> int:
+        return client.post(
+            f"{settings.API_V1_STR}/sensor-data/dashboard/bar-chart",
+            headers=normal_user_token_headers,
+            json={
+                "skip": 0,
+                "limit": 5,
+                "fetch_mode": 5,
+                "begin_custom_date": (end - timedelta(days=30 + index)).isoformat(),
+                "end_custom_date": end.isoformat(),
+            },
+        ).status_code
+
+    with ThreadPoolExecutor(max_workers=requests) as executor:
+        statuses = list(executor.map(bar_chart, range(requests)))
+
+    assert statuses == [200] * requests
@@ -0,0 +1,121 @@
+from fastapi.testclient import TestClient
+from sqlmodel import Session, col, delete
+
+from app.core.config import settings
+from app.core.slow_queries import slow_query_log
+from app.models import SensorData
+from app.tests.utils.utils import random_lower_string
+
+
+def test_read_slow_queries(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    normal_user_token_headers: dict[str, str],
+) -> None:
+    slow_query_log.clear()
+    slow_query_log.record(
+        statement="SELECT 1",
+        parameters={"equipment_ids": ["EQ-1"]},
+        route="sensor-data-read_sensor_data_for_bar_chart",
+        duration_seconds=3.5,
+        operation="SELECT",
+        executemany=False,
+    )
+
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/slow-queries/", headers=superuser_token_headers
+    )
+    assert r.status_code == 200
+    body = r.json()
+    assert body["count"] == 1
+    assert body["data"][0]["route"] == "sensor-data-read_sensor_data_for_bar_chart"
+    # Not kept unless SLOW_QUERY_LOG_PARAMETERS
+    assert body["data"][0]["parameters"] is None
+
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/slow-queries/", headers=normal_user_token_headers
+    )
+    assert r.status_code == 403
+    slow_query_log.clear()
+
+
+def test_profile_sync_route(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    normal_user_token_headers: dict[str, str],
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/users/me",
+        headers={**normal_user_token_headers, "X-Profile": "1"},
+    )
+    # Only superusers can profile
+    assert "X-Profile-Id" not in r.headers
+
+    r = client.get(
+        f"{settings.API_V1_STR}/users/me",
+        headers={**superuser_token_headers, "X-Profile": "1"},
+    )
+    assert r.status_code == 200
+    profile_id = r.headers["X-Profile-Id"]
+
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/profiles/{profile_id}",
+        headers=superuser_token_headers,
+    )
+    assert r.status_code == 200
+    profile = r.json()
+    assert profile["route"] == "users-read_user_me"
+    assert profile["status"] == 200
+    assert set(profile["breakdown"]) == {
+        "serialization",
+        "db",
+        "orm",
+        "validation",
+        "other",
+    }
+
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/profiles/", headers=superuser_token_headers
+    )
+    assert profile_id in [profile["id"] for profile in r.json()["data"]]
+
+
+def test_profile_csv_import(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    equipment_id = f"profile-{random_lower_string()[:8]}"
+    rows = "".join(
+        f"{equipment_id},2024-01-01T{hour % 24:02}:{minute:02}:00,{minute}.5\n"
+        for hour in range(50)
+        for minute in range(60)
+    )
+    r = client.post(
+        f"{settings.API_V1_STR}/sensor-data/csv",
+        headers={**superuser_token_headers, "X-Profile": "1"},
+        files={
+            "sensor_data_csv_file": (
+                "data.csv",
+                f"equipmentId,timestamp,value\n{rows}".encode(),
+            )
+        },
+    )
+    assert r.status_code == 200
+    db.execute(delete(SensorData).where(col(SensorData.equipment_id) == equipment_id))
+    db.commit()
+
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/profiles/{r.headers['X-Profile-Id']}",
+        headers=superuser_token_headers,
+    )
+    profile = r.json()
+    assert profile["statements"] > 0
+    assert profile["db_wait_seconds"] > 0
+    # The parsing and validation in the threadpool are sampled too
+    assert profile["samples"] > 0
+    assert "parse_csv_sensor_data_file" in profile["collapsed_stacks"]
+
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/profiles/{profile['id']}?format=collapsed",
+        headers=superuser_token_headers,
+    )
+    assert r.text == profile["collapsed_stacks"]
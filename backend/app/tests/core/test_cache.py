@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from app.core.cache import HourlyBucketCache
+
+
+class FakeFetcher:
+    def __init__(self, rows: list[tuple[str, datetime, float]]):
+        self.rows = rows
+        self.calls: list[tuple[datetime, datetime, list[str] | None]] = []
+        # Bumped by the writes, as the database trigger does
+        self.watermarks: dict[datetime, int] = {}
+
+    async def __call__(
+        self, begin: datetime, end: datetime, equipment_ids: list[str] | None
+    ) -> list[tuple[str, datetime, float]]:
+        self.calls.append((begin, end, equipment_ids))
+        return [
+            row
+            for row in self.rows
+            if begin <= row[1] < end and (not equipment_ids or row[0] in equipment_ids)
+        ]
+
+    async def fetch_watermarks(
+        self, begin: datetime, end: datetime
+    ) -> dict[datetime, int]:
+        return {
+            hour: seq for hour, seq in self.watermarks.items() if begin <= hour < end
+        }
+
+    def write(self, rows: list[tuple[str, datetime, float]], hour: datetime) -> None:
+        self.rows = rows
+        self.watermarks[hour] = self.watermarks.get(hour, 0) + 1
+
+
+def test_closed_hours_are_fetched_only_once() -> None:
+    now = datetime(2024, 9, 12, 15, 30)
+    fetch = FakeFetcher(
+        [
+            ("eq-1", datetime(2024, 9, 12, 10), 1.0),
+            ("eq-1", datetime(2024, 9, 12, 15), 2.0),
+        ]
+    )
+    cache = HourlyBucketCache(window_hours=24)
+
+    rows = asyncio.run(cache.get(fetch, fetch.fetch_watermarks, now=now))
+    assert [row["avg"] for row in rows] == [1.0, 2.0]
+    assert fetch.calls[0][0] == datetime(2024, 9, 11, 16)
+
+    fetch.calls.clear()
+    asyncio.run(
+        cache.get(fetch, fetch.fetch_watermarks, now=now + timedelta(minutes=10))
+    )
+    # Only the open hour is recomputed
+    assert fetch.calls == [
+        (datetime(2024, 9, 12, 15), now + timedelta(minutes=10), None)
+    ]
+
+
+def test_late_data_recomputes_only_its_hour() -> None:
+    now = datetime.today().replace(minute=30)
+    closed_hour = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+    fetch = FakeFetcher([("eq-1", closed_hour, 1.0)])
+    cache = HourlyBucketCache(window_hours=24)
+    asyncio.run(cache.get(fetch, fetch.fetch_watermarks, now=now))
+
+    fetch.write([("eq-1", closed_hour, 5.0)], closed_hour)
+    fetch.calls.clear()
+    rows = asyncio.run(cache.get(fetch, fetch.fetch_watermarks, now=now))
+
+    assert (closed_hour, closed_hour + timedelta(hours=1), None) in fetch.calls
+    assert len(fetch.calls) == 2
+    assert rows == [{"equipment_id": "eq-1", "date_trunc": closed_hour, "avg": 5.0}]
+
+
+def test_deleted_data_is_removed_from_bucket() -> None:
+    now = datetime.today().replace(minute=30)
+    closed_hour = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+    fetch = FakeFetcher([("eq-1", closed_hour, 1.0)])
+    cache = HourlyBucketCache(window_hours=24)
+    asyncio.run(cache.get(fetch, fetch.fetch_watermarks, now=now))
+
+    fetch.write([], closed_hour)
+
+    assert asyncio.run(cache.get(fetch, fetch.fetch_watermarks, now=now)) == []
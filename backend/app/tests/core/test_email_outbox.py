@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+from typing import Any
+from unittest.mock import patch
+
+from sqlmodel import Session
+
+from app import crud
+from app.core.config import settings
+from app.core.db import engine
+from app.core.email_outbox import EmailOutboxSender, retry_delay
+from app.models import EmailOutbox, EmailOutboxStatus
+from app.tests.utils.utils import random_email
+from app.utils import get_email_template
+
+
+class FakeSMTP:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.sent: list[list[str]] = []
+        self.closed = False
+
+    def sendmail(
+        self,
+        *,
+        from_addr: str,
+        to_addrs: list[str],
+        msg: str,
+        mail_options: list[str] | None = None,
+        rcpt_options: list[str] | None = None,
+    ) -> None:
+        if self.fail:
+            raise ConnectionRefusedError("SMTP server down")
+        self.sent.append(to_addrs)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def emails_enabled() -> Any:
+    return patch.multiple(
+        settings, SMTP_HOST="smtp.example.com", EMAILS_FROM_EMAIL="admin@example.com"
+    )
+
+
+def test_sender_reuses_the_smtp_connection(db: Session) -> None:
+    smtp = FakeSMTP()
+    connections = []
+
+    def smtp_factory() -> Any:
+        connections.append(smtp)
+        return smtp
+
+    emails_to = [random_email(), random_email()]
+    with emails_enabled():
+        email_ids = [
+            crud.enqueue_email(
+                session=db, email_to=email_to, subject="Test", html_content="<p>Hi</p>"
+            ).id
+            for email_to in emails_to
+        ]
+        EmailOutboxSender(engine, smtp_factory).send_pending()
+
+    assert len(connections) == 1
+    for email_to in emails_to:
+        assert [email_to] in smtp.sent
+    db.expire_all()
+    # Sent emails are removed from the outbox
+    for email_id in email_ids:
+        assert db.get(EmailOutbox, email_id) is None
+
+
+def test_sender_retries_with_backoff(db: Session) -> None:
+    smtp: Any = FakeSMTP(fail=True)
+    with emails_enabled():
+        email = crud.enqueue_email(
+            session=db,
+            email_to=random_email(),
+            subject="Test",
+            html_content="<p>Hi</p>",
+        )
+        sender = EmailOutboxSender(engine, lambda: smtp)
+        sender.send_pending()
+
+    db.refresh(email)
+    assert email.status == EmailOutboxStatus.PENDING.value
+    assert email.attempts == 1
+    assert email.next_attempt_at > datetime.utcnow()
+    assert email.last_error and "SMTP server down" in email.last_error
+    # The broken connection isn't reused
+    assert smtp.closed
+
+    email.attempts = settings.EMAIL_SEND_MAX_ATTEMPTS - 1
+    email.next_attempt_at = datetime.utcnow()
+    db.add(email)
+    db.commit()
+    with emails_enabled():
+        sender.send_pending()
+
+    db.refresh(email)
+    assert email.status == EmailOutboxStatus.FAILED.value
+    db.delete(email)
+    db.commit()
+
+
+def test_retry_delay_is_capped() -> None:
+    assert retry_delay(1) <= timedelta(seconds=settings.EMAIL_RETRY_BACKOFF_SECONDS)
+    assert retry_delay(100) <= timedelta(
+        seconds=settings.EMAIL_RETRY_MAX_BACKOFF_SECONDS
+    )
+
+
+def test_email_templates_are_compiled_once() -> None:
+    assert get_email_template("test_email.html") is get_email_template(
+        "test_email.html"
+    )
@@ -0,0 +1,78 @@
+import gzip
+import json
+
+from fastapi import FastAPI, Request, Response
+from fastapi.testclient import TestClient
+from starlette.middleware.gzip import GZipMiddleware
+
+from app.core.encoded import EncodedBody, encode_json, encoded_response, pick_encoding
+
+ROWS = {
+    "data": [{"value": f"equipment-{i}", "label": f"equipment-{i}"} for i in range(200)]
+}
+
+
+def test_large_bodies_are_compressed_once() -> None:
+    body = encode_json(ROWS)
+
+    assert json.loads(body.identity) == ROWS
+    assert json.loads(gzip.decompress(body.variants["gzip"])) == ROWS
+    # Same bytes each time, the entries don't depend on the clock
+    assert encode_json(ROWS) == body
+
+
+def test_small_bodies_arent_compressed() -> None:
+    assert encode_json({"data": []}).variants == {}
+
+
+def test_pick_encoding() -> None:
+    available = {"gzip": b"", "br": b""}
+
+    assert pick_encoding("gzip, deflate, br", available) == "br"
+    assert pick_encoding("gzip, deflate", available) == "gzip"
+    assert pick_encoding("gzip;q=1.0, br;q=0.5", available) == "gzip"
+    assert pick_encoding("br;q=0, *", available) == "gzip"
+    assert pick_encoding("br", {"gzip": b""}) is None
+    assert pick_encoding("gzip;q=0", available) is None
+    assert pick_encoding("", available) is None
+
+
+def encoded_app(body: EncodedBody) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/options")
+    def options(request: Request) -> Response:
+        return encoded_response(request, body, '"etag"')
+
+    @app.get("/uncached")
+    def uncached() -> dict[str, list[dict[str, str]]]:
+        return ROWS
+
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
+    return app
+
+
+def test_serves_the_variant_accepted() -> None:
+    body = encode_json(ROWS)
+    client = TestClient(encoded_app(body))
+
+    r = client.get("/options", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert r.headers["Vary"] == "Accept-Encoding"
+    assert r.headers["ETag"] == '"etag"'
+    # Sent as cached, not compressed again by the middleware
+    assert int(r.headers["Content-Length"]) == len(body.variants["gzip"])
+    assert r.json() == ROWS
+
+    r = client.get("/options", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in r.headers
+    assert r.content == body.identity
+
+
+def test_uncached_responses_are_compressed_by_the_middleware() -> None:
+    client = TestClient(encoded_app(encode_json(ROWS)))
+
+    r = client.get("/uncached", headers={"Accept-Encoding": "gzip"})
+
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert r.json() == ROWS
@@ -0,0 +1,113 @@
+import json
+import os
+from pathlib import Path
+
+from app.core import metrics
+
+
+def test_text_exposition_format() -> None:
+    text = metrics.generate_latest(
+        [
+            {
+                "name": "requests_total",
+                "documentation": "Requests.",
+                "type": "counter",
+                "samples": [{"labels": {"route": 'a"b'}, "value": 2.0}],
+            },
+            {
+                "name": "latency_seconds",
+                "documentation": "Latency.",
+                "type": "histogram",
+                "samples": [
+                    {
+                        "labels": {},
+                        "buckets": {"0.1": 1, "+Inf": 2},
+                        "count": 2,
+                        "sum": 0.5,
+                    }
+                ],
+            },
+        ]
+    )
+
+    assert text.splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="a\\"b"} 2.0',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="+Inf"} 2',
+        "latency_seconds_sum 0.5",
+        "latency_seconds_count 2",
+    ]
+
+
+def test_collect_all_merges_the_other_workers(tmp_path: Path) -> None:
+    metrics.cache_requests.labels(cache="test-merge", result="hit").inc(3)
+    own = {metric["name"]: metric for metric in metrics.collect()}[
+        "db_pool_checked_out_connections"
+    ]["samples"]
+    # A worker that exited (no such pid), its gauges are left out
+    snapshot = [
+        {
+            "name": "cache_requests_total",
+            "type": "counter",
+            "samples": [
+                {"labels": {"cache": "test-merge", "result": "hit"}, "value": 2.0}
+            ],
+        },
+        {
+            "name": "db_pool_checked_out_connections",
+            "type": "gauge",
+            "samples": [{"labels": {"pool": "test-merge"}, "value": 5}],
+        },
+    ]
+    (tmp_path / "999999999-exited.json").write_text(json.dumps(snapshot))
+
+    for _ in range(2):
+        merged = {
+            metric["name"]: metric for metric in metrics.collect_all(str(tmp_path))
+        }
+
+        # Counted once, from the archive the second time
+        assert {"labels": {"cache": "test-merge", "result": "hit"}, "value": 5.0} in (
+            merged["cache_requests_total"]["samples"]
+        )
+        assert merged["db_pool_checked_out_connections"]["samples"] == own
+    # The snapshot of the exited worker was folded into the archive
+    assert not (tmp_path / "999999999-exited.json").exists()
+    assert (tmp_path / metrics.ARCHIVE_NAME).exists()
+
+
+def test_archive_skips_the_snapshots_already_folded(tmp_path: Path) -> None:
+    snapshot = [
+        {
+            "name": "cache_requests_total",
+            "type": "counter",
+            "samples": [
+                {"labels": {"cache": "test-archive", "result": "hit"}, "value": 2.0}
+            ],
+        },
+    ]
+    (tmp_path / "999999999-exited.json").write_text(json.dumps(snapshot))
+    metrics.archive_exited(str(tmp_path))
+    # As if the previous run was interrupted before deleting it
+    (tmp_path / "999999999-exited.json").write_text(json.dumps(snapshot))
+    metrics.archive_exited(str(tmp_path))
+
+    archive = json.loads((tmp_path / metrics.ARCHIVE_NAME).read_text())
+    (counter,) = archive["metrics"]
+    assert counter["samples"] == [
+        {"labels": {"cache": "test-archive", "result": "hit"}, "value": 2.0}
+    ]
+
+
+def test_write_snapshot(tmp_path: Path) -> None:
+    metrics.write_snapshot(str(tmp_path))
+
+    (path,) = tmp_path.iterdir()
+    assert path.name.startswith(f"{os.getpid()}-")
+    assert [metric["name"] for metric in json.loads(path.read_text())] == [
+        metric.name for metric in metrics.REGISTRY
+    ]
@@ -0,0 +1,29 @@
+from typing import Any
+from unittest.mock import MagicMock
+
+from app.core.metrics import Counter, Histogram, db_pool_checkout_wait, db_pool_overflow
+from app.core.pool import InstrumentedQueuePool
+
+
+def get_sample(metric: Counter | Histogram, pool_name: str) -> dict[str, Any]:
+    return next(
+        sample
+        for sample in metric.collect()["samples"]
+        if sample["labels"] == {"pool": pool_name}
+    )
+
+
+def test_pool_records_checkouts_and_overflow() -> None:
+    pool = InstrumentedQueuePool(
+        creator=MagicMock, pool_size=1, max_overflow=2, logging_name="test-pool"
+    )
+
+    first = pool.connect()
+    assert "test-pool" not in str(db_pool_overflow.collect())
+
+    second = pool.connect()
+    assert get_sample(db_pool_overflow, "test-pool")["value"] == 1
+    assert get_sample(db_pool_checkout_wait, "test-pool")["count"] == 2
+
+    first.close()
+    second.close()
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from starlette.requests import Request
+
+from app.core.rate_limit import (
+    MemoryBucketStore,
+    SqliteBucketStore,
+    client_address,
+    take_token,
+)
+
+
+def test_take_token_refills_over_time() -> None:
+    (tokens, wait) = take_token(None, 0.0, capacity=2, per_second=1, now=0.0)
+    assert (tokens, wait) == (1, 0.0)
+    (tokens, wait) = take_token(0.0, 0.0, capacity=2, per_second=1, now=0.5)
+    assert wait == 0.5
+    (tokens, wait) = take_token(0.0, 0.0, capacity=2, per_second=1, now=10.0)
+    # Never more than the capacity
+    assert (tokens, wait) == (1, 0.0)
+
+
+def test_memory_store_rejects_past_the_burst() -> None:
+    store = MemoryBucketStore()
+    waits = [store.take("ip:10.0.0.1", 3, 0.01) for _ in range(4)]
+
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] > 0
+    # Other keys have their own bucket
+    assert store.take("ip:10.0.0.2", 3, 0.01) == 0.0
+
+
+def test_sqlite_store_is_shared(tmp_path: Path) -> None:
+    path = str(tmp_path / "buckets.sqlite")
+    # Two stores over the same file, like two workers
+    stores = [SqliteBucketStore(path), SqliteBucketStore(path)]
+
+    with ThreadPoolExecutor(4) as executor:
+        waits = list(
+            executor.map(
+                lambda i: stores[i % 2].take("account:a@example.com", 5, 0.01), range(8)
+            )
+        )
+
+    assert sum(wait == 0.0 for wait in waits) == 5
+
+
+def forwarded_request(peer: str, forwarded_for: str | None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded_for.encode())] if forwarded_for else []
+    return Request({"type": "http", "client": (peer, 1234), "headers": headers})
+
+
+def test_client_address_behind_trusted_proxies() -> None:
+    # Straight from the client, its X-Forwarded-For is ignored
+    assert client_address(forwarded_request("203.0.113.7", "10.9.8.7")) == "203.0.113.7"
+    # Through the proxy
+    assert (
+        client_address(forwarded_request("127.0.0.1", "203.0.113.7")) == "203.0.113.7"
+    )
+    # The hops made up by the client, left of what the proxy appended, are skipped
+    assert (
+        client_address(forwarded_request("127.0.0.1", "10.9.8.7, 203.0.113.7"))
+        == "203.0.113.7"
+    )
+    assert client_address(forwarded_request("127.0.0.1", None)) == "127.0.0.1"
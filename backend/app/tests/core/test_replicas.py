@@ -0,0 +1,46 @@
+import time
+from typing import Any, cast
+from unittest.mock import MagicMock
+
+from app.core.replicas import ReadReplicaRouter
+
+
+def create_router(lags: list[float], **kwargs: Any) -> ReadReplicaRouter:
+    router = ReadReplicaRouter(
+        primary=MagicMock(name="primary"),
+        replicas=[MagicMock(name=f"replica-{i}") for i in range(len(lags))],
+        max_lag_seconds=5.0,
+        **kwargs,
+    )
+    # Pretend the lag was just measured, so no check is scheduled
+    router._lag = list(lags)
+    router._checked_at = [time.monotonic()] * len(lags)
+    return router
+
+
+def test_without_replicas_uses_primary() -> None:
+    router = ReadReplicaRouter(primary=MagicMock(), replicas=[])
+    assert router.choose() is router.primary
+
+
+def test_round_robin_skips_lagging_replicas() -> None:
+    router = create_router([0.0, 60.0, 1.0])
+    chosen = [router.choose() for _ in range(4)]
+    assert chosen == [router.replicas[0], router.replicas[2]] * 2
+
+
+def test_falls_back_to_primary_when_all_replicas_lag() -> None:
+    router = create_router([10.0, 60.0])
+    assert router.choose() is router.primary
+
+
+def test_read_your_writes_uses_primary() -> None:
+    router = create_router([0.0])
+    assert router.choose(prefer_primary=True) is router.primary
+
+
+def test_least_connections() -> None:
+    router = create_router([0.0, 0.0], selection="least_connections")
+    cast(MagicMock, router.replicas[0].pool).checkedout.return_value = 4
+    cast(MagicMock, router.replicas[1].pool).checkedout.return_value = 1
+    assert router.choose() is router.replicas[1]
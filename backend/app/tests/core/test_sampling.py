@@ -0,0 +1,40 @@
+import random
+
+from app.core.sampling import estimate_distinct_count
+
+
+def sample_pages(
+    pages_per_equipment: list[int], percent: float, seed: int
+) -> list[int]:
+    # Each equipment has rows in that many pages, each page kept with
+    # probability percent, as TABLESAMPLE SYSTEM does
+    generator = random.Random(seed)
+    pages_seen = [
+        sum(1 for _ in range(pages) if generator.random() < percent / 100)
+        for pages in pages_per_equipment
+    ]
+    return [pages for pages in pages_seen if pages]
+
+
+def test_rare_equipment_missed_by_the_sample_are_estimated() -> None:
+    # Half of the equipment only wrote in a few pages of the range
+    pages_per_equipment = [200] * 500 + [5] * 500
+
+    errors = []
+    for seed in range(20):
+        pages_seen = sample_pages(pages_per_equipment, 10.0, seed)
+        (estimate, relative_error) = estimate_distinct_count(pages_seen, 10.0)
+        assert len(pages_seen) < estimate
+        errors.append(abs(estimate - 1000) / (relative_error * estimate))
+
+    # Within 2 standard errors most of the time
+    assert sum(1 for error in errors if error < 2) >= 15
+
+
+def test_no_extrapolation_when_every_equipment_is_seen_often() -> None:
+    assert estimate_distinct_count([10, 20, 30], 10.0) == (3.0, 0.0)
+
+
+def test_whole_table_sampled() -> None:
+    assert estimate_distinct_count([1, 1, 2], 100.0) == (3.0, 0.0)
+    assert estimate_distinct_count([], 1.0) == (0.0, 0.0)
@@ -0,0 +1,74 @@
+import asyncio
+
+from app.core.metrics import dashboard_query_coalesced
+from app.core.single_flight import SingleFlight
+
+
+def test_concurrent_identical_calls_share_result() -> None:
+    single_flight = SingleFlight()
+    executions = []
+
+    async def query() -> list[int]:
+        executions.append(1)
+        await asyncio.sleep(0.05)
+        return [1, 2, 3]
+
+    async def run() -> list[list[int]]:
+        return await asyncio.gather(
+            *[single_flight.do(("test-query",), query) for _ in range(5)]
+        )
+
+    results = asyncio.run(run())
+
+    assert len(executions) == 1
+    assert results == [[1, 2, 3]] * 5
+    assert any(
+        sample["labels"] == {"query": "test-query"} and sample["value"] == 4
+        for sample in dashboard_query_coalesced.collect()["samples"]
+    )
+
+
+def test_calls_after_completion_are_executed_again() -> None:
+    single_flight = SingleFlight()
+    executions = []
+
+    async def query() -> int:
+        executions.append(1)
+        return len(executions)
+
+    async def run() -> tuple[int, int]:
+        first = await single_flight.do(("other-query",), query)
+        second = await single_flight.do(("other-query",), query)
+        return (first, second)
+
+    assert asyncio.run(run()) == (1, 2)
+
+
+def test_call_is_cancelled_when_every_caller_is() -> None:
+    single_flight = SingleFlight()
+    cancelled = []
+
+    async def query() -> None:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def run() -> None:
+        callers = [
+            asyncio.ensure_future(single_flight.do(("slow-query",), query))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0.01)
+
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled
+
+        callers[1].cancel()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+
+    assert cancelled == [1]
@@ -0,0 +1,58 @@
+import time
+from unittest.mock import patch
+
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.core.db import engine
+from app.core.slow_queries import SlowQuery, SlowQueryLog, slow_query_log
+
+
+def wait_for_plan(entry: SlowQuery, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while (
+        entry.plan is None and entry.plan_error is None and time.monotonic() < deadline
+    ):
+        time.sleep(0.01)
+
+
+def test_slow_select_is_recorded_and_explained() -> None:
+    slow_query_log.clear()
+    with (
+        patch("app.core.config.settings.SLOW_QUERY_THRESHOLD_SECONDS", 0.05),
+        patch("app.core.config.settings.SLOW_QUERY_EXPLAIN", True),
+        patch("app.core.config.settings.SLOW_QUERY_LOG_PARAMETERS", True),
+    ):
+        with Session(engine) as session:
+            session.execute(
+                text("SELECT pg_sleep(0.06), :marker"), {"marker": "slow-test"}
+            )
+            session.execute(text("SELECT 1"))
+
+        (entry,) = slow_query_log.entries()
+        wait_for_plan(entry)
+
+    assert entry.route == "background"
+    assert entry.duration_seconds >= 0.05
+    assert "pg_sleep" in entry.statement
+    assert entry.parameters and "slow-test" in entry.parameters
+    assert entry.plan_error is None
+    assert entry.plan[0]["Plan"]["Actual Rows"] == 1
+
+
+def test_writes_are_not_explained() -> None:
+    log = SlowQueryLog(maxsize=2)
+    with patch("app.core.config.settings.SLOW_QUERY_EXPLAIN", True):
+        for _ in range(3):
+            entry = log.record(
+                statement="DELETE FROM sensor_data",
+                parameters={},
+                route="test",
+                duration_seconds=2.0,
+                operation="DELETE",
+                executemany=False,
+            )
+
+    assert entry.plan is None and entry.plan_error is None
+    # Bounded, newest first
+    assert [entry.id for entry in log.entries()] == [3, 2]
@@ -0,0 +1,25 @@
+import json
+import subprocess
+import sys
+
+from app.benchmarks.startup import LAZY_MODULES
+
+# Only what the app imports is checked, the time it takes depends on the
+# machine: see app/benchmarks/startup.py --compare for that.
+
+
+def test_app_import_doesnt_load_the_lazy_modules() -> None:
+    # In a fresh interpreter, the tests already imported everything here
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import json, sys, app.main; print(json.dumps(sorted(sys.modules)))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = json.loads(result.stdout.splitlines()[-1])
+
+    assert [module for module in [*LAZY_MODULES, "numpy"] if module in modules] == []
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+from sqlalchemy import exc, text
+from sqlmodel import Session
+
+from app.core.db import engine
+from app.core.timeouts import (
+    database_error_handler,
+    is_statement_timeout,
+    set_statement_timeout,
+)
+from app.main import app
+
+
+def test_statement_timeout_cancels_slow_queries() -> None:
+    with Session(engine) as session:
+        set_statement_timeout(session, 0.05)
+        with pytest.raises(exc.OperationalError) as error:
+            session.execute(text("SELECT pg_sleep(1)"))
+
+    assert is_statement_timeout(error.value)
+
+
+def test_statement_timeout_is_per_transaction() -> None:
+    with Session(engine) as session:
+        set_statement_timeout(session, 5)
+        assert session.execute(text("SHOW statement_timeout")).one()[0] == "5s"
+
+    # Another session on the same pooled connection isn't affected
+    with Session(engine) as session:
+        assert session.execute(text("SHOW statement_timeout")).one()[0] == "0"
+
+
+def test_other_database_errors_are_not_handled() -> None:
+    assert app.exception_handlers[exc.OperationalError] is database_error_handler
+    assert exc.DBAPIError not in app.exception_handlers
+
+    with Session(engine) as session:
+        with pytest.raises(exc.OperationalError) as error:
+            session.execute(
+                text("SELECT * FROM pg_terminate_backend(pg_backend_pid())")
+            )
+
+    assert not is_statement_timeout(error.value)
+    # Re-raised, so it reaches the default 500
+    with pytest.raises(exc.OperationalError):
+        asyncio.run(database_error_handler(None, error.value))  # type: ignore[arg-type]
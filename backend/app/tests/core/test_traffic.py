@@ -0,0 +1,78 @@
+import base64
+import json
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from app.core import traffic
+from app.core.config import settings
+from app.core.traffic import TrafficRecorder, TrafficRecordingMiddleware
+
+
+class Reading(BaseModel):
+    value: float
+
+
+def recording_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.post(f"{settings.API_V1_STR}/sensor-data/", status_code=201)
+    def create(reading: Reading) -> Reading:
+        return reading
+
+    @app.post(f"{settings.API_V1_STR}/login/access-token")
+    def login() -> dict[str, str]:
+        return {"access_token": "token"}
+
+    app.add_middleware(TrafficRecordingMiddleware)
+    return app
+
+
+def test_records_the_requests_of_the_recorded_paths(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    recorder = TrafficRecorder(str(tmp_path))
+    monkeypatch.setattr(traffic, "traffic_recorder", recorder)
+
+    with TestClient(recording_app()) as client:
+        client.post(
+            f"{settings.API_V1_STR}/sensor-data/?source=test",
+            json={"value": 1.5},
+            headers={"Authorization": "Bearer secret"},
+        )
+        client.post(
+            f"{settings.API_V1_STR}/login/access-token",
+            data={"username": "user", "password": "secret"},
+        )
+    recorder.close()
+
+    [file] = tmp_path.glob("*.jsonl")
+    [entry] = [json.loads(line) for line in file.read_text().splitlines()]
+    assert entry["method"] == "POST"
+    assert entry["path"] == f"{settings.API_V1_STR}/sensor-data/"
+    assert entry["query"] == "source=test"
+    assert entry["status"] == 201
+    assert entry["content_type"] == "application/json"
+    assert json.loads(base64.b64decode(entry["body"])) == {"value": 1.5}
+    assert entry["duration"] > 0
+    assert "secret" not in file.read_text()
+
+
+def test_leaves_large_bodies_out(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    recorder = TrafficRecorder(str(tmp_path))
+    monkeypatch.setattr(traffic, "traffic_recorder", recorder)
+    monkeypatch.setattr(settings, "TRAFFIC_RECORD_MAX_BODY_BYTES", 10)
+
+    with TestClient(recording_app()) as client:
+        client.post(f"{settings.API_V1_STR}/sensor-data/", json={"value": 123456789.0})
+    recorder.close()
+
+    [file] = tmp_path.glob("*.jsonl")
+    entry = json.loads(file.read_text())
+    assert entry["body"] is None
+    assert entry["body_omitted"] is True
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.core.db import engine
+from app.core.user_cache import TTLCache, UserCacheListener
+from app.tests.utils.user import create_random_user
+
+
+def test_cache_evicts_least_recently_used() -> None:
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_cache_entries_expire() -> None:
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=0.01)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+
+
+def test_cache_ignores_values_read_before_an_invalidation() -> None:
+    cache = TTLCache(maxsize=2, ttl=60)
+    version = cache.version
+    cache.invalidate("a")
+    cache.set("a", "stale", version=version)
+
+    assert cache.get("a") is None
+
+
+def test_listener_invalidates_users_updated_elsewhere(db: Session) -> None:
+    user = create_random_user(db)
+    user_id = str(user.id)
+    cache = TTLCache(maxsize=10, ttl=60, enabled=False)
+    dsn = str(settings.SQLALCHEMY_DATABASE_URI).replace("+psycopg", "")
+
+    async def run() -> None:
+        listener_task = asyncio.create_task(UserCacheListener(cache, dsn).run())
+        while not cache.enabled:
+            await asyncio.sleep(0.01)
+        cache.set(user_id, {"id": user_id})
+
+        # Plain SQL, as another worker or a script would
+        with Session(engine) as session:
+            session.execute(
+                text('UPDATE "user" SET full_name = :name WHERE id = :id'),
+                {"name": "Renamed", "id": user_id},
+            )
+            session.commit()
+
+        for _ in range(100):
+            if cache.get(user_id) is None:
+                break
+            await asyncio.sleep(0.01)
+        listener_task.cancel()
+
+    asyncio.run(run())
+
+    assert cache.get(user_id) is None
@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import async_crud, crud
+from app.core.cache import truncate_to_hour
+from app.core.config import settings
+from app.models import SensorDataCreate, SensorDataHourWatermark
+from app.tests.utils.utils import random_lower_string
+
+
+def test_split_interval() -> None:
+    begin = datetime(2024, 1, 1)
+    bounds = async_crud.split_interval(begin, begin + timedelta(days=4), 4)
+
+    assert bounds[0] == (begin, begin + timedelta(days=1))
+    assert bounds[-1] == (begin + timedelta(days=3), begin + timedelta(days=4))
+    assert len(bounds) == 4
+
+
+def test_parallel_average_matches_serial(db: Session) -> None:
+    equipment_ids = [random_lower_string() for _ in range(3)]
+    now = datetime.today()
+    for index, equipment_id in enumerate(equipment_ids):
+        for days in range(0, 30, 3):
+            crud.create_sensor_data(
+                session=db,
+                sensor_create_data=SensorDataCreate(
+                    equipment_id=equipment_id,
+                    timestamp=now - timedelta(days=days),
+                    value=index + days,
+                ),
+            )
+
+    Averages = tuple[int, list[dict[str, Any]]]
+
+    async def run() -> tuple[Averages, Averages]:
+        # Connections of an async engine are bound to their event loop
+        engine = create_async_engine(
+            str(settings.SQLALCHEMY_DATABASE_URI), poolclass=NullPool
+        )
+        begin = now - timedelta(days=31)
+        async with AsyncSession(engine) as session:
+            serial = await async_crud.get_average_by_equipment(
+                session=session, begin=begin, end=now, equipment_ids=equipment_ids
+            )
+            parallel = await async_crud.get_average_by_equipment_parallel(
+                slices=4,
+                session=session,
+                begin=begin,
+                end=now,
+                equipment_ids=equipment_ids,
+            )
+        await engine.dispose()
+        return (serial, parallel)
+
+    ((serial_count, serial_rows), (parallel_count, parallel_rows)) = asyncio.run(run())
+
+    assert parallel_count == serial_count
+    assert [row["equipment_id"] for row in parallel_rows] == sorted(equipment_ids)
+    for serial_row, parallel_row in zip(serial_rows, parallel_rows, strict=True):
+        assert abs(serial_row["avg"] - parallel_row["avg"]) < 1e-9
+
+
+def test_old_hour_watermarks_are_deleted(db: Session) -> None:
+    equipment_id = random_lower_string()
+    now = datetime.today()
+    for days in (0, 10):
+        crud.create_sensor_data(
+            session=db,
+            sensor_create_data=SensorDataCreate(
+                equipment_id=equipment_id,
+                timestamp=now - timedelta(days=days),
+                value=1.0,
+            ),
+        )
+
+    async def run() -> int:
+        engine = create_async_engine(
+            str(settings.SQLALCHEMY_DATABASE_URI), poolclass=NullPool
+        )
+        async with AsyncSession(engine) as session:
+            deleted = await async_crud.delete_old_hour_watermarks(
+                session=session, before=now - timedelta(days=7)
+            )
+        await engine.dispose()
+        return deleted
+
+    # The writes themselves don't prune anything
+    assert asyncio.run(run()) >= 1
+    hours = db.exec(
+        select(SensorDataHourWatermark.hour).where(
+            SensorDataHourWatermark.equipment_id == equipment_id
+        )
+    ).all()
+    assert hours == [truncate_to_hour(now)]
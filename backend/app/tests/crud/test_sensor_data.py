@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+from sqlmodel import Session
+
+from app import crud
+from app.models import SensorDataCreate
+from app.tests.utils.utils import random_lower_string
+
+
+def test_hot_queries_reuse_the_same_statement() -> None:
+    end = datetime.today()
+    begin = end - timedelta(hours=24)
+
+    (one, one_params) = crud.average_by_equipment_query(begin, end, ["a"])
+    (three, three_params) = crud.average_by_equipment_query(begin, end, ["a", "b", "c"])
+
+    # Same statement object, hence the same SQL text whatever the number of ids
+    assert one is three
+    assert one_params["equipment_ids"] == ["a"]
+    assert three_params["equipment_ids"] == ["a", "b", "c"]
+    assert crud.hourly_averages_query(begin, end)[0] is crud.HOURLY_AVERAGES
+
+
+def test_get_average_by_equipment_filtered(db: Session) -> None:
+    equipment_ids = [random_lower_string(), random_lower_string()]
+    for equipment_id, value in zip(equipment_ids, [1.0, 3.0], strict=True):
+        crud.create_sensor_data(
+            session=db,
+            sensor_create_data=SensorDataCreate(
+                equipment_id=equipment_id, timestamp=datetime.today(), value=value
+            ),
+        )
+
+    (_, rows) = crud.get_average_by_equipment(
+        session=db,
+        begin=datetime.today() - timedelta(hours=1),
+        end=datetime.today() + timedelta(minutes=1),
+        equipment_ids=equipment_ids,
+    )
+
+    assert sorted(rows, key=lambda row: row["avg"]) == [
+        {"equipment_id": equipment_ids[0], "avg": 1.0},
+        {"equipment_id": equipment_ids[1], "avg": 3.0},
+    ]
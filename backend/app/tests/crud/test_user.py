@@ -1,7 +1,9 @@
 from fastapi.encoders import jsonable_encoder
+from passlib.context import CryptContext
 from sqlmodel import Session
 
 from app import crud
+from app.core.config import settings
 from app.core.security import verify_password
 from app.models import User, UserCreate, UserUpdate
 from app.tests.utils.utils import random_email, random_lower_string
@@ -89,3 +91,25 @@ def test_update_user(db: Session) -> None:
     assert user_2
     assert user.email == user_2.email
     assert verify_password(new_password, user_2.hashed_password)
+
+
+def test_authenticate_rehashes_outdated_password_hash(db: Session) -> None:
+    email = random_email()
+    password = random_lower_string()
+    user = crud.create_user(
+        session=db, user_create=UserCreate(email=email, password=password)
+    )
+    # Made with another cost than PASSWORD_HASH_ROUNDS
+    user.hashed_password = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash(
+        password
+    )
+    db.add(user)
+    db.commit()
+
+    authenticated_user = crud.authenticate(session=db, email=email, password=password)
+
+    assert authenticated_user
+    assert authenticated_user.hashed_password.startswith(
+        f"$2b${settings.PASSWORD_HASH_ROUNDS:02d}$"
+    )
+    assert verify_password(password, authenticated_user.hashed_password)
@@ -0,0 +1,61 @@
+import numpy as np
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.load_synthetic_data import (
+    SyntheticSeries,
+    delete_series,
+    equipment_profiles,
+    generate_window,
+    load,
+)
+from app.models import SensorData
+from app.tests.utils.utils import random_lower_string
+
+
+def test_generate_window_is_deterministic_and_in_time_order() -> None:
+    series = SyntheticSeries(equipment=20, interval_seconds=60, days=1, gap_rate=0)
+    profiles = equipment_profiles(series)
+
+    (equipment, seconds, values) = generate_window(series, profiles, 0, series.steps)
+    (_, _, again) = generate_window(series, profiles, 0, series.steps)
+
+    assert len(values) == 20 * 1440
+    assert np.array_equal(values, again)
+    for index in range(20):
+        assert np.all(np.diff(seconds[equipment == index]) > 0)
+    # Around each baseline, spikes included
+    assert np.all(
+        np.abs(values - profiles["baseline"][equipment])
+        < profiles["baseline"][equipment]
+    )
+
+
+def test_generate_window_leaves_gaps() -> None:
+    series = SyntheticSeries(
+        equipment=20, interval_seconds=60, days=1, gap_rate=5, gap_minutes=60
+    )
+
+    (_, _, values) = generate_window(
+        series, equipment_profiles(series), 0, series.steps
+    )
+
+    assert len(values) < 20 * 1440
+
+
+def test_load_copies_every_generated_row(db: Session) -> None:
+    series = SyntheticSeries(
+        equipment=3, interval_seconds=60, days=1, prefix=f"{random_lower_string()}-"
+    )
+
+    rows = load(series, workers=1, rows_per_copy=1000)
+
+    (count, first, last) = db.exec(
+        select(
+            func.count(), func.min(SensorData.timestamp), func.max(SensorData.timestamp)
+        ).where(SensorData.equipment_id.startswith(series.prefix))
+    ).one()
+    assert count == rows
+    assert series.start <= first < last <= series.end
+
+    assert delete_series(series) == rows
@@ -1,28 +1,33 @@
 from io import StringIO
-import pandas as pd
 import logging
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from fastapi import UploadFile
+from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
-import emails  # type: ignore
 import jwt
-from jinja2 import Template
 from jwt.exceptions import InvalidTokenError
 
 from app.core.config import settings
 from app.models import SensorDataFetchMode, SensorDataDashboardFetch
 
+# pandas, emails and jinja2 are imported on first use: every router imports
+# this module, and they would make up a good part of each worker's startup
+# time and memory (see app/benchmarks/startup.py)
+if TYPE_CHECKING:
+    from emails.backend import SMTPBackend  # type: ignore
+    from jinja2 import Template
+
 
 @dataclass
 class EmailData:
     html_content: str
     subject: str
 
-async def read_csv_sensor_data_file(sensor_data_csv_file: UploadFile):
-    contents = sensor_data_csv_file.file.read()
+def parse_csv_sensor_data_file(contents: bytes) -> list[dict[str, Any]]:
+    import pandas as pd
+
     data = StringIO(str(contents,'utf-8')) 
     df = pd.read_csv(data)
 
@@ -69,36 +74,55 @@ def get_data_interval(fetch_data: SensorDataDashboardFetch):
     return (begin_date, end_date)
 
 
-def render_email_template(*, template_name: str, context: dict[str, Any]) -> str:
+@lru_cache
+def get_email_template(template_name: str) -> "Template":
+    from jinja2 import Template
+
+    # Compiled once per worker, the built templates only change on deploys
     template_str = (
         Path(__file__).parent / "email-templates" / "build" / template_name
     ).read_text()
-    html_content = Template(template_str).render(context)
+    return Template(template_str)
+
+
+def render_email_template(*, template_name: str, context: dict[str, Any]) -> str:
+    html_content = get_email_template(template_name).render(context)
     return html_content
 
 
+def get_smtp_options() -> dict[str, Any]:
+    smtp_options = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
+    if settings.SMTP_TLS:
+        smtp_options["tls"] = True
+    elif settings.SMTP_SSL:
+        smtp_options["ssl"] = True
+    if settings.SMTP_USER:
+        smtp_options["user"] = settings.SMTP_USER
+    if settings.SMTP_PASSWORD:
+        smtp_options["password"] = settings.SMTP_PASSWORD
+    return smtp_options
+
+
 def send_email(
     *,
     email_to: str,
     subject: str = "",
     html_content: str = "",
+    smtp: "SMTPBackend | None" = None,
 ) -> None:
+    """
+    Sends the email right away, through the given SMTP connection if any. The
+    request handlers enqueue their emails instead, see crud.enqueue_email.
+    """
+    import emails  # type: ignore
+
     assert settings.emails_enabled, "no provided configuration for email variables"
     message = emails.Message(
         subject=subject,
         html=html_content,
         mail_from=(settings.EMAILS_FROM_NAME, settings.EMAILS_FROM_EMAIL),
     )
-    smtp_options = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
-    if settings.SMTP_TLS:
-        smtp_options["tls"] = True
-    elif settings.SMTP_SSL:
-        smtp_options["ssl"] = True
-    if settings.SMTP_USER:
-        smtp_options["user"] = settings.SMTP_USER
-    if settings.SMTP_PASSWORD:
-        smtp_options["password"] = settings.SMTP_PASSWORD
-    response = message.send(to=email_to, smtp=smtp_options)
+    response = message.send(to=email_to, smtp=smtp or get_smtp_options())
     logging.info(f"send email result: {response}")
 
 
@@ -1,5 +1,11 @@
 #! /usr/bin/env bash
 
+# Forget the metrics of the previous workers
+if [ -n "$METRICS_MULTIPROC_DIR" ]; then
+    mkdir -p "$METRICS_MULTIPROC_DIR"
+    rm -f "$METRICS_MULTIPROC_DIR"/*.json
+fi
+
 # Let the DB start
 python /app/app/backend_pre_start.py
 